@@ -262,9 +262,6 @@ class CLI(threading.Thread):
 
                 action_name, params = action_raw.split(' ', 1)
 
-                if not action_name.startswith('^'):
-                    action_name = '^' + action_name
-
                 try:
                     py_params = eval(params, {}, {}) # convert user input to py variables in list
                 except SyntaxError:
@@ -1,15 +1,18 @@
 from .util import base64_decode, base64_encode
 from .encoding import encode as m_encode
 from .encoding import decode as m_decode
+from .encoding import decode_lazy as m_decode_lazy
+from .encoding import decode_at as m_decode_at
 
 from .exceptions import ExceptionWithResponse, DecodingError
+from .routing import ROUTE_SEPARATOR, route_destination
 
 from nacl.utils import random  as nacl_random
 
+import struct
 
-class RespCode():
-    # IDEA make values shorter, even int/byte
 
+class RespCode():
     ACK = b'ACK' # 10
     OK = b'OK' # 11
 
@@ -22,6 +25,10 @@ class RespCode():
 
     codes = [ACK, OK, BDSIG, PRSER, DENID, NAK, NUKER]
 
+    # wire format 0.2 sends a code as one byte (0 being no code)
+    to_byte = {ACK: 10, OK: 11, BDSIG: 20, PRSER: 21, DENID: 22, NAK: 30, NUKER: 31}
+    from_byte = {v: k for k, v in to_byte.items()}
+
     # ?? 'Unknown node address, unable to verify.'
 
     # human friendly helpers ?
@@ -30,13 +37,31 @@ class RespCode():
     # DENIED = DENID
 
 class TransmittableBroadcast:
-    """A struct containing the ready to go `data` bytes and its assosiated `broadcast` object"""
+    """A struct containing the ready to go `data` bytes and its assosiated `broadcast` object
 
-    __slots__ = 'data', 'broadcast'
+    May instead be made from the `plain` (encoded) broadcast and a `make_data`
+    callback (signing and encrypting it), called when `data` is first used;
+    so a plain broadcast can be put in a container without that cost.
+    For a container `broadcast` is the list of broadcasts in it.
+    """
 
-    def __init__(self, raw_data:bytes, assosiated_broadcast):
-        self.data = raw_data
+    __slots__ = '_data', 'broadcast', 'plain', '_make_data'
+
+    def __init__(self, raw_data:bytes, assosiated_broadcast, plain:bytes=None, make_data=None):
+        self._data = raw_data
         self.broadcast = assosiated_broadcast
+        self.plain = plain
+        self._make_data = make_data
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._make_data(self.plain)
+        return self._data
+
+    @data.setter
+    def data(self, val):
+        self._data = val
 
 # class DiscoveryTransmittableBroadcast(TransmittableBroadcast):
 #     def __init__(self, raw_data:bytes):
@@ -45,9 +70,14 @@ class TransmittableBroadcast:
 
 class Payload():
 
-    def __init__(self, raw_bytes=None):
+    def __init__(self, raw_bytes=None, load_raw_bytes=None):
+        """
+        :load_raw_bytes: callback returning the raw bytes when first needed
+            (i.e. decrypt), used instead of `raw_bytes`.
+        """
 
-        self.raw_bytes = raw_bytes
+        self.__raw_bytes = raw_bytes
+        self.__load_raw_bytes = load_raw_bytes
 
         # filled up if kind == REQ
         self.__request_prop_names = None # []
@@ -56,6 +86,19 @@ class Payload():
         self.__resp_annc_obj = None # {} use with RESP and ANNC to make payload
 
 
+    @property
+    def raw_bytes(self):
+        if self.__load_raw_bytes is not None:
+            self.__raw_bytes = self.__load_raw_bytes()
+            self.__load_raw_bytes = None
+        return self.__raw_bytes
+
+    @raw_bytes.setter
+    def raw_bytes(self, val):
+        self.__raw_bytes = val
+        self.__load_raw_bytes = None
+
+
     @property
     def request_prop_names(self):
         if self.__request_prop_names == None:
@@ -83,11 +126,14 @@ class Payload():
         """The object contained in the payload of a resp or annc broadcast.
         Decodes payload there is one, will raise DecodingError if can't decode;
         returns None if there is no raw_payload
+
+        A dict payload is a `LazyDict` (a `Mapping`), its values are decoded
+        when accessed.
         """
 
-        if self.__resp_annc_obj == None:
+        if self.__resp_annc_obj is None:
             if self.raw_bytes != None:
-                self.__resp_annc_obj = m_decode(self.raw_bytes)
+                self.__resp_annc_obj = m_decode_lazy(self.raw_bytes)
 
 
         return self.__resp_annc_obj
@@ -119,35 +165,41 @@ class Payload():
             return None
 
         data = self.raw_bytes
+        size = len(data)
+        pos = 0 # cursor, start of the next property or action
 
-        while data != b'':
-            if data[0] == ord('^'): # action
-                name_end = data.find(b'(')
-                args_end = data.find(b')')
-
-                if name_end == -1 or args_end == -1:
+        while pos < size:
+            if data[pos] == 94: # '^' action
+                name_end = data.find(b'(', pos)
+                if name_end == -1:
                     raise ExceptionWithResponse(RespCode.PRSER, 'Expected start of action arguments.')
-                if args_end == -1:
-                    raise ExceptionWithResponse(RespCode.PRSER, 'Expected end of action arguments.')
 
+                name = data[pos+1:name_end].decode('utf-8')
+
+                # arguments are decoded in place, so may contain any bytes (e.g. ')')
+                args_list = []
+                pos = name_end + 1
+                while pos < size and data[pos] != 41: # ')'
+                    arg, pos = m_decode_at(data, pos)
+                    args_list.append(arg)
 
-                name = data[1:name_end].decode('utf-8')
-                args_list = m_decode(b'l%s;' % data[name_end+1:args_end]) # fake a list for easy decoding
+                if pos >= size:
+                    raise ExceptionWithResponse(RespCode.PRSER, 'Expected end of action arguments.')
 
                 self.__request_actions[name] = args_list # add
 
-                data = data[args_end+2:]
+                pos += 2 # skip ')' and ','
 
             else: # property
-                name_end = data.find(b',') # anther act/prop or end of data(-1)
+                name_end = data.find(b',', pos) # anther act/prop or end of data(-1)
                 if name_end == -1:
-                    name_end = len(data) # ensures full name and proper ending
+                    name_end = size # ensures full name and proper ending
 
-                name = data[:name_end].decode('utf-8')
+                name = data[pos:name_end].decode('utf-8')
 
                 self.__request_prop_names.append(name) # add
 
-                data = data[name_end+1:]
+                pos = name_end + 1
 
 
 
@@ -156,22 +208,39 @@ class Payload():
 
 class Broadcast():
 
-    def __init__(self, kind, frm, to, annc_result=None, resp_code=None, raw_payload=None):
+    VERSIONS = {'0.1': b'\x00\x01', '0.2': b'\x00\x02'}
+
+    # 0.2: v(2) nonce(4) kind(1) code(1) and the lengths of to(1), frm(1),
+    #   annc result or reply to(1) and payload(2); followed by those four
+    _HEADER_V02 = struct.Struct('!2s4sBBBBBH')
+
+    KIND_BYTES = {'REQ': 1, 'ANNC': 2, 'RESP': 3, 'RREQ': 4, 'RREP': 5, 'RERR': 6}
+    KINDS_BY_BYTE = {1: b'REQ', 2: b'ANNC', 3: b'RESP', 4: b'RREQ', 5: b'RREP', 6: b'RERR'}
+
+    # route request, reply, and error (see `Node.discover_route`), 0.2 only
+    ROUTE_KINDS = ('RREQ', 'RREP', 'RERR')
+
+    RAW_PAYLOAD = 0x80 # set in the 0.2 kind byte, the payload is not base64
+
+    def __init__(self, kind, frm, to, annc_result=None, resp_code=None, raw_payload=None, reply_to=None):
         """Represents, decodes, and encodes the various kinds of broadcasts.
 
         :kind: kind of broadcast (e.g. 'REQ')
         :frm: from node
-        :to: destination node, group or all ('*')
+        :to: destination node, group or all ('*'); a node may be given
+            with its source route: the addresses between, joined by '>'
         :annc_result: applicable for 'REQ' only --
             if the reciver node should announce the result of the request.
         :resp_code: applicable for 'RESP' only,
             use of RespCode.xxx recomended (RespCode.ACK)
         :raw_payload: write a custom broadcast payload (NOT recommended), when encoding
             a broadcast, it will not get overriten. Somewhat usefull for unittests.
+        :reply_to: applicable for 'RESP' only -- the nonce of the request
+            it responds to (sent in 0.2 only).
 
         """
 
-        if kind not in ['REQ', 'ANNC', 'RESP'] + ['MARCO', 'POLO', 'ACPT', 'AQUA']:
+        if kind not in ['REQ', 'ANNC', 'RESP'] + list(self.ROUTE_KINDS) + ['MARCO', 'POLO', 'ACPT', 'AQUA']:
             raise ValueError('Invalid broadcast type.')
 
 
@@ -192,6 +261,14 @@ class Broadcast():
 
         self.annc_result = annc_result
         self.resp_code = resp_code
+        self.reply_to = reply_to
+
+        self.nonce = None # 4 byte id, as parsed or from the last `encode`
+
+        # if the payload is base64 in the broadcast, None (when encoding) for
+        # the version's default: base64 in 0.1 (its payload ends at a '|'),
+        # raw bytes in 0.2 (its payload is length prefixed)
+        self.b64_payload = None
 
 
     def __repr__(self):
@@ -207,9 +284,28 @@ class Broadcast():
         return cls('ANNC', frm=frm, to=to, raw_payload=raw_payload)
 
     @classmethod
-    def RESP(cls, to, frm, resp_code, raw_payload=None):
-        return cls('RESP', frm=frm, to=to, resp_code=resp_code, raw_payload=raw_payload)
+    def RESP(cls, to, frm, resp_code, raw_payload=None, reply_to=None):
+        return cls('RESP', frm=frm, to=to, resp_code=resp_code, raw_payload=raw_payload, reply_to=reply_to)
+
 
+    @classmethod
+    def ROUTE(cls, kind, to, frm, route_obj):
+        """A route request (to '*'), reply, or error; `route_obj` its payload."""
+        b = cls(kind, frm=frm, to=to)
+        b.payload.resp_annc_obj = route_obj
+        return b
+
+    @property
+    def destination(self):
+        """The node (or group) the broadcast is finally to, `to` without its
+        source route if it has one."""
+        return route_destination(self.to)
+
+    @property
+    def next_hop(self):
+        """Where the broadcast is first transmitted to by its sender: the
+        start of its source route, otherwise `to`."""
+        return self.to.partition(ROUTE_SEPARATOR)[0]
 
     def is_to_all(self):
         """If the broadcast is to all nodes. (i.e. where 'to'=='*')"""
@@ -217,14 +313,23 @@ class Broadcast():
 
     def to_secure_group(self):
         """The group the broadcast is addressed to (False if not a group)"""
-        if self.to.startswith(b'#') and len(self.to) > 1:
-            return self.to
-        else:
-            return False
+        return self.secure_group(self.to)
 
     def to_gen_group(self): # includes 'all' ('*')
-        if self.to[0:1] == b'*' and len(self.to) >= 1:
-            return self.to
+        return self.gen_group(self.to)
+
+    @staticmethod
+    def secure_group(to:bytes):
+        """The secure group a broadcast `to` is addressed to (False if not one),
+        e.g. from the header of one not yet verified (see `header_fields`)."""
+        if to.startswith(b'#') and len(to) > 1:
+            return to
+        return False
+
+    @staticmethod
+    def gen_group(to:bytes): # includes 'all' ('*')
+        if to[0:1] == b'*':
+            return to
         return False
 
     def is_to_only_one(self):
@@ -233,20 +338,29 @@ class Broadcast():
         return not (self.to.startswith(b'#') or self.to.startswith(b'*'))
 
 
-    def encode(self, version_str='0.1', payload_encryptor=lambda b,pyld: base64_encode(pyld)): #feels like HACK, may remove defaults
+    def encode(self, version_str='0.1', payload_encryptor=lambda b,pyld: pyld): #feels like HACK, may remove defaults
         """Creates a raw broadcast byte string.
 
-        :version_str: version being used in form: ('#.#')
+        :version_str: version being used in form: ('#.#'), see `VERSIONS`
 
         :payload_encryptor: callback to a function (such as in a node) that
             takes the broadcast and constructed payload (without encryption)
             and encrypts the _payload_(not broadcast) as necessary; the result
-            (with encrption or not) must be base 64 encoded.
+            is base 64 encoded here if `b64_payload` (or the version) says so.
         """
 
-        if version_str not in ['0.1']:
+        if version_str not in self.VERSIONS:
             raise ValueError('Invalid version: %s' % version_str)
 
+        if version_str == '0.1' and self.kind in self.ROUTE_KINDS:
+            raise ValueError("Can't encode a '%s' broadcast in version 0.1." % self.kind)
+
+        b64 = self.b64_payload
+        if b64 is None:
+            b64 = version_str == '0.1'
+        elif not b64 and version_str == '0.1':
+            raise ValueError('Payload must be base64 in version 0.1')
+
         pre_payload = self.payload.raw_bytes
 
         if self.kind == 'REQ' and pre_payload== None:
@@ -256,14 +370,17 @@ class Broadcast():
             for action_name, args in self.payload.request_actions.items():
                 args_join_encoded = b''.join([m_encode(arg) for arg in args])
 
-                encoded_action = b'%s(%s)' % (
+                if action_name.startswith('^'): # already marked as an action
+                    action_name = action_name[1:]
+
+                encoded_action = b'^%s(%s)' % (
                     action_name.encode('utf-8'), args_join_encoded)
 
                 actions_encoded.append(encoded_action)
 
             pre_payload = b','.join(props_encoded+actions_encoded)
 
-        if (self.kind == 'RESP' or self.kind == 'ANNC') and pre_payload == None:
+        if (self.kind in ('RESP', 'ANNC') + self.ROUTE_KINDS) and pre_payload == None:
             if self.payload.resp_annc_obj:
                 pre_payload = m_encode(self.payload.resp_annc_obj)
             else: # else there is no payload, make null
@@ -273,16 +390,23 @@ class Broadcast():
 
 
         # may be encrypted if broadcast 'to' warents it
-        b64d_final_payload = payload_encryptor(self, pre_payload)
+        final_payload = payload_encryptor(self, pre_payload)
+        if b64:
+            final_payload = base64_encode(final_payload)
+
+        self.nonce = nacl_random(4)
+
+        if version_str == '0.2':
+            return self._encode_v02(final_payload, b64)
 
         fill = {
-            b'v': bytes([int(n) for n in version_str.split('.')]),
-            b'nonce': nacl_random(4),
+            b'v': self.VERSIONS[version_str],
+            b'nonce': self.nonce,
             b'kind': self.kind.encode('utf-8'),
             b'to': self.to,
             b'frm': self.frm,
-            b'payload_b64': b64d_final_payload,
-            b'annc_result': self.annc_result.encode('utf-8') if self.annc_result else b'\x00',
+            b'payload_b64': final_payload,
+            b'annc_result': self._annc_result_bytes() or b'\x00',
             b'resp_code': self.resp_code or b'n'
         }
 
@@ -295,49 +419,185 @@ class Broadcast():
 
         return template % fill
 
+    def _encode_v02(self, payload:bytes, b64:bool) -> bytes:
+        """The 0.2 header: fixed size fields then the addresses and payload."""
+
+        if self.kind not in self.KIND_BYTES:
+            raise ValueError("Can't encode a '%s' broadcast." % self.kind)
+
+        if self.kind == 'REQ':
+            extra = self._annc_result_bytes()
+        elif self.kind == 'RESP':
+            extra = self.reply_to or b''
+        else:
+            extra = b''
+
+        try:
+            header = self._HEADER_V02.pack(self.VERSIONS['0.2'], self.nonce,
+                                           self.KIND_BYTES[self.kind] | (0 if b64 else self.RAW_PAYLOAD),
+                                           RespCode.to_byte[self.resp_code] if self.kind == 'RESP' else 0,
+                                           len(self.to), len(self.frm), len(extra), len(payload))
+        except struct.error:
+            raise ValueError('Broadcast address or payload too long for the 0.2 header.') from None
+
+        return b''.join((header, self.to, self.frm, extra, payload))
+
+    def _annc_result_bytes(self) -> bytes:
+        if not self.annc_result:
+            return b''
+        if isinstance(self.annc_result, str):
+            return self.annc_result.encode('utf-8')
+        return self.annc_result
+
 
     @classmethod
-    def from_plain_broadcast_bytes(cls, bcast:str, payload_decrypter):
+    def _header_v02(cls, bcast:bytes, start:int=0):
+        """Unpacks a 0.2 header, returns (kind, code, to, frm, annc result or
+        reply to, payload start, payload end) where kind and code are still
+        bytes (ints).
+        Raises `ValueError` if the header doesn't fit the broadcast."""
+
+        try:
+            _, _, kind, code, to_len, frm_len, extra_len, payload_len = cls._HEADER_V02.unpack_from(bcast, start)
+        except struct.error:
+            raise ValueError('Broadcast header cut short') from None
+
+        to_start = start + cls._HEADER_V02.size
+        frm_start = to_start + to_len
+        extra_start = frm_start + frm_len
+        payload_start = extra_start + extra_len
+        payload_end = payload_start + payload_len
+
+        if payload_end > len(bcast):
+            raise ValueError('Broadcast shorter than its header says')
+
+        return (kind, code, bcast[to_start:frm_start], bcast[frm_start:extra_start],
+                bcast[extra_start:payload_start], payload_start, payload_end)
+
+    @classmethod
+    def header_fields(cls, bcast:bytes, start:int=0):
+        """Finds the kind, to and from of a plain broadcast (beginning at `start`)
+        without parsing the rest. Returns (kind, to, frm, position just after
+        frm), raises `ValueError` if they can not be found."""
+
+        if bcast[start:start+2] == cls.VERSIONS['0.2']:
+            kind, _, to, frm, _, payload_start, _ = cls._header_v02(bcast, start)
+            return cls.KINDS_BY_BYTE.get(kind & ~cls.RAW_PAYLOAD, b''), to, frm, payload_start
+
+        # v(2) nonce(4) |kind|to|frm|...
+        kind_end = bcast.find(b'|', start+7)
+        to_end = bcast.find(b'|', kind_end+1) if kind_end != -1 else -1
+        frm_end = bcast.find(b'|', to_end+1) if to_end != -1 else -1
+
+        if frm_end == -1:
+            raise ValueError('Broadcast header not found')
+
+        return bcast[start+7:kind_end], bcast[kind_end+1:to_end], bcast[to_end+1:frm_end], frm_end
+
+    @classmethod
+    def from_plain_broadcast_bytes(cls, bcast:bytes, payload_decrypter):
         """Takes the raw network decrpyted level broadcast, returns broadcast object.
         If not to == *[group], then an extra layer of encyption still exists on the payload
 
-        :decrypt_payload_callback: a callback from the node to decypt and b64 decode the payload
+        The version is read from the first two bytes, 0.1 and 0.2 are understood.
+
+        Only the header is parsed, the payload is (b64 decoded and) decrypted
+        when first accessed; so a broadcast that is not to this node costs
+        no more than finding a few '|' (or a struct unpack for 0.2).
+
+        :payload_decrypter: a callback from the node to decypt the payload
+            (given the payload bytes, to and frm)
         """
 
-        # use the first 6 bytes to get version and bcast id
-        protocol_version = '.'.join([str(bcast[:2][i]) for i in range(2)])
-        b_nonce_id = bcast[2:6]
+        version = bcast[:2]
+
+        if version == cls.VERSIONS['0.2']:
+            b, payload_start, payload_end = cls._from_v02_bytes(bcast)
 
-        s = bcast[7:].split(b'|')
+        elif version == cls.VERSIONS['0.1']:
+            b, payload_start, payload_end = cls._from_v01_bytes(bcast)
 
-        kind = s[0]
-        section_count = len(s) + 1 # plus the v/id section
+        else:
+            raise ExceptionWithResponse(RespCode.NAK, 'Unknown broadcast version: %r' % version)
+
+        to, frm = b.to, b.frm
+
+        if b.b64_payload:
+            load_raw_bytes = lambda: payload_decrypter(base64_decode(bcast[payload_start:payload_end]), to, frm)
+        else:
+            load_raw_bytes = lambda: payload_decrypter(bcast[payload_start:payload_end], to, frm)
+
+        b.nonce = bcast[2:6]
+        b.payload = Payload(load_raw_bytes=load_raw_bytes)
 
-        to = s[1]
-        frm = s[2] #from
+        return b
 
+    @classmethod
+    def _from_v01_bytes(cls, bcast:bytes):
+        try:
+            kind, to, frm, frm_end = cls.header_fields(bcast)
+        except ValueError:
+            raise ExceptionWithResponse(RespCode.NAK, 'Unable to parse broadcast header') from None
 
-        def decrypt_payload(payload):
-            return payload_decrypter(payload, to, frm)
+        section_count = 5 + bcast.count(b'|', frm_end+1) # v/id, kind, to, frm and one more
 
         if kind == b'REQ' and section_count == 6:
-            payload = decrypt_payload(s[3])
-            annc_result = s[4] if s[4] != b'\x00' else None
+            payload_end = bcast.find(b'|', frm_end+1)
+            annc_result = bcast[payload_end+1:]
 
-            return cls.REQ(to, frm, payload, annc_result)
+            b = cls.REQ(to, frm, None, annc_result if annc_result != b'\x00' else None)
 
         elif kind == b'ANNC' and section_count == 5:
-            payload = decrypt_payload(s[3])
+            payload_end = len(bcast)
 
-            return cls.ANNC(frm, to, payload)
+            b = cls.ANNC(frm, to)
 
         elif kind == b'RESP' and section_count == 6:
-            resp_code = s[3]
+            code_end = bcast.find(b'|', frm_end+1)
+            resp_code = bcast[frm_end+1:code_end]
 
-            payload = decrypt_payload(s[4])
+            b = cls.RESP(to, frm, resp_code)
 
-            return cls.RESP(to, frm, resp_code, payload)
+            frm_end = code_end # payload follows the code
+            payload_end = len(bcast)
 
         else:
             error_text = 'Unable to parse broadcast of kind: %s with %i sections ' % (kind, section_count)
             raise ExceptionWithResponse(RespCode.NAK, error_text, frm)
+
+        b.b64_payload = True
+
+        return b, frm_end+1, payload_end
+
+    @classmethod
+    def _from_v02_bytes(cls, bcast:bytes):
+        try:
+            kind, code, to, frm, extra, payload_start, payload_end = cls._header_v02(bcast)
+        except ValueError:
+            raise ExceptionWithResponse(RespCode.NAK, 'Unable to parse broadcast header') from None
+
+        if payload_end != len(bcast):
+            raise ExceptionWithResponse(RespCode.NAK, 'Broadcast longer than its header says', frm)
+
+        raw = kind & cls.RAW_PAYLOAD
+        kind = cls.KINDS_BY_BYTE.get(kind & ~cls.RAW_PAYLOAD)
+
+        if kind == b'REQ':
+            b = cls.REQ(to, frm, None, extra or None)
+
+        elif kind == b'ANNC':
+            b = cls.ANNC(frm, to)
+
+        elif kind == b'RESP' and code in RespCode.from_byte:
+            b = cls.RESP(to, frm, RespCode.from_byte[code], reply_to=extra or None)
+
+        elif kind is not None and kind.decode() in cls.ROUTE_KINDS:
+            b = cls(kind.decode(), frm=frm, to=to)
+
+        else:
+            error_text = 'Unable to parse broadcast of kind: %s with code %i' % (kind, code)
+            raise ExceptionWithResponse(RespCode.NAK, error_text, frm)
+
+        b.b64_payload = not raw
+
+        return b, payload_start, payload_end
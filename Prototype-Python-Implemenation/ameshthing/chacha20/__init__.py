@@ -5,10 +5,15 @@ Basic Usage:
 >>> ciphertext = box.encrypt(b'Do the salsa with a shake!', nonce_8_byte)
 >>> plaintext = box.decrpyt(ciphertext, nonce_8_byte)
 
+Without copies, into a buffer (e.g. a preallocated frame):
+>>> written = box.encrypt_into(plaintext, bytearray_or_memoryview, nonce_8_byte)
+>>> written = box.decrypt_into(ciphertext, bytearray_or_memoryview)
+
 """
 
 
 from ._chacha20 import crypt as chacha20_crypt # import from C
+from ._chacha20 import crypt_into as chacha20_crypt_into
 
 class ChaChaBox():
     """Python binding to C XOR ChaCha20
@@ -43,13 +48,8 @@ class ChaChaBox():
         if len(nonce) != self.NONCE_SIZE:
             raise ValueError('Nonce must be %i bytes.' % self.NONCE_SIZE)
 
-
-        # FIXME when passed to C, it is by ref, therefore the plain text python 'pointer'
-        # gets manipualated into the cipher text (as it should it C), but also
-        # affects the python variable being passed
-        ciphertext = chacha20_crypt(plaintext, nonce, self.secret_key)
-
-        return nonce + ciphertext
+        # the plaintext is left as it is, see `encrypt_into` to avoid copies
+        return nonce + chacha20_crypt(plaintext, nonce, self.secret_key)
 
     def decrypt(self, ciphertext):
         """Decrypts ciphertext using the symmetric key and the prepended nonce.
@@ -57,10 +57,39 @@ class ChaChaBox():
         :ciphertext: [nonce][actual ciphertext]
         """
 
-        nonce = ciphertext[:self.NONCE_SIZE]
-        ciphertext_only = ciphertext[self.NONCE_SIZE:]
+        view = memoryview(ciphertext)
+
+        return chacha20_crypt(view[self.NONCE_SIZE:], bytes(view[:self.NONCE_SIZE]), self.secret_key)
+
+    def encrypt_into(self, plaintext, dst, nonce) -> int:
+        """Writes [nonce][ciphertext] into the start of the writable buffer
+        `dst` (a bytearray, or memoryview of one), which must have room.
+        `plaintext` is any bytes-like object, and is left as it is.
+        Returns the number of bytes written.
+        """
+
+        if len(nonce) != self.NONCE_SIZE:
+            raise ValueError('Nonce must be %i bytes.' % self.NONCE_SIZE)
+
+        dst = memoryview(dst)
+        if len(dst) < self.NONCE_SIZE + len(plaintext):
+            raise ValueError('`dst` too short for the ciphertext.')
+
+        dst[:self.NONCE_SIZE] = nonce
+
+        return self.NONCE_SIZE + chacha20_crypt_into(plaintext, dst[self.NONCE_SIZE:], nonce, self.secret_key)
+
+    def decrypt_into(self, ciphertext, dst) -> int:
+        """Writes the plaintext of [nonce][ciphertext] into the start of the
+        writable buffer `dst`, which must have room (it may be the same buffer
+        as `ciphertext`, decrypting in place). Returns the number of bytes
+        written.
+        """
+
+        view = memoryview(ciphertext)
+        nonce = bytes(view[:self.NONCE_SIZE])
 
-        return chacha20_crypt(ciphertext_only, nonce, self.secret_key)
+        return chacha20_crypt_into(view[self.NONCE_SIZE:], dst, nonce, self.secret_key)
 
     def __repr__(self):
         return "<ChaChaBox object>"
@@ -1,4 +1,6 @@
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include <string.h>
 
 
 /************Start this guy's chacha*************/
@@ -123,13 +125,18 @@ struct Chacha20 {
     }
 
     void crypt(uint8_t *bytes, size_t n_bytes){
+        crypt(bytes, bytes, n_bytes);
+    }
+
+    // dst may be src (in place) or start before it, but not overlap it from after
+    void crypt(const uint8_t *src, uint8_t *dst, size_t n_bytes){
         uint8_t *keystream8 = (uint8_t*)keystream32;
         for (size_t i = 0; i < n_bytes; i++){
             if (position >= 64){
                 block.next(keystream32);
                 position = 0;
             }
-            bytes[i] ^= keystream8[position];
+            dst[i] = src[i] ^ keystream8[position];
             position++;
         }
     }
@@ -150,30 +157,80 @@ strlen(const char *str)
 Use: pass in the message/cypher, the 8 byte nonce, and 32 byte key.
 >>> chacha20.crypt(messaeg, nonce, key)
 
+Returns new bytes, the message is left as it is.
+
 Nonces should only be use ONCE.
 
 */
 static PyObject * chacha_crypt(PyObject *self, PyObject *args) {
 
-    uint8_t *m;
-    size_t *m_len;
+    Py_buffer m;
 
     const uint8_t *nonce;
-    size_t *nl;
+    Py_ssize_t nl;
 
     const uint8_t *key;
-    size_t kl;
+    Py_ssize_t kl;
 
-    if (!PyArg_ParseTuple(args, "y#y#y#", &m, &m_len, &nonce, &nl, &key, &kl))
+    if (!PyArg_ParseTuple(args, "y*y#y#", &m, &nonce, &nl, &key, &kl))
         return NULL;
 
-    // printf("m_len = %lu\n", (size_t)m_len);
+    if (nl != 8 || kl != 32) {
+        PyBuffer_Release(&m);
+        PyErr_SetString(PyExc_ValueError, "nonce must be 8 bytes and key 32 bytes");
+        return NULL;
+    }
+
+    PyObject *out = PyBytes_FromStringAndSize(NULL, m.len);
+    if (out != NULL) {
+        Chacha20 cc = Chacha20(key, nonce);
+        cc.crypt((const uint8_t *)m.buf, (uint8_t *)PyBytes_AS_STRING(out), (size_t)m.len);
+    }
+
+    PyBuffer_Release(&m);
+
+    return out;
+}
+
+/** Crypts any bytes-like `src` into the writable buffer `dst` (e.g. a
+bytearray or a memoryview slice of one), which must be at least as long.
+`dst` may be `src` itself (in place), or start before it in the same buffer.
+Returns the number of bytes written.
+
+>>> chacha20.crypt_into(src, dst, nonce, key)
+*/
+static PyObject * chacha_crypt_into(PyObject *self, PyObject *args) {
+
+    Py_buffer src, dst;
+
+    const uint8_t *nonce;
+    Py_ssize_t nl;
+
+    const uint8_t *key;
+    Py_ssize_t kl;
+
+    if (!PyArg_ParseTuple(args, "y*w*y#y#", &src, &dst, &nonce, &nl, &key, &kl))
+        return NULL;
+
+    if (nl != 8 || kl != 32 || dst.len < src.len) {
+        PyBuffer_Release(&src);
+        PyBuffer_Release(&dst);
+        PyErr_SetString(PyExc_ValueError,
+            nl != 8 || kl != 32 ? "nonce must be 8 bytes and key 32 bytes" : "dst shorter than src");
+        return NULL;
+    }
+
+    Py_ssize_t n = src.len;
+
+    Py_BEGIN_ALLOW_THREADS
+    Chacha20 cc = Chacha20(key, nonce);
+    cc.crypt((const uint8_t *)src.buf, (uint8_t *)dst.buf, (size_t)n);
+    Py_END_ALLOW_THREADS
 
-    Chacha20 cc = Chacha20((const uint8_t *)key, nonce);
-    cc.crypt((uint8_t *)m, (size_t)m_len);
+    PyBuffer_Release(&src);
+    PyBuffer_Release(&dst);
 
-    return Py_BuildValue("y#", m, m_len);
-    // TODO figure out if some kind of memoerty management is a thing before the return.
+    return PyLong_FromSsize_t(n);
 }
 
 
@@ -188,6 +245,7 @@ static PyObject * chacha_foobar(PyObject *self, PyObject *args) {
 static PyMethodDef ChaChaMethods[] = {
     {"foobar",  chacha_foobar, METH_VARARGS, "A foo bar test."},
     {"crypt",  chacha_crypt, METH_VARARGS, "'Crypts a thing. Encryption and decryption are same operation.'"},
+    {"crypt_into",  chacha_crypt_into, METH_VARARGS, "Crypts a bytes-like src into a writable buffer dst, returns the length."},
 
     {NULL, NULL, 0, NULL} /* Sentinel */
 };
@@ -27,6 +27,33 @@ class ChaChaBoxTests(unittest.TestCase):
         self.assertEqual(d, self.PLAINTEXT)
 
 
+    def test_inputs_left_alone(self):
+        plaintext = bytearray(self.PLAINTEXT)
+        self.box.encrypt(plaintext, self.TEST_NONCE)
+        self.assertEqual(plaintext, self.PLAINTEXT)
+
+        ciphertext = bytearray(self.EXPECTED_CIPHER)
+        self.assertEqual(self.box.decrypt(ciphertext), self.PLAINTEXT)
+        self.assertEqual(ciphertext, self.EXPECTED_CIPHER)
+
+    def test_into_buffers(self):
+        frame = bytearray(4 + len(self.EXPECTED_CIPHER))
+        written = self.box.encrypt_into(self.PLAINTEXT, memoryview(frame)[4:], self.TEST_NONCE)
+
+        self.assertEqual(written, len(self.EXPECTED_CIPHER))
+        self.assertEqual(frame[4:], self.EXPECTED_CIPHER)
+
+        out = bytearray(100)
+        written = self.box.decrypt_into(memoryview(frame)[4:], out)
+        self.assertEqual(out[:written], self.PLAINTEXT)
+
+        written = self.box.decrypt_into(memoryview(frame)[4:], frame) # in place, over the header
+        self.assertEqual(frame[:written], self.PLAINTEXT)
+
+        self.assertRaises(ValueError, self.box.encrypt_into, self.PLAINTEXT, bytearray(10), self.TEST_NONCE)
+        self.assertRaises(ValueError, self.box.decrypt_into, self.EXPECTED_CIPHER, bytearray(10))
+        self.assertRaises(TypeError, self.box.decrypt_into, self.EXPECTED_CIPHER, bytes(100)) # not writable
+
     def test_bad_secret_key(self):
         self.assertRaises(ValueError, ChaChaBox, (b'\x31' * 31))
         self.assertRaises(ValueError, ChaChaBox, (b'\x33' * 33))
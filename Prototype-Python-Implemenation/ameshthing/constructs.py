@@ -12,7 +12,7 @@ class BaseConstruct():
     of Actions and Properties.
     """
 
-    __slots__ = '_name', '_type', 'meta'
+    __slots__ = '_name', '_type', '_meta'
 
     @property
     def name(self):
@@ -22,6 +22,13 @@ class BaseConstruct():
     def type_T(self):
         return self._type
 
+    @property
+    def meta(self):
+        return self._meta
+    @meta.setter
+    def meta(self, new):
+        self._meta = new
+
     def __init__(self, name:str, type_):
         if name in BAD_NAME_CHARS and name != '':
             raise Exception('Name can not be empty.')
@@ -32,14 +39,32 @@ class BaseConstruct():
 
         self._type = type_
 
-        self.meta = {}
+        self._meta = {}
 
 class Property(BaseConstruct):
-    __slots__ = 'value'
+    """A node's property. Its encoding is cached until `value` or `meta` is
+    assigned; after changing either in place (e.g. appending to a list value)
+    assign it again so the change is encoded."""
+
+    __slots__ = '_value', '_encoded' # `_encoded` is `None` when not (yet) valid
 
     def __init__(self, name:str, type_, value=None):
+        self._encoded = None
         super().__init__(name, type_)
-        self.value = value
+        self._value = value
+
+    @property
+    def value(self):
+        return self._value
+    @value.setter
+    def value(self, new):
+        self._value = new
+        self._encoded = None
+
+    @BaseConstruct.meta.setter
+    def meta(self, new):
+        self._meta = new
+        self._encoded = None
 
     def __repr__(self):
         # return "Property at " + str(hex(id(self)))
@@ -96,13 +121,9 @@ class Action(BaseConstruct):
                     % (len(args), len(self.action_parameters)))
 
         # test for correct types
-        for i in range(len(args)):
-            arg = args[i]
-            param = self.action_parameters[i]
-
-            if arg != None:
-                if type(arg) != param.type_T.pytype:
-                    raise ArgumentValidationError("Argument for '%s' should be '%s'" % (param.name, param.type_T.repr))
+        for arg, param in zip(args, self.action_parameters):
+            if arg is not None and type(arg) is not param._type.pytype:
+                raise ArgumentValidationError("Argument for '%s' should be '%s'" % (param.name, param._type.repr))
 
 
         # TODO add meta verification when I work out meta
@@ -117,7 +138,13 @@ class Action(BaseConstruct):
 
 
 class BaseNode():
-    """Most basic node used for special encoding. Inheritance not recomended."""
+    """Most basic node used for special encoding. Inheritance not recomended.
+
+    The encodings of its actions and of `node_info` are cached (as a
+    Property's is): after changing either in place, e.g. an action's
+    parameters or their meta, or a key of `node_info`, call `actions_changed`
+    or `node_info_changed` so the change is encoded. Adding an action
+    (`add_action`) or assigning `node_info` does so itself."""
 
     def __init__(self):
 
@@ -126,6 +153,9 @@ class BaseNode():
         self.properties = {}
         self.actions = {}
 
+        self._encoded_actions = None # cached encoding of all actions, see `actions_changed`
+        self._encoded_node_info = None # see `node_info_changed`
+
     network_addr = property(lambda s:s.node_info['addr'])
 
 
@@ -135,6 +165,16 @@ class BaseNode():
     @node_info.setter
     def node_info(self, new):
         self._node_info = new
+        self._encoded_node_info = None
+
+    def node_info_changed(self):
+        """To call after changing `node_info` in place, so the change is encoded."""
+        self._encoded_node_info = None
+
+    def actions_changed(self):
+        """To call after changing `actions` in place (an action's parameters
+        or their meta, or removing one), so the change is encoded."""
+        self._encoded_actions = None
 
 
     def __repr__(self):
@@ -171,6 +211,7 @@ class BaseNode():
         if act.name in self.actions:
             raise Exception('Action already exists.')
         self.actions[act.name] = act
+        self.actions_changed()
 
         return self.actions[act.name]
 
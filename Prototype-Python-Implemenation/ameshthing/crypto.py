@@ -18,10 +18,101 @@ from nacl.encoding import Base64Encoder as nacl_Base64Encoder
 
 from nacl.secret import SecretBox, EncryptedMessage
 
+from nacl.bindings import crypto_aead_xchacha20poly1305_ietf_encrypt as xchacha20poly1305_encrypt
+from nacl.bindings import crypto_aead_xchacha20poly1305_ietf_decrypt as xchacha20poly1305_decrypt
+
 from .chacha20 import ChaChaBox
 
 from .util import base64_encode, base64_decode
 
+from collections import OrderedDict, namedtuple
+
+
+# who a node is, made once per key change (see `Crypto.identity`)
+Identity = namedtuple('Identity', 'addr verify_key public_key kVerify kPublic')
+
+# size of a node's verify (Ed25519) and public (Curve25519) keys
+PEER_KEY_SIZE = 32
+
+def _is_peer_key(key):
+    return type(key) is bytes and len(key) == PEER_KEY_SIZE
+
+
+class AeadBox():
+    """XChaCha20-Poly1305 (libsodium, via PyNaCl) with the interface of a
+    ChaChaBox, for an authenticated network layer: data encrypted with
+    another key, or corrupted, fails `decrypt` (raising
+    `nacl.exceptions.CryptoError`) rather than becoming garbage.
+
+    ciphertext: [nonce (24)][encrypted data][tag (16)]
+    """
+
+    KEY_SIZE = 32
+    NONCE_SIZE = 24
+    TAG_SIZE = 16
+
+    def __init__(self, secret_key):
+        if len(secret_key) != self.KEY_SIZE:
+            raise ValueError('Secret key must be %i bytes.' % self.KEY_SIZE)
+
+        self.secret_key = secret_key
+
+    def encrypt(self, plaintext, nonce):
+        if len(nonce) != self.NONCE_SIZE:
+            raise ValueError('Nonce must be %i bytes.' % self.NONCE_SIZE)
+
+        return nonce + xchacha20poly1305_encrypt(bytes(plaintext), None, nonce, self.secret_key)
+
+    def encrypt_into(self, plaintext, dst, nonce) -> int:
+        encrypted = self.encrypt(plaintext, nonce) # libsodium's binding returns new bytes
+        memoryview(dst)[:len(encrypted)] = encrypted
+        return len(encrypted)
+
+    def decrypt(self, ciphertext):
+        nonce = bytes(ciphertext[:self.NONCE_SIZE])
+        return xchacha20poly1305_decrypt(bytes(ciphertext[self.NONCE_SIZE:]), None, nonce, self.secret_key)
+
+
+class KeyCache():
+    """A least recently used cache of objects made (by `make`) from key bytes,
+    e.g. a precomputed Box from a public key; keeping at most `max_entries`.
+
+    As entries are keyed by the key bytes, a changed key is simply a miss,
+    and the old entry is evicted in time (or with `forget`).
+    """
+
+    def __init__(self, make, max_entries=256):
+        self.make = make
+        self.max_entries = max_entries
+
+        self._objects = OrderedDict()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, key):
+        return key in self._objects
+
+    def get(self, key:bytes):
+        objects = self._objects
+        try:
+            objects.move_to_end(key)
+            return objects[key]
+        except KeyError:
+            pass
+
+        obj = objects[key] = self.make(key)
+        if len(objects) > self.max_entries:
+            objects.popitem(last=False)
+
+        return obj
+
+    def forget(self, key:bytes):
+        self._objects.pop(key, None)
+
+    def clear(self):
+        self._objects.clear()
+
 
 
 class Crypto():
@@ -49,6 +140,9 @@ class Crypto():
     >>> encrypt_symmetrically(payload, key)
     >>> decrypt_symmetrically(payload, key)
 
+    The network layer is ChaCha20 (unauthenticated) unless the network key
+    is set with `aead=True`, then XChaCha20-Poly1305 (see `AeadBox`).
+
 
     >>> c.public_address  # derived from verifiying key
 
@@ -67,9 +161,16 @@ class Crypto():
         # generated from `public_address` property getter, different from public key
         self.__public_address = None
 
+        self._identity = None
+
 
         self.network_secret_box = None
 
+        # per peer, so talking to a known node costs only the symmetric work
+        self._boxes = KeyCache(lambda key: Box(self.private_key, PublicKey(key))) # shared key precomputed
+        self._verify_keys = KeyCache(VerifyKey)
+        self._group_boxes = KeyCache(ChaChaBox, 64) # by (secure group) key, see `forget_symmetric_key`
+
         #self.signing_key = nacl.signing.SigningKey.generate()
         # self.verify_key = self.signing_key.verify_key
 
@@ -85,11 +186,36 @@ class Crypto():
 
         return self.__public_address
 
+    @property
+    def identity(self) -> Identity:
+        """The address, public key objects and their encoded bytes; made
+        once, until the keys change."""
+
+        if self._identity is None:
+            verify_key = self.signing_key.verify_key
+            public_key = self.private_key.public_key
+
+            self._identity = Identity(self.public_address, verify_key, public_key,
+                                      verify_key.encode(), public_key.encode())
+
+        return self._identity
+
+
+
+    @property
+    def network_aead(self) -> bool:
+        return isinstance(self.network_secret_box, AeadBox)
 
+    @property
+    def network_overhead(self) -> int:
+        """Bytes the network signing and encryption add to a message."""
+        box = self.network_secret_box
+        return 64 + box.NONCE_SIZE + getattr(box, 'TAG_SIZE', 0)
 
     def get_save_key_dict(self):
         return {
             'net': base64_encode(self.network_secret_box.secret_key),
+            'netAead': self.network_aead,
             'sign': self.signing_key.encode(encoder=nacl_Base64Encoder),
             'priv': self.private_key.encode(encoder=nacl_Base64Encoder),
             'addr': self.public_address
@@ -97,7 +223,7 @@ class Crypto():
 
     def load_keys_from_save_dict(self, save:dict):
 
-        self.network_secret_box = ChaChaBox(base64_decode(save['net']))
+        self.set_network_key(base64_decode(save['net']), save.get('netAead', False))
 
         self.signing_key = SigningKey(save['sign'], encoder=nacl_Base64Encoder)
 
@@ -105,6 +231,9 @@ class Crypto():
 
         self.__public_address = save['addr']
 
+        self._identity = None
+        self._boxes.clear() # shared with the old private key
+
 
     def create_dual_keys(self):
         """Call only when fresh node. These keys _are_ the node."""
@@ -115,14 +244,39 @@ class Crypto():
         # For the key exchange for individual-to-individual encryption
         self.private_key = PrivateKey.generate()
 
+        self.__public_address = None
+        self._identity = None
+        self._boxes.clear()
+
+
+    def set_network_key(self, key:bytes, aead:bool=False):
+        """The network's shared key, `aead` if the network uses an
+        authenticated network layer (all its nodes must agree)."""
+        self.network_secret_box = AeadBox(key) if aead else ChaChaBox(key)
+
+
+    def add_peer_keys(self, verify_key:bytes, public_key:bytes):
+        """Prepares for a (newly cached) node's keys: its verify key object,
+        and the Box with the shared key (the costly Curve25519 step).
+
+        The keys come from other nodes, so ones that are not `PEER_KEY_SIZE`
+        bytes are not prepared (rather than raising); using them fails."""
 
-    def set_network_key(self, key:bytes):
-        self.network_secret_box = ChaChaBox(key)
+        if _is_peer_key(verify_key) and _is_peer_key(public_key):
+            self._verify_keys.get(verify_key)
+            self._boxes.get(public_key)
+
+    def forget_peer_keys(self, verify_key:bytes, public_key:bytes):
+        """Drops what was prepared for keys no longer used (e.g. changed)."""
+
+        if _is_peer_key(verify_key) and _is_peer_key(public_key):
+            self._verify_keys.forget(verify_key)
+            self._boxes.forget(public_key)
 
 
     def encrypt_to_public_key(self, plaindata:bytes, key:bytes):
 
-        box = Box(self.private_key, PublicKey(key))
+        box = self._boxes.get(key)
 
         nonce = nacl.utils.random(Box.NONCE_SIZE)
 
@@ -133,15 +287,19 @@ class Crypto():
 
     def decrypt_from_public_key(self, cipher_data:bytes, key:bytes):
 
-        box = Box(self.private_key, PublicKey(key))
+        box = self._boxes.get(key)
 
         return box.decrypt(cipher_data)
 
 
 
-    def sign_and_encrypt_with_network_key(self, message:bytes):
+    def sign_and_encrypt_with_network_key(self, message:bytes, reserve:int=0):
         """Returns the signed then encypted message (broadcast).
         Signed with signing key, encrypted with symettric network key.
+
+        :reserve: bytes to leave (zeroed) before the encrypted message, for
+            the caller to fill (e.g. the frame header); then the result is a
+            bytearray, encrypted into place without other copies.
         """
 
         signed = self.signing_key.sign(message)
@@ -149,36 +307,46 @@ class Crypto():
         # *MUST* only be used once, but it is not considered
         #   secret and can be transmitted or stored alongside the ciphertext. A
         #   good source of nonce is just 24 random bytes.
-        nonce = nacl.utils.random(ChaChaBox.NONCE_SIZE)
+        nonce = nacl.utils.random(self.network_secret_box.NONCE_SIZE)
+
+        if not reserve:
+            return self.network_secret_box.encrypt(signed, nonce)
 
-        encrypted = self.network_secret_box.encrypt(signed, nonce)
+        box = self.network_secret_box
+        out = bytearray(reserve + box.NONCE_SIZE + getattr(box, 'TAG_SIZE', 0) + len(signed))
+        box.encrypt_into(signed, memoryview(out)[reserve:], nonce)
 
-        return encrypted
+        return out
 
 
     def decrypt_from_network(self, encrypted):
+        """Raises `nacl.exceptions.CryptoError` if the network layer is
+        authenticated and `encrypted` isn't genuine."""
         return self.network_secret_box.decrypt(encrypted)
 
     def verify_signed_bytes(self, signed:bytes, verify_key_raw:bytes):
-        verify_key = VerifyKey(verify_key_raw) # convert to NaCl object
+        verify_key = self._verify_keys.get(verify_key_raw) # NaCl object
 
         return verify_key.verify(signed)
 
 
-    @staticmethod
-    def encrypt_symmetrically(plain_data:bytes, key:bytes):
+    def encrypt_symmetrically(self, plain_data:bytes, key:bytes):
         """ChaCha20 encrypts plain data with key."""
 
         nonce = nacl.utils.random(ChaChaBox.NONCE_SIZE)
 
-        box = ChaChaBox(key)
+        box = self._group_boxes.get(key)
 
         return box.encrypt(plain_data, nonce)
 
-    @staticmethod
-    def decrypt_symmetrically(cipher_data:bytes, key:bytes):
+    def decrypt_symmetrically(self, cipher_data:bytes, key:bytes):
         """ChaCha20 decrypts cipher data using passed key"""
 
-        box = ChaChaBox(key)
+        box = self._group_boxes.get(key)
 
         return box.decrypt(cipher_data)
+
+    def forget_symmetric_key(self, key:bytes):
+        """Drops what was prepared for a (secure group) key no longer used,
+        e.g. when the group is left or its key changed."""
+        self._group_boxes.forget(key)
@@ -0,0 +1,216 @@
+"""
+Keeping track of requests a Node has dispatched: matching responses to
+them, and timing them out (with a hashed timer wheel) when none comes.
+"""
+
+from collections import OrderedDict
+from math import ceil
+from time import monotonic
+
+
+class Timer():
+    """A callback scheduled on a TimerWheel, `cancel` to stop it firing."""
+
+    __slots__ = 'deadline', 'callback', '_slot'
+
+    def __init__(self, deadline:int, callback, slot:set):
+        self.deadline = deadline # in ticks
+        self.callback = callback
+        self._slot = slot
+
+    def cancel(self):
+        if self._slot is not None:
+            self._slot.discard(self)
+            self._slot = None
+
+    @property
+    def cancelled(self):
+        return self._slot is None
+
+
+class TimerWheel():
+    """A hashed timer wheel, many timeouts cost O(1) each to schedule,
+    cancel, and fire; rather than keeping them sorted.
+
+    Time is counted in ticks of `tick` seconds, a timer is put in the slot
+    of its deadline tick (modulo the number of `slots`) and fires on the
+    first `advance` at or after that tick. So timers fire up to one tick
+    late, never early.
+
+    `advance` is called by the event loop every tick once `start(loop)` is
+    called, it may also be called directly (e.g. when a loop isn't used).
+
+    >>> wheel.start(loop)
+    >>> timer = wheel.schedule(5, lambda: print('5 seconds later'))
+    >>> timer.cancel()
+    """
+
+    def __init__(self, tick=0.1, slots=512, clock=monotonic):
+        self.tick = tick
+        self.clock = clock
+
+        self._slots = [set() for _ in range(slots)]
+        self._now = self._ticks(clock()) # the last tick advanced to
+
+        self._loop = None
+        self._handle = None
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+    def _ticks(self, seconds):
+        return int(seconds / self.tick)
+
+    def schedule(self, delay:float, callback) -> Timer:
+        """Calls `callback()` after `delay` seconds, returns its Timer."""
+
+        deadline = max(ceil((self.clock() + delay) / self.tick), self._now + 1)
+        slot = self._slots[deadline % len(self._slots)]
+
+        timer = Timer(deadline, callback, slot)
+        slot.add(timer)
+
+        return timer
+
+    def advance(self, now:float=None):
+        """Fires every timer due by `now` (default the clock)."""
+
+        now = self._ticks(self.clock() if now is None else now)
+
+        # after a whole turn every slot has been looked at, so a long gap
+        # (e.g. no loop) costs no more than one turn
+        first = max(self._now + 1, now - len(self._slots) + 1)
+        self._now = max(self._now, now)
+
+        slots = self._slots
+        for tick in range(first, now + 1):
+            slot = slots[tick % len(slots)]
+            if not slot:
+                continue
+
+            due = [t for t in slot if t.deadline <= now]
+            for timer in due:
+                if timer.cancelled: # by an earlier callback
+                    continue
+                timer.cancel()
+                timer.callback()
+
+    @property
+    def running(self):
+        return self._handle is not None
+
+    def start(self, loop):
+        """Advances the wheel every tick from the event `loop`."""
+
+        self.stop()
+        self._loop = loop
+        self._handle = loop.call_later(self.tick, self._run)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = self._loop = None
+
+    def _run(self):
+        self.advance()
+        self._handle = self._loop.call_later(self.tick, self._run)
+
+
+class DispatchedRequest():
+    """A request sent to `to`, waiting for its response.
+
+    :callback: called with the response Broadcast
+    :timeout_callback: called (without arguments) if no response comes in time
+    """
+
+    def __init__(self, to:bytes, callback=None, timeout_callback=None, broadcast=None, nonce:bytes=None):
+        self.to = to
+        self.callback = callback
+        self.timeout_callback = timeout_callback
+        self.broadcast = broadcast
+        self.nonce = nonce # of the request, echoed by its response
+
+        self.timer = None # of the timeout, while waiting
+
+    def call_callback(self, response):
+        if self.callback is not None:
+            self.callback(response)
+
+    def call_timeout_callback(self):
+        if self.timeout_callback is not None:
+            self.timeout_callback()
+
+
+class RequestRegistry():
+    """The dispatched requests of a Node, indexed by destination and nonce.
+
+    A response echoing a request's nonce (`reply_to`) answers that request,
+    so many can be in flight to the same node; one without (e.g. a 0.1
+    broadcast) answers the oldest request waiting on its sender. Both found
+    in O(1). A request not answered within its timeout is removed and its
+    `timeout_callback` called, by the `timers` wheel.
+    """
+
+    def __init__(self, timers:TimerWheel=None):
+        self.timers = timers if timers is not None else TimerWheel()
+
+        self._by_to = {} # to: OrderedDict of requests, oldest first
+        self._by_nonce = {} # (to, nonce): request
+
+    def __len__(self):
+        return sum(len(requests) for requests in self._by_to.values())
+
+    def __iter__(self):
+        for requests in list(self._by_to.values()):
+            yield from list(requests)
+
+    def waiting_on(self, to:bytes) -> int:
+        """The number of requests waiting on a response from `to`."""
+        return len(self._by_to.get(to, ()))
+
+    def add(self, request:DispatchedRequest, timeout:float=10.0):
+        self._by_to.setdefault(request.to, OrderedDict())[request] = None
+        if request.nonce is not None:
+            self._by_nonce[(request.to, request.nonce)] = request
+
+        request.timer = self.timers.schedule(timeout, lambda: self._timed_out(request))
+
+    def remove(self, request:DispatchedRequest):
+        """Stops waiting on `request` (without calling anything)."""
+
+        requests = self._by_to.get(request.to)
+        if requests is None or request not in requests:
+            return
+
+        del requests[request]
+        if not requests:
+            del self._by_to[request.to]
+
+        if request.nonce is not None:
+            self._by_nonce.pop((request.to, request.nonce), None)
+
+        request.timer.cancel()
+
+    def response_received(self, response) -> DispatchedRequest:
+        """Gives a response Broadcast to the request it replies to (or the
+        oldest waiting on its sender), returns that request (None if there
+        wasn't one)."""
+
+        reply_to = getattr(response, 'reply_to', None)
+        if reply_to is not None:
+            request = self._by_nonce.get((response.frm, reply_to))
+        else:
+            requests = self._by_to.get(response.frm)
+            request = next(iter(requests)) if requests else None
+
+        if request is None:
+            return None
+
+        self.remove(request)
+        request.call_callback(response)
+
+        return request
+
+    def _timed_out(self, request:DispatchedRequest):
+        self.remove(request)
+        request.call_timeout_callback()
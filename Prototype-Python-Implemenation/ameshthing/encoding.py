@@ -16,309 +16,880 @@ Spec:
         Action Parameter = $[name]|[type]|[meta];
     Node = node<[p...;]...|[^action(...);]...|node-info-dict>
 
+    String table (opt-in) = R[object], within which:
+        defining string = S[len]:[val] (a string, also added to the table)
+        reference = r[table index]; (the string at that index)
+
 """
 
 # from .node import BaseNode
-from .constructs import BaseNode, Property, Action, ActionParameter
-from .types import types
+from .constructs import BaseNode, Property, Action, ActionParameter, BAD_NAME_CHARS
+from .types import types_by_tag
 
 from .exceptions import EncodingError, DecodingError
 
+from collections.abc import Mapping
+
 
 def utf8bytes(obj):
     """Takes an object and converts it to a byte string"""
     return bytes(str(obj), 'utf-8')
 
-def encode(obj, force_type=None):
-    """Preliminary function used by encode().
-    Encodes python objects to a python string.
-    Byte strings (i.e. b'...') and unicode are encoded with
-    the correct length as utf-8 even though as a pre utf-8
-    python string len == 1.
+def encode(obj, force_type=None, refs=False):
+    """Encodes ('dumps') a python object into a byte string of $name encoding.
 
-    ** Warning: Never use this outside of encoding.encode()
+    Strings (and names) are utf-8 encoded, lengths being of the encoded bytes.
+    Dict keys are sorted, so equal objects always encode the same.
 
-    Note: string lengths need to be corrected by
-    encoding return as utf-8 outside this function.
+    :force_type: 'I' to encode an int as the (proposed) 64 bit `I` type.
+    :refs: use a string table (`R`), strings after their first use are
+        written as a short reference to it. Smaller when keys and values
+        repeat (node structs, saves), at some cost in speed.
     """
 
-    if obj == None:
-        return b'\x00'
-
-    if type(obj) is bool:
-        return b'T' if obj else b'F'
-
-    if type(obj) is int:
-        if force_type == 'I':
-            return b'I' + utf8bytes(obj) + b';'
-
-        return b'i' + utf8bytes(obj) + b';'
+    buf = bytearray()
+    if refs:
+        buf += b'R'
+        _encode_refs(obj, buf, {})
+    else:
+        encode_into(obj, buf, force_type)
+    return bytes(buf)
+
+def encode_into(obj, buf:bytearray, force_type=None):
+    """Encodes `obj`, appending it to the end of `buf` (a bytearray).
+
+    Everything is written into the one growable buffer, so nested
+    lists and dicts are linear in their size.
+    >>> buf = bytearray(b'l')
+    >>> for reading in readings: encode_into(reading, buf)
+    >>> buf += b';'
+    """
 
-    if type(obj) is float:
-        return b'f' + utf8bytes(obj) + b';'
+    if force_type == 'I' and type(obj) is int:
+        buf += b'I%d;' % obj
+        return
+
+    enc = _ENCODERS.get(type(obj))
+    if enc is None:
+        enc = _encoder_for_subclass(obj)
+    enc(obj, buf)
+
+
+def _encode_null(obj, buf):
+    buf += b'\x00'
+
+def _encode_bool(obj, buf):
+    buf += b'T' if obj else b'F'
+
+def _encode_int(obj, buf):
+    buf += b'i%d;' % obj
+
+def _encode_float(obj, buf):
+    buf += b'f%s;' % utf8bytes(obj)
+
+def _encode_str(obj, buf):
+    encoded = obj.encode('utf-8')
+    buf += b's%d:' % len(encoded)
+    buf += encoded
+
+def _encode_bytes(obj, buf): # use z for bytes or base64 data, also bytearray
+    buf += b'z%d:' % len(obj)
+    buf += obj
+
+def _encode_memoryview(obj, buf): # appended straight from the viewed buffer
+    buf += b'z%d:' % obj.nbytes
+    buf += obj
+
+def _encode_list(obj, buf):
+    encoder_for = _ENCODERS.get
+    buf += b'l'
+    for elem in obj:
+        (encoder_for(type(elem)) or _encoder_for_subclass(elem))(elem, buf)
+    buf += b';'
+
+def _encode_dict(obj, buf):
+    encoder_for = _ENCODERS.get
+    buf += b'd'
+    for key in sorted(obj):
+        value = obj[key]
+        (encoder_for(type(key)) or _encoder_for_subclass(key))(key, buf)
+        (encoder_for(type(value)) or _encoder_for_subclass(value))(value, buf)
+    buf += b';'
+
+## Special Types
+
+def _encode_property(obj, buf):
+    encoded = obj._encoded
+    if encoded is None: # cached on the property until its value or meta is set
+        segment = bytearray(b'p%s|%s|' % (utf8bytes(obj.name), utf8bytes(obj._type.repr)))
+        encode_into(obj._value, segment)
+        segment += b'|'
+        encode_into(obj._meta, segment)
+        segment += b';'
+        encoded = obj._encoded = bytes(segment)
+    buf += encoded
+
+def _encode_action(obj, buf):
+    buf += b'^%s(' % utf8bytes(obj.name)
+    for param in obj.action_parameters: # combine one after the other
+        _encode_action_parameter(param, buf)
+    buf += b')%s;' % utf8bytes(obj.return_type.repr)
+
+def _encode_action_parameter(obj, buf):
+    buf += b'$%s|%s|' % (utf8bytes(obj.name), utf8bytes(obj._type.repr))
+    encode_into(obj.meta, buf)
+    buf += b';'
+
+def _encode_node(obj, buf):
+    """Joins the cached encoding of each property, of the actions, and of
+    the node info; only those changed since last time are encoded again."""
+
+    buf += b'node<'
+    for p in obj.properties.values():
+        encoded = p._encoded
+        if encoded is None:
+            _encode_property(p, buf)
+        else:
+            buf += encoded
+    buf += b'|'
+
+    actions = obj._encoded_actions
+    if actions is None:
+        segment = bytearray()
+        for a in obj.actions.values():
+            _encode_action(a, segment)
+        actions = obj._encoded_actions = bytes(segment)
+    buf += actions
+    buf += b'|'
+
+    node_info = obj.node_info # (a Node fills it in first, if out of date)
+    encoded = obj._encoded_node_info
+    if encoded is None:
+        segment = bytearray()
+        encode_into(node_info, segment)
+        encoded = obj._encoded_node_info = bytes(segment)
+    buf += encoded
+    buf += b'>'
+
+
+## String table mode
+
+# strings shorter (when utf-8 encoded) are not added to the table, their
+# reference would be no shorter
+_REF_MIN_LEN = 3
+
+def _encode_refs(obj, buf, table):
+    """Encodes `obj` within a string table (`R`), `table` being {string: index}
+    of the strings defined (`S`) so far.
+
+    Only strings differ from the normal encoding, so any object holding none
+    (or already encoded, such as a `LazyDict`) is encoded as normal.
+    """
 
     if isinstance(obj, str):
-        return b's' + utf8bytes(len(obj.encode('utf-8'))) + b':' + obj.encode('utf-8')
-
-    if isinstance(obj, bytes): # use z for bytes or base64 data
-
-        return b'z' + utf8bytes(len(obj)) + b':' + obj
-
-    if isinstance(obj, list):
-        res = b'l'
+        index = table.get(obj)
+        if index is not None:
+            buf += b'r%d;' % index
+            return
+
+        encoded = obj.encode('utf-8')
+        if len(encoded) < _REF_MIN_LEN:
+            buf += b's%d:' % len(encoded)
+        else:
+            table[obj] = len(table)
+            buf += b'S%d:' % len(encoded)
+        buf += encoded
+
+    elif isinstance(obj, list):
+        buf += b'l'
         for elem in obj:
-            res += encode(elem)
-        return res + b';'
-
-    if isinstance(obj, dict):
-        res = b'd'
-        for key in sorted(obj.keys()):
-            res += encode(key) + encode(obj[key])
-        return res + b';'
-
-    ## Special Types
-
-    if type(obj) is Property:
-        return b'p%s|%s|%s|%s;' % (
-            utf8bytes(obj.name), utf8bytes(obj._type.repr),
-            encode(obj.value), encode(obj.meta))
-
-    if type(obj) is Action:
-        encoded_params = []
-        if len(obj.action_parameters) > 0:
-            encoded_params = [encode(param) for param in obj.action_parameters]
-
-        return b'^%s(%s)%s;' % (
-                utf8bytes(obj.name),
-                b''.join(encoded_params), # combine one after the other
-                utf8bytes(obj.return_type.repr)
-                )
-
-    if type(obj) is ActionParameter:
-        return b'$%s|%s|%s;' % (utf8bytes(obj.name), utf8bytes(obj._type.repr), encode(obj.meta))
-
-
-    if isinstance(obj, BaseNode): # isinstance used so subclasses are included.
-        encoded_actions = [encode(a) for a in obj.actions.values()]
-        encoded_properties = [encode(p) for p in obj.properties.values()]
-
-        return b'node<%s|%s|%s>' % (
-                b''.join(encoded_properties),
-                b''.join(encoded_actions),
-                encode(obj.node_info)
-        )
-
-
-    raise EncodingError('Unknown object type when encoding: %s' %repr(obj))
-
-
-
+            _encode_refs(elem, buf, table)
+        buf += b';'
+
+    elif isinstance(obj, dict):
+        buf += b'd'
+        for key in sorted(obj):
+            _encode_refs(key, buf, table)
+            _encode_refs(obj[key], buf, table)
+        buf += b';'
+
+    elif type(obj) is Property: # not the cached encoding, it has no references
+        buf += b'p%s|%s|' % (utf8bytes(obj.name), utf8bytes(obj._type.repr))
+        _encode_refs(obj._value, buf, table)
+        buf += b'|'
+        _encode_refs(obj._meta, buf, table)
+        buf += b';'
+
+    elif type(obj) is ActionParameter:
+        buf += b'$%s|%s|' % (utf8bytes(obj.name), utf8bytes(obj._type.repr))
+        _encode_refs(obj.meta, buf, table)
+        buf += b';'
+
+    elif type(obj) is Action:
+        buf += b'^%s(' % utf8bytes(obj.name)
+        for param in obj.action_parameters:
+            _encode_refs(param, buf, table)
+        buf += b')%s;' % utf8bytes(obj.return_type.repr)
+
+    elif isinstance(obj, BaseNode):
+        buf += b'node<'
+        for p in obj.properties.values():
+            _encode_refs(p, buf, table)
+        buf += b'|'
+        for a in obj.actions.values():
+            _encode_refs(a, buf, table)
+        buf += b'|'
+        _encode_refs(obj.node_info, buf, table)
+        buf += b'>'
+
+    else:
+        encode_into(obj, buf)
+
+
+# exact type -> encoder, subclasses are added by `_encoder_for_subclass`
+_ENCODERS = {
+    type(None): _encode_null,
+    bool: _encode_bool,
+    int: _encode_int,
+    float: _encode_float,
+    str: _encode_str,
+    bytes: _encode_bytes,
+    bytearray: _encode_bytes,
+    memoryview: _encode_memoryview,
+    list: _encode_list,
+    dict: _encode_dict,
+    Property: _encode_property,
+    Action: _encode_action,
+    ActionParameter: _encode_action_parameter,
+    BaseNode: _encode_node,
+}
+
+def _encoder_for_subclass(obj):
+    """Finds (and remembers) the encoder for a subclass of an encodable type."""
+
+    if isinstance(obj, BaseNode): # isinstance used so subclasses (i.e. Node) are included.
+        enc = _encode_node
+    elif isinstance(obj, str):
+        enc = _encode_str
+    elif isinstance(obj, bytes):
+        enc = _encode_bytes
+    elif isinstance(obj, list):
+        enc = _encode_list
+    elif isinstance(obj, dict):
+        enc = _encode_dict
+    else:
+        raise EncodingError('Unknown object type when encoding: %s' %repr(obj))
+
+    _ENCODERS[type(obj)] = enc
+    return enc
+
+
+
+
+
+
+
+# Tag bytes, precomputed so the decoder compares ints rather than building
+# one byte strings (or calling `ord`) for every object.
+_NULL, _TRUE, _FALSE = 0x00, ord('T'), ord('F')
+_INT, _FLOAT, _STR, _BIN = ord('i'), ord('f'), ord('s'), ord('z')
+_LIST, _DICT, _END = ord('l'), ord('d'), ord(';')
+_PROP, _PARAM, _ACTION, _NODE = ord('p'), ord('$'), ord('^'), ord('n')
+_PARAMS_END, _PIPE, _NODE_END = ord(')'), ord('|'), ord('>')
+_REFS, _DEF_STR, _REF = ord('R'), ord('S'), ord('r')
+_STRING_TAGS = frozenset((_STR, _BIN, _DEF_STR)) # (one check in the decoding loop)
+
+# type_T (or None) by tag byte, indexed rather than looked up
+_TYPE_FOR_TAG = [types_by_tag.get(tag) for tag in range(256)]
+
+# Decoding container kinds (`None` is the top level)
+_K_LIST, _K_DICT, _K_PROP, _K_PARAM, _K_ACTION, _K_NODE = range(6)
+
+# used to make sure decoding does not go deep enough to cause vulnerability
+MAX_DEPTH = 200
+
+# a string/bytes length longer than this many digits is treated as garbage
+# rather than waited for, so a bad stream cannot be buffered forever
+_MAX_LENGTH_DIGITS = 20
+# the same for numbers (and string table references) before their ';', as
+# many as python reads as an int by default
+_MAX_NUMBER_DIGITS = 4300
+# and the names of properties, parameters, and actions
+_MAX_NAME_LENGTH = 1024
+
+
+def _end_not_found(size, pos, most, what):
+    """For a token at `pos` whose end isn't in the data: `_EndOfData` (it may
+    yet come) unless more than `most` bytes of it are already there."""
+
+    if size - pos > most:
+        raise DecodingError('End of %s not found' % what, pos)
+    raise _EndOfData
+
+
+class _EndOfData(Exception):
+    """Raised within `_decode` when a token runs past the end of the data."""
+
+# returned by `_decode` in place of an object when the data ran out
+_INCOMPLETE = object()
+
+
+def _decode(data, pos, frames=None, view=None):
+    """Decodes one object starting at `pos`, returns (object, end position).
 
+    Iterative: the container being filled is held in locals (`kind`, `obj`,
+    `state`, `key`) and enclosing containers are pushed on an explicit stack
+    rather than the python call stack. Each pass of the loop reads one
+    token; a finished value is then handed to its container, closing
+    (and handing up) containers whose end has been reached.
 
+    `frames` makes decoding resumable (see `StreamDecoder`): when given, it
+    is used as the stack, and running out of data saves the container in
+    progress onto it and returns (_INCOMPLETE, start of the unfinished
+    token). Calling again with the same list, more data and that position
+    carries on. Without it running out of data is a `DecodingError`.
 
+    `view`, a memoryview of `data`, is sliced for binary ('z') values
+    instead of copying them out of `data`.
+    """
 
-def decode(data:bytes):
+    find = data.find
+    size = len(data)
+    STR, BIN, INT, NULL, TRUE, FALSE, FLOAT, END = _STR, _BIN, _INT, _NULL, _TRUE, _FALSE, _FLOAT, _END
+    PARAMS_END, PIPE, NODE_END, DICT, LIST, DEF_STR = _PARAMS_END, _PIPE, _NODE_END, _DICT, _LIST, _DEF_STR
+    type_for_tag = _TYPE_FOR_TAG
+    STRING_TAGS = _STRING_TAGS
+    new_property = Property.__new__
+    K_LIST, K_DICT, K_PROP, K_PARAM, K_ACTION, K_NODE = _K_LIST, _K_DICT, _K_PROP, _K_PARAM, _K_ACTION, _K_NODE
+
+    refs = None # the string table, if in one ('R')
+
+    if frames is None:
+        stack = []
+        kind = obj = state = key = None
+    elif frames: # resuming, see the end
+        stack = frames
+        kind, obj, state, key = stack.pop()
+        refs = stack.pop()
+    else:
+        stack = frames
+        kind = obj = state = key = None
+
+    # Nothing is changed until a token has been read in full, so when the data
+    # runs out (`IndexError` or `_EndOfData`) `pos` is still the token start.
+    # Closing bytes are tokens too (so checked), a container is only handed
+    # back once its end has been read.
+    try:
+        while True:
+            c = data[pos]
+
+            if c in STRING_TAGS:
+                # most lengths are one or two digits, read those without slicing
+                length = data[pos+1] - 48
+                if data[pos+2] == 58 and 0 <= length <= 9: # ':'
+                    start = pos + 3
+                elif 0 <= length <= 9 and 48 <= data[pos+2] <= 57 and data[pos+3] == 58:
+                    length = length * 10 + data[pos+2] - 48
+                    start = pos + 4
+                else:
+                    lenend = find(b':', pos)
+                    if lenend == -1: _end_not_found(size, pos, _MAX_LENGTH_DIGITS + 1, 'length')
+
+                    try: length = int(data[pos+1:lenend], 10)
+                    except ValueError: raise DecodingError("Could not get length of string or bytes", pos) from None
+                    start = lenend + 1
+
+                end = start + length
+                if end > size:
+                    raise _EndOfData
+
+                if c == STR: # normal string
+                    value = data[start:end].decode() # (utf-8)
+
+                elif c == BIN: # byte string, retained as bytes
+                    if view is not None:
+                        value = view[start:end]
+                    else:
+                        value = data[start:end]
+                        if type(value) is not bytes: # streamed data is a bytearray
+                            value = bytes(value)
+
+                elif refs is None:
+                    raise DecodingError("'S' string outside a string table", pos)
+
+                else: # string defined in the table
+                    value = data[start:end].decode()
+                    refs.append(value)
+
+                pos = end
+                if kind == K_DICT: # handed to the dict here, the most common case
+                    if state:
+                        obj[key] = value
+                        state = False
+                    else: # key, next comes its value
+                        key = value
+                        state = True
+                    continue
+
+            elif c == INT:
+                value = data[pos+1] - 48
+                if 0 <= value <= 9 and data[pos+2] == END: # single digit
+                    pos += 3
+                else:
+                    end = find(b';', pos)
+                    if end == -1: _end_not_found(size, pos, _MAX_NUMBER_DIGITS + 1, 'integer')
+
+                    try: value = int(data[pos+1:end], 10)
+                    except ValueError: raise DecodingError("Expected integer number (or ';')", pos+1) from None
+                    pos = end + 1
+
+            elif c == END: # end of a list, dict, property, or parameter
+                if not ((kind == K_DICT and not state) or (kind == K_PROP and state == 3)
+                        or kind == K_LIST or (kind == K_PARAM and state)):
+                    raise DecodingError("Unexpected ';'", pos)
+                value = obj
+                pos += 1
+                kind, obj, state, key = stack.pop()
+
+                if kind == K_PROP and state == 2 and pos < size and data[pos] == END:
+                    obj._meta = value # a property's meta, read with its end
+                    value = obj
+                    pos += 1
+                    kind, obj, state, key = stack.pop()
+
+                    if kind == K_NODE and state == 0 and value._name not in obj.properties:
+                        obj.properties[value._name] = value # (a duplicate is an error below)
+                        continue
+
+            elif c == DICT or c == _PROP or c == LIST or c == _PARAM or c == _ACTION or c == _NODE:
+                # start of a container, its header is read before pushing
+                if len(stack) >= MAX_DEPTH:
+                    raise RecursionError('Depth of decode tree too deep. Max=%i.' % MAX_DEPTH)
+
+                if c == DICT:
+                    stack.append((kind, obj, state, key))
+                    kind, obj, state = K_DICT, {}, False # state: have key
+                    pos += 1
+
+                elif c == _PROP or c == _PARAM:
+                    name_end = find(b'|', pos+1)
+                    if name_end == -1: _end_not_found(size, pos, _MAX_NAME_LENGTH + 1, 'name')
+
+                    name = data[pos+1:name_end].decode()
+
+                    type_ = type_for_tag[data[name_end+1]]
+                    if type_ is None:
+                        raise DecodingError('Could not determin the type of the %s'
+                            % ('property' if c == _PROP else 'paramerter'), name_end+1)
+
+                    if data[name_end+2] != PIPE:
+                        raise DecodingError("Expected '|' after the type", name_end+2)
+
+                    if c == _PROP and name in BAD_NAME_CHARS and name != '': # as `BaseConstruct` checks
+                        raise DecodingError('Invalid property name', pos+1)
+
+                    stack.append((kind, obj, state, key))
+                    if c == _PROP: # state: 0 value, 1 '|', 2 meta, 3 ';'
+                        # made without `__init__`, as its name and type are
+                        # checked, and it has no encoding yet
+                        obj = new_property(Property)
+                        obj._name, obj._type, obj._value, obj._meta, obj._encoded = name, type_, None, None, None
+                        kind, state = K_PROP, 0
+                    else: # state: has meta
+                        kind, obj, state = K_PARAM, ActionParameter(name, type_), False
+
+                    pos = name_end + 3 # skip type and pipe
+
+                elif c == LIST:
+                    stack.append((kind, obj, state, key))
+                    kind, obj = K_LIST, []
+                    pos += 1
+
+                elif c == _ACTION: # '^%s(%joined-params)%s;'
+                    name_end = find(b'(', pos+1)
+                    if name_end == -1: _end_not_found(size, pos, _MAX_NAME_LENGTH + 1, 'name')
+
+                    stack.append((kind, obj, state, key))
+                    kind, obj, key = K_ACTION, [], str(data[pos+1:name_end], 'utf-8') # params, name
+                    pos = name_end + 1
+
+                elif c == _NODE and data.startswith(b'node<', pos):
+                    stack.append((kind, obj, state, key))
+                    kind, obj, state = K_NODE, BaseNode(), 0 # state: 0 props, 1 actions, 2 info, 3 '>'
+                    pos += 5
+
+                elif size - pos < 5 and b'node<'.startswith(data[pos:]):
+                    raise _EndOfData
+
+                else:
+                    raise DecodingError("'%s' charater not valid as encoding object start" % chr(c), pos)
+
+                continue
+
+            elif c == NODE_END and kind == K_NODE and state == 3:
+                value = obj
+                pos += 1
+                kind, obj, state, key = stack.pop()
+
+            elif c == NULL:
+                value = None
+                pos += 1
+
+            elif c == TRUE or c == FALSE:
+                value = c == TRUE
+                pos += 1
+
+            elif c == FLOAT:
+                end = find(b';', pos)
+                if end == -1: _end_not_found(size, pos, _MAX_NUMBER_DIGITS + 1, 'float')
+
+                try: value = float(data[pos+1:end])
+                except ValueError: raise DecodingError('Could not convert float', pos) from None
+                pos = end + 1
+
+            elif c == PARAMS_END and kind == K_ACTION: # end of action '...)T;'
+                return_type = type_for_tag[data[pos+1]]
+                if return_type is None:
+                    raise DecodingError('Could not determin the return type of the action', pos+1)
+                if data[pos+2] != END:
+                    raise DecodingError("Expected ';' after the action", pos+2)
+
+                value = Action(key, None, obj, return_type)
+                pos += 3
+                kind, obj, state, key = stack.pop()
+
+            elif c == PIPE and ((kind == K_NODE and state < 2) or (kind == K_PROP and state == 1)):
+                state += 1 # end of node section, or property value
+                pos += 1
+                continue
+
+            elif c == _REF:
+                end = find(b';', pos)
+                if end == -1: _end_not_found(size, pos, _MAX_NUMBER_DIGITS + 1, 'reference')
+                if refs is None:
+                    raise DecodingError("'r' reference outside a string table", pos)
+
+                try: index = int(data[pos+1:end], 10)
+                except ValueError: index = -1
+                if not 0 <= index < len(refs):
+                    raise DecodingError('Invalid string table reference', pos)
+                value = refs[index]
+                pos = end + 1
+
+            elif c == _REFS and kind is None and refs is None: # string table for the object
+                refs = []
+                pos += 1
+                continue
+
+            else:
+                raise DecodingError("'%s' charater not valid as encoding object start" % chr(c), pos)
+
+            # Hand the value to its container (closing bytes are read as tokens)
+            if kind == K_DICT:
+                if state:
+                    obj[key] = value
+                    state = False
+                else: # non-string key
+                    key = value
+                    state = True
+
+            elif kind == K_PROP: # (a new Property, its encoding isn't cached)
+                if state == 0:
+                    obj._value = value
+                    if pos + 1 < size and data[pos] == PIPE: # read with the value
+                        pos += 1
+                        state = 1
+                        if data[pos] == DICT and len(stack) < MAX_DEPTH: # and the meta's start
+                            stack.append((kind, obj, 2, key))
+                            kind, obj, state = K_DICT, {}, False
+                            pos += 1
+                            continue
+                elif state == 2:
+                    obj._meta = value
+                else:
+                    raise DecodingError("Expected '%s' in property" % ('|' if state == 1 else ';'), pos)
+                state += 1
+
+            elif kind == K_LIST:
+                obj.append(value)
+
+            elif kind == K_NODE:
+                if state == 0:
+                    if type(value) is not Property or value._name in obj.properties:
+                        raise DecodingError('Issue parsing node properties', pos)
+                    obj.properties[value._name] = value
+
+                elif state == 1:
+                    if type(value) is not Action or value.name in obj.actions:
+                        raise DecodingError('Issue parsing node actions', pos)
+                    obj.actions[value.name] = value
+
+                elif state == 2:
+                    obj.node_info = value
+                    state = 3
+
+                else:
+                    raise DecodingError("Expected '>' at end of node", pos)
+
+            elif kind is None:
+                return value, pos
+
+            elif kind == K_PARAM:
+                if state:
+                    raise DecodingError("Expected ';' after parameter", pos)
+                obj.meta = value
+                state = True
+
+            else: # K_ACTION
+                if type(value) is not ActionParameter:
+                    raise DecodingError('Expected action parameter or end of parameters', pos)
+                obj.append(value)
+
+    except (IndexError, _EndOfData):
+        if frames is None:
+            raise DecodingError('Unexpected end of data', pos) from None
+
+        stack.append(refs)
+        stack.append((kind, obj, state, key))
+        return _INCOMPLETE, pos
+
+
+def decode(data:bytes, zero_copy=False):
     """Decodes ('loads') a byte string of $name encoding into a python object.
 
     Note: bytestrings are utf-8 encoded, thus are decoded to python strings
     on decoding. Data marked as binnary (with 'z') is infered as base 64 data
     and represented as a bytearray.
+
+    :zero_copy: binary ('z') values are `memoryview` slices of `data` rather
+        than copies, which keep `data` alive. `data` may also be a bytearray,
+        which can not be resized while any of the slices exist.
     """
 
-    if type(data) != bytes:
+    if type(data) != bytes and not (zero_copy and type(data) == bytearray):
         raise TypeError('a bytes-like object is required, not \'%s\'' % type(data).__name__)
 
-    # used to make sure decoding does not go deep enough to cause vulnerability
-    max_depth = 200
-    cur_depth = 0
-
-    def decode_next(start):
-        nonlocal cur_depth
-
-        if len(data) <= start:
-            raise DecodingError('Unexpected end of data', start)
-
-        # print('decode depth =',cur_depth)
-        if cur_depth > max_depth:
-            raise RecursionError('Depth of decode tree too deep. Max=%i.' % max_depth)
+    try:
+        if zero_copy:
+            return _decode(data, 0, None, memoryview(data))[0]
+        return _decode(data, 0)[0]
+    except (DecodingError, RecursionError):
+        raise
+    except Exception:
+        raise DecodingError('Unknown encoding error') from None
 
-        if data[start] == ord('\x00'):
-            return None, start + 1
 
-        if data[start] == ord('T') or data[start] == ord('F'):
-            return (data[start] == ord('T')), start + 1
+def decode_at(data:bytes, pos:int):
+    """Decodes the object starting at `pos` within `data` (which may go on past
+    it), returns (object, position after it). For reading encoded values
+    embedded in other data without slicing them out first.
+    """
 
-        if data[start] == ord('i'):
-            end = data.find(ord(';'), start)
+    try:
+        return _decode(data, pos)
+    except (DecodingError, RecursionError):
+        raise
+    except Exception:
+        raise DecodingError('Unknown encoding error', pos) from None
 
-            try:
-                return int(data[start+1:end], 10), end + 1
-            except ValueError:
-                raise DecodingError("Expected integer number (or ';')", start+2) from None
 
-        if data[start] == ord('f'):
-            end = data.find(ord(';'), start)
+def _skip(data, pos):
+    """Returns the end position of the object starting at `pos`, scanning over
+    it without decoding it. Strings and bytes are jumped by their length, so
+    large values cost nothing. Values are not validated (e.g. utf-8, numbers).
+    """
 
-            if end == -1: raise DecodingError('End of float not found', start)
+    find = data.find
+    size = len(data)
+    depth = 0
 
-            try:
-                return float(data[start+1:end]), end + 1
-            except:
-                raise DecodingError('Could not convert float', start) from None
+    while True:
+        c = data[pos]
 
-        if data[start] == ord('l'):
-            cur_depth += 1
-            res = []
-            start += 1
+        if c == _STR or c == _BIN:
+            lenend = find(b':', pos)
+            try: length = int(data[pos+1:lenend], 10) if lenend != -1 else -1
+            except ValueError: length = -1
+            if length < 0: raise DecodingError('Could not get length of string or bytes', pos)
+            pos = lenend + 1 + length
 
-            try:
-                while data[start] != ord(';'):
-                    elem, start = decode_next(start)
-                    res.append(elem)
-            except IndexError:
-                raise DecodingError('Unexpected end of list (no end) ', start-1) from None
+        elif c == _INT or c == _FLOAT:
+            end = find(b';', pos)
+            if end == -1: raise DecodingError('Unexpected end of data', pos)
+            pos = end + 1
 
-            cur_depth -= 1
+        elif c == _NULL or c == _TRUE or c == _FALSE:
+            pos += 1
 
+        elif c == _LIST or c == _DICT:
+            if depth >= MAX_DEPTH:
+                raise RecursionError('Depth of decode tree too deep. Max=%i.' % MAX_DEPTH)
+            depth += 1
+            pos += 1
 
-            return res, start + 1
+        elif c == _END:
+            if depth == 0: raise DecodingError("Unexpected ';'", pos)
+            depth -= 1
+            pos += 1
 
-        if data[start] == ord('d'):
-            cur_depth += 1
-            res = {}
-            start += 1
+        else: # properties, actions and nodes are rare in payloads, decode them
+            pos = _decode(data, pos)[1]
 
-            try:
-                while data[start] != ord(';'):
-                    key, start = decode_next(start)
-                    value, start = decode_next(start)
-                    res[key] = value
-            except IndexError:
-                raise DecodingError('Unexpected end of dict (no end) ', start-1) from None
+        if depth == 0:
+            if pos > size: raise DecodingError('Unexpected end of data', size)
+            return pos
 
-            cur_depth -= 1
-            return res, start + 1
 
+class LazyDict(Mapping):
+    """A read only dict over an encoded dict ('d...;'), values are only decoded
+    when accessed. Keys are found with one scan over the data, skipping the
+    values, so e.g. large binary values nobody looks at cost close to nothing.
 
-        if data[start] == ord('p'):
-            name_end = data.find(b'|', start+1)
-            name = str(data[start+1:name_end], 'utf-8')
+    Compares equal to a dict with the same items. Encoding it writes the
+    original bytes back out.
+    """
 
-            type_byte = chr(data[name_end+1])
-            try: type_ = [t for t in types if t.repr==type_byte][0]
-            except: raise DecodingError('Could not determin the type of the property', name_end+1)
+    def __init__(self, data:bytes, pos:int=0):
+        """Indexes the dict at `pos` in `data`, raises `DecodingError` if it is
+        not a well formed dict (invalid values are only found on access)."""
 
-            p = Property(name, type_)
+        if data[pos:pos+1] != b'd':
+            raise DecodingError('Expected a dict', pos)
 
-            try:
-                p.value, meta_start = decode_next(name_end+3)
-            except DecodingError:
-                raise DecodingError('Could not get propety value, format incorrect', name_end+3)
+        self._data = data
+        self._start = pos
+        self._values = {} # key: decoded value
+        self._offsets = {} # key: position of (not yet decoded) value
 
-            p.meta, last = decode_next(meta_start+1)
+        try:
+            pos += 1
+            while data[pos] != _END:
+                key, pos = _decode(data, pos)
+                if data[pos] == _END: raise DecodingError("Unexpected ';'", pos)
 
-            return p, last + 1
+                self._offsets[key] = pos
+                pos = _skip(data, pos)
+        except (DecodingError, RecursionError):
+            raise
+        except IndexError:
+            raise DecodingError('Unexpected end of data', len(data)) from None
+        except TypeError: # unhashable key
+            raise DecodingError('Dict key not hashable', pos) from None
 
-        if data[start] == ord('$'): # action param
-            name_end = data.find(b'|', start+1)
-            name = str(data[start+1:name_end], 'utf-8')
+        self._end = pos + 1
 
-            type_byte = chr(data[name_end+1])
-            try: type_ = [t for t in types if t.repr==type_byte][0]
-            except: raise DecodingError('Could not determin the type of the paramerter', name_end+1)
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
 
-            ap = ActionParameter(name, type_)
-            ap.meta, end = decode_next(name_end+3)
+        pos = self._offsets[key] # KeyError if not in the dict
+        try:
+            value = _decode(self._data, pos)[0]
+        except (DecodingError, RecursionError):
+            raise
+        except Exception:
+            raise DecodingError('Unknown encoding error', pos) from None
 
-            return ap, end + 1
+        self._values[key] = value
+        return value
 
-        if data[start] == ord('^'): # action '^%s(%joined-list)%s;'
-            name_end = data.find(b'(', start+1)
-            name = str(data[start+1:name_end], 'utf-8')
+    def __iter__(self):
+        return iter(self._offsets)
 
-            a = Action(name)
+    def __len__(self):
+        return len(self._offsets)
 
-            start = name_end + 1
+    def __contains__(self, key):
+        return key in self._offsets
 
-            cur_depth += 1
-            while data[start] != ord(')'):
-                if data[start] != ord('$'):
-                    raise DecodingError('Expected action parameter or end of parameters', start)
+    def __repr__(self):
+        return 'LazyDict(%i keys)' % len(self._offsets)
 
-                ap, start = decode_next(start)
-                a.action_parameters.append(ap)
-            cur_depth -= 1
+    @property
+    def raw_bytes(self):
+        """The encoded dict this was made from."""
+        return self._data[self._start:self._end]
 
-            try:
-                type_byte = chr(data[start + 1])
-                type_ = [t for t in types if t.repr==type_byte][0]
-            except: raise DecodingError('Could not determin the return type of the action', name_end+1)
 
+def _encode_lazy_dict(obj, buf):
+    buf += obj.raw_bytes
 
-            return a, start + 3 # 3 -> ')T;'
+_ENCODERS[LazyDict] = _encode_lazy_dict
 
-        if data[start:start+4] == b'node': # node
-            n = BaseNode()
-            start += 5
 
-            cur_depth += 1
-            try:
-                while data[start] != ord('|'): # get props
-                    p, start = decode_next(start)
-                    n.add_property(p)
-            except: raise DecodingError('Issue parsing node properties', start) from None
-            cur_depth -= 1
+def decode_lazy(data:bytes):
+    """Like `decode`, except a top level dict is returned as a `LazyDict`."""
 
-            start += 1 # skip over pipe to action section
+    if data[:1] == b'd':
+        if type(data) != bytes:
+            raise TypeError('a bytes-like object is required, not \'%s\'' % type(data).__name__)
+        return LazyDict(data)
 
+    return decode(data)
 
-            cur_depth += 1
-            try:
-                while data[start] != ord('|'): # get actions
-                    a, start = decode_next(start)
-                    n.add_action(a)
-            except: raise DecodingError('Issue parsing node actions', start)
-            cur_depth -= 1
 
-            try: n.node_info, start = decode_next(start+1)
-            except DecodingError: raise DecodingError('Could not parse node info') from None
+class StreamDecoder():
+    """Incrementally decodes a stream of top-level objects arriving in chunks.
 
-            return n, start + 1
+    Data is given to `feed` as it arrives; iterating (or `next`) returns each
+    object once the whole of it has been fed. Parse state is kept between
+    chunks so a large object is read once rather than re-scanned on every
+    chunk, and bytes already parsed are dropped from the buffer.
 
+        decoder = StreamDecoder()
+        for chunk in chunks:
+            decoder.feed(chunk)
+            for obj in decoder:
+                handle(obj)
 
-        # if gets here, its a string('s') or bytes('z')
-        if data[start:start+1] not in b'sz':
-            error_message = "'%s' charater not valid as encoding object start" % chr(data[start]),
-            raise DecodingError(error_message, start) from None
+    A `DecodingError` (or `RecursionError`) leaves the decoder unusable.
+    """
 
-        lenend = data.find(ord(':'), start)
+    def __init__(self):
+        self._buffer = bytearray() # unparsed data
+        self._pos = 0 # where parsing resumes
+        self._frames = [] # containers of the partially decoded object
 
-        try: length = int(data[start+1:lenend], 10)
-        except ValueError: raise DecodingError("Could not get length of string or bytes", start) from None
+    def feed(self, data):
+        """Adds a chunk of (bytes-like) data to the stream."""
+        self._buffer += data
 
+    @property
+    def in_object(self):
+        """True when part of an object has been fed but not all of it
+        (e.g. the stream was truncated if it has ended)."""
+        return bool(self._frames) or self._pos != len(self._buffer)
 
-        end = lenend + length + 1
+    def __iter__(self):
+        return self
 
-        value = data[lenend+1:end]
+    def __next__(self):
+        """Returns the next complete object, raises `StopIteration` if
+        more data needs to be fed first."""
 
-        if data[start] == ord('s'): # normal string
-            value = str(value, 'utf-8')
-        # else byte string ('z') as , retain bytestring
+        buffer = self._buffer
+        if self._pos >= len(buffer):
+            raise StopIteration
 
-        return value, end
+        try:
+            obj, pos = _decode(buffer, self._pos, self._frames)
+        except (DecodingError, RecursionError):
+            raise
+        except Exception:
+            raise DecodingError('Unknown encoding error') from None
 
+        # everything before `pos` has been consumed (kept in `_frames` if the
+        # object is incomplete)
+        consumed = min(pos, len(buffer))
+        del buffer[:consumed]
+        self._pos = pos - consumed
 
-    try:
-        return decode_next(0)[0]
-    except RecursionError as e:
-        too_deep = e
-    except DecodingError as e:
-        raise DecodingError(e) from None
-    except:
-        raise DecodingError('Unknown encoding error') from None
+        if obj is _INCOMPLETE:
+            raise StopIteration
+        return obj
 
-    if too_deep: # only reached on RecursionError
-        raise RecursionError(too_deep)
 
 
 
@@ -373,23 +944,3 @@ def __non_recursive_encode_concept(obj):
 
 
     print(out)
-
-# i tried breifly and could not figure it out shortly, may try again later
-def __non_recursive_decode_concept(data:bytes):
-    pass
-    # i tried breifly and could not figure it out shortly, may try again later
-
-    enc = b'li1;i2;i3;;'
-
-    out = None
-
-    cur_out = None
-
-    for c in enc:
-
-        if c == ord('l'):
-            cur_out = []
-
-        if c == ord('i'):
-            if type(cur_out) == list:
-                pass
@@ -35,6 +35,15 @@ class TransmissionError(Exception):
     """Raised the physical transmission fails for some reason."""
     pass
 
+class FrameError(ValueError):
+    """A received frame is malformed, `reason` is short (for counting drops)."""
+
+    def __init__(self, reason, message):
+
+        super().__init__(message)
+
+        self.reason = reason
+
 
 
 class EncodingError(Exception):
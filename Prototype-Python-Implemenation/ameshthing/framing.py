@@ -0,0 +1,260 @@
+"""
+The packet frame around (network encrypted) broadcasts, and containers
+carrying several broadcasts in one frame.
+
+Frame:
+    [version x02][handle(1)][hops(1)][length(2, network order)][data (length bytes)]
+
+`hops` is how many more times the frame may be relayed (see `relayed_frame`),
+outside the encryption so a relay changes nothing else. Version x01 frames,
+without it, are still read (as never relayed), and made for nodes that only
+read those (advertising broadcast version '0.1') and for discovery.
+
+Container (handle x0A), `data` being signed then network encrypted as one:
+    [frm]|[length(2)][plain broadcast][length(2)][plain broadcast]...
+"""
+
+import struct
+from time import monotonic
+
+from .exceptions import FrameError
+
+
+VERSION = 0x02 # of frames made
+VERSION_NO_HOPS = 0x01
+
+HEADERS = {VERSION: struct.Struct('!BBBH'), VERSION_NO_HOPS: struct.Struct('!BBH')}
+
+HANDLE_BROADCAST = 0x01 # normal in-network broadcast
+HANDLE_DISCOVERY = 0x05
+HANDLE_CONTAINER = 0x0A # several broadcasts, one signature and network encryption
+
+FRAME_HEADER_SIZE = 5
+MAX_FRAME_DATA = 0xFFFF
+MAX_HOPS = 0xFF
+
+SIGNATURE_SIZE = 64
+NETWORK_NONCE_SIZE = 8
+
+# signature (64) and network encryption nonce (8) around a container,
+# the least (see `Crypto.network_overhead`)
+CONTAINER_OVERHEAD = SIGNATURE_SIZE + NETWORK_NONCE_SIZE
+
+MIN_BROADCAST_SIZE = 13 # the fixed 0.2 header, any 0.1 broadcast is longer
+
+# the least data a frame of each handle can have, anything less is junk
+MIN_FRAME_DATA = {
+    HANDLE_BROADCAST: CONTAINER_OVERHEAD + MIN_BROADCAST_SIZE,
+    HANDLE_CONTAINER: CONTAINER_OVERHEAD + 2 + 2 + MIN_BROADCAST_SIZE, # frm|, one entry
+    HANDLE_DISCOVERY: SIGNATURE_SIZE + 2 + 1 + 4, # v|POLO at least
+}
+
+
+def _check_hops(hops:int):
+    if not 0 <= hops <= MAX_HOPS:
+        raise ValueError('Frame hops must be 0 to %i (not %i)' % (MAX_HOPS, hops))
+
+
+def frame_version_for(broadcast_version:str) -> int:
+    """The frame version to send broadcasts of a version ('0.1', '0.2') in,
+    nodes only reading 0.1 broadcasts only read version x01 frames too."""
+    return VERSION_NO_HOPS if broadcast_version == '0.1' else VERSION
+
+
+def make_frame(handle:int, data:bytes, hops:int=0, version:int=VERSION) -> bytes:
+    """Puts the frame header before the (encrypted) data. A version x01
+    frame has no `hops`, it is never relayed."""
+
+    if len(data) > MAX_FRAME_DATA:
+        raise ValueError('Frame data too long (%i bytes)' % len(data))
+
+    if version == VERSION_NO_HOPS:
+        return HEADERS[version].pack(version, handle, len(data)) + data
+
+    _check_hops(hops)
+    return HEADERS[VERSION].pack(VERSION, handle, hops, len(data)) + data
+
+
+def finish_frame(handle:int, frame:bytearray, hops:int=0, version:int=VERSION) -> bytes:
+    """Fills in the header of a frame whose data was written after
+    `FRAME_HEADER_SIZE` reserved bytes (see `Crypto.sign_and_encrypt_with_network_key`).
+    A version x01 frame (no `hops`) starts a byte in."""
+
+    length = len(frame) - FRAME_HEADER_SIZE
+    if length > MAX_FRAME_DATA:
+        raise ValueError('Frame data too long (%i bytes)' % length)
+
+    if version == VERSION_NO_HOPS:
+        HEADERS[version].pack_into(frame, 1, version, handle, length)
+        return bytes(memoryview(frame)[1:])
+
+    _check_hops(hops)
+    HEADERS[VERSION].pack_into(frame, 0, VERSION, handle, hops, length)
+
+    return bytes(frame)
+
+
+def check_frame(data:bytes) -> tuple:
+    """Checks a received frame's header against its data, before any
+    decryption: the version, a known handle, the declared length being the
+    actual length, and the data being long enough for that handle.
+
+    Returns (handle, hops, data), raises `FrameError` if it is junk.
+    """
+
+    if len(data) < 1:
+        raise FrameError('short', 'Frame shorter than its header')
+
+    header = HEADERS.get(data[0])
+    if header is None:
+        raise FrameError('version', 'Unknown frame version %i' % data[0])
+
+    if len(data) < header.size:
+        raise FrameError('short', 'Frame shorter than its header')
+
+    if data[0] == VERSION:
+        _, handle, hops, length = header.unpack_from(data)
+    else:
+        _, handle, length = header.unpack_from(data)
+        hops = 0
+
+    min_length = MIN_FRAME_DATA.get(handle)
+    if min_length is None:
+        raise FrameError('handle', 'Unknown frame handle %i' % handle)
+
+    if length != len(data) - header.size:
+        raise FrameError('length', 'Frame length %i, but has %i bytes' % (length, len(data) - header.size))
+
+    if length < min_length:
+        raise FrameError('size', 'Frame data too short for handle %i' % handle)
+
+    return handle, hops, data[header.size:]
+
+
+def relayed_frame(frame:bytes):
+    """The (checked) frame to transmit on when relaying it: a copy, unchanged
+    but for one hop fewer left. None if it has no hops left."""
+
+    if frame[0] != VERSION or not frame[2]:
+        return None
+
+    relayed = bytearray(frame)
+    relayed[2] -= 1
+
+    return relayed
+
+
+def pack_container(frm:bytes, plain_broadcasts) -> bytes:
+    """Joins plain broadcasts (all from `frm`) into the body of a container,
+    it is then signed and network encrypted as a normal broadcast would be."""
+
+    parts = [frm, b'|']
+    for plain in plain_broadcasts:
+        parts.append(struct.pack('!H', len(plain)))
+        parts.append(plain)
+
+    return b''.join(parts)
+
+
+def unpack_container(body:bytes):
+    """Returns (frm, [plain broadcast, ...]) from the (verified) body of a
+    container. Raises `ValueError` if malformed."""
+
+    frm_end = body.find(b'|')
+    if frm_end < 1:
+        raise ValueError('Container sender not found')
+
+    frm = body[:frm_end]
+
+    plains = []
+    pos = frm_end + 1
+    size = len(body)
+    while pos < size:
+        if pos + 2 > size:
+            raise ValueError('Container entry length cut short')
+
+        length, = struct.unpack_from('!H', body, pos)
+        pos += 2
+        if pos + length > size:
+            raise ValueError('Container entry longer than the container')
+
+        plains.append(body[pos:pos+length])
+        pos += length
+
+    return frm, plains
+
+
+class BroadcastBatcher():
+    """Gathers broadcasts from a node and transmits them together in container
+    frames, paying for one signature and network encryption per frame.
+
+    A frame is sent once adding a broadcast would take it past `max_size`
+    bytes, or `max_delay` seconds after its first broadcast was added:
+    by the event `loop` if given, otherwise checked on each `add` (and
+    `flush` can be called at any time).
+
+    >>> batcher = BroadcastBatcher(node, loop=asyncio.get_event_loop())
+    >>> for b in anncs: batcher.add(b)
+    """
+
+    def __init__(self, node, max_size=1024, max_delay=0.05, loop=None):
+        if not CONTAINER_OVERHEAD < max_size <= MAX_FRAME_DATA:
+            raise ValueError('`max_size` must be more than %i and at most %i' % (CONTAINER_OVERHEAD, MAX_FRAME_DATA))
+
+        self.node = node
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.loop = loop
+
+        self._pending = [] # plain broadcasts
+        self._broadcasts = []
+        self._size = 0 # of the container body so far
+        self._deadline = None
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, broadcast):
+        """Queues a Broadcast (from the node) to be transmitted."""
+
+        if self._deadline is not None and monotonic() >= self._deadline:
+            self.flush()
+
+        plain = self.node.make_transmittable_broadcast(broadcast).plain
+
+        if self._pending and self._size + 2 + len(plain) > self.max_size:
+            self.flush()
+
+        if not self._pending:
+            self._size = len(broadcast.frm) + 1 + self.node.crypto.network_overhead
+
+        self._pending.append(plain)
+        self._broadcasts.append(broadcast)
+        self._size += 2 + len(plain)
+
+        if self._deadline is None:
+            self._deadline = monotonic() + self.max_delay
+            if self.loop is not None:
+                self._timer = self.loop.call_later(self.max_delay, self.flush)
+
+        if self._size >= self.max_size: # a single broadcast filling a frame
+            self.flush()
+
+    def flush(self):
+        """Transmits all queued broadcasts now (if any)."""
+
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._deadline = None
+
+        if not self._pending:
+            return
+
+        pending, broadcasts = self._pending, self._broadcasts
+        self._pending, self._broadcasts = [], []
+
+        tb = self.node.make_transmittable_container(pending, broadcasts)
+
+        destinations = {self.node.link_to(b.to) for b in broadcasts}
+        self.node.do_transmission(tb.data, destinations.pop() if len(destinations) == 1 else b'*')
@@ -1,7 +1,10 @@
 import asyncio
+import struct
+from time import monotonic
 from socket import gethostname, gethostbyname
 
 from .node import Node
+from .framing import HEADERS
 
 
 def get_host_ip() -> str:
@@ -25,6 +28,8 @@ class TCPNode(Node):
 
         self.my_tcp_node_routes = {} # TODO load from save # {node_addr:writer object}
 
+        self.tcp_neighbours = {} # {node_addr: (host, port)}, the nodes in reach
+
     def start_tcp(self, host=None):
         if not host:
             host = get_host_ip()
@@ -36,6 +41,8 @@ class TCPNode(Node):
 
         self.server = self.loop.run_until_complete(coro)
 
+        self.start_timers(self.loop)
+
         self.host = host
 
         # self.loop.run_forever()
@@ -48,19 +55,39 @@ class TCPNode(Node):
 
 
 
+    @staticmethod
+    @asyncio.coroutine
+    def read_frame(reader):
+        """Reads one whole transmission frame (`version|handle|hops|!H length|data`,
+        no hops in version 1) from the stream, however the bytes are split across reads."""
+        header = yield from reader.readexactly(1)
+        size = HEADERS[header[0]].size if header[0] in HEADERS else 4 # (junk, checked later)
+        header += yield from reader.readexactly(size - 1)
+        length, = struct.unpack('!H', header[-2:])
+        return header + (yield from reader.readexactly(length))
+
     @asyncio.coroutine
     def client_do(self, data, remote_host, remote_port=LISTEN_PORT):
-        reader, writer = yield from asyncio.open_connection(remote_host, remote_port,
-                                                            loop=self.loop,)
-                                                            # local_addr=(self.host, self.CLIENT_PORT))
+        sent = monotonic()
+        try:
+            reader, writer = yield from asyncio.open_connection(remote_host, remote_port,
+                                                                loop=self.loop,)
+                                                                # local_addr=(self.host, self.CLIENT_PORT))
+        except OSError:
+            for node_addr in self._tcp_neighbours_at(remote_host, remote_port):
+                self.link_failed(node_addr) # out of reach, routes through it are broken
+            raise
 
 
         writer.write(data)
 
 
-        data = yield from reader.read(65536)
+        data = yield from self.read_frame(reader)
         self.live_print('Received back: %r' % data)
 
+        for node_addr in self._tcp_neighbours_at(remote_host, remote_port): # link cost
+            self.link_measured(node_addr, rtt=monotonic() - sent, delivered=True)
+
         trctb = self.transmission_received_callback(data)
         if trctb:
             self.send_data_to(trctb.data, remote_host, remote_port)
@@ -69,7 +96,7 @@ class TCPNode(Node):
 
     @asyncio.coroutine
     def server_handle(self, reader, writer):
-        data = yield from reader.read(65536)
+        data = yield from self.read_frame(reader)
         addr, port = writer.get_extra_info('peername')
 
         self.live_print("Received %r \nfrom %r:%i" % (data, addr,port))
@@ -97,23 +124,34 @@ class TCPNode(Node):
         self.server.close()
         self.loop.run_until_complete(self.server.wait_closed())
 
+    def add_tcp_neighbour(self, node_addr:bytes, host, port=LISTEN_PORT):
+        """A node this one can transmit to directly (e.g. the next hop of routes)."""
+        self.tcp_neighbours[node_addr] = (host, port)
+
+    def _tcp_neighbours_at(self, host, port) -> list:
+        return [n for n, host_port in self.tcp_neighbours.items() if host_port == (host, port)]
+
     # overridden -- required
     def do_transmission(self, data:bytes, to):
-        # TODO figure out what ip it goes to
+        """Sends to `to` (a neighbour, being the next hop of a source route) if
+        it is a known neighbour, otherwise to all neighbours (e.g. '*', or a node
+        not yet routed to) to relay on; to this host when there are none."""
 
         print('tcp do transmition, to:', to)
 
         if to in self.my_tcp_node_routes:
             print('using old writer')
             n_writer = self.my_tcp_node_routes[to]
-            writer.write(data)
+            n_writer.write(data)
             # yield from writer.drain()
+        elif to in self.tcp_neighbours:
+            self.send_data_to(data, *self.tcp_neighbours[to])
+        elif self.tcp_neighbours:
+            for rhost, rport in set(self.tcp_neighbours.values()):
+                self.send_data_to(data, rhost, rport)
         else:
-            print('no known writter, making new')
-            rhost = '127.0.0.1'
-            rport = 7770
-
-            self.send_data_to(data, rhost, rport)
+            print('no known neighbours, sending to this host')
+            self.send_data_to(data, '127.0.0.1', self.LISTEN_PORT)
 
     def live_print(self, message):
         """Optionaly overridden to get log messages showing the network functioning."""
@@ -3,20 +3,27 @@ from .broadcast import Broadcast, TransmittableBroadcast, RespCode
 
 from .encoding import encode as m_encode
 from .encoding import decode as m_decode
+from .encoding import StreamDecoder
 
-from .util import base64_decode, base64_encode
 from os import rename as file_rename
 
-from .exceptions import NotToMeException, ExceptionWithResponse, DecodingError, NotInSecureGroupException, UnknownNodeException, ArgumentValidationError, TransmissionError
+from .exceptions import NotToMeException, ExceptionWithResponse, DecodingError, NotInSecureGroupException, UnknownNodeException, ArgumentValidationError, TransmissionError, FrameError
 from nacl.exceptions import BadSignatureError as nacl_BadSignatureError
+from nacl.exceptions import CryptoError as nacl_CryptoError
+from nacl.utils import random as nacl_random
 
 from .crypto import Crypto
 
 import logging
 
-from time import time
-
 import struct
+import asyncio
+from collections import Counter
+from collections.abc import Mapping
+
+from .framing import make_frame, finish_frame, frame_version_for, check_frame, relayed_frame, FRAME_HEADER_SIZE, VERSION_NO_HOPS, pack_container, unpack_container, HANDLE_BROADCAST, HANDLE_CONTAINER, HANDLE_DISCOVERY
+from .routing import SeenCache, RouteCache, GossipFlooding, NeighbourTable, RoutingTable, ROUTE_SEPARATOR, MAX_ROUTED_TO, route_destination, route_next_hop
+from .dispatch import DispatchedRequest, RequestRegistry, TimerWheel
 
 class Node(BaseNode):
 
@@ -27,85 +34,189 @@ class Node(BaseNode):
 
         self.crypto = Crypto()
 
+        # see `join_group` and `leave_group`, changes only reach node_info through them
         self.joined_groups = set() # 'all groups' names
         self.joined_secure_groups = {} # name : symmetric key bytes
+        self._groups_changed = 0 # times joined or left, for node_info 'groups'
+
+
+        self.dispatched_requests = RequestRegistry() # timeouts fire once `start_timers(loop)`
+
+        self.seen_broadcasts = SeenCache() # (frm, nonce) of broadcasts received and sent
+
+        self.wire_version = '0.2' # broadcast format, advertised as node_info 'v'
 
+        self.dropped_frames = Counter() # reason: count, of junk received
 
-        self.dispatched_requests = []
+        self.hop_limit = 7 # times frames sent by this node may be relayed
+        self.relaying = True # relays frames (also) to other nodes, see `relay_frame`
+        self.relayed_frames = 0
 
+        # group broadcasts are rebroadcast by gossip, if at all (see `GossipFlooding`)
+        self.gossip = GossipFlooding(TimerWheel(tick=0.02, slots=64)) # its own, for short delays
+        self.gossiping = True
+
+        self.routes = RouteCache() # source routes to other nodes, see `discover_route`
+        self.source_routing = True # unicasts go by their cached route, if there is one
+        self._route_requests = SeenCache(max_age=30.0) # (origin, request id) of those handled
+        self._discovering = SeenCache(max_age=5.0) # destinations a route was just requested for
+
+        self.neighbours = NeighbourTable() # nodes in direct reach, and their link costs
+        self._routing_table = None # see `routing_table`
+        self._links_changed = 0 # times a link cost changed (enough), for node_info 'routing'
+        self.advert_max_entries = 100 # routes in one advertisement ANNC, more are split
+        self._advert_timer = None
+
+        self._node_info_made_from = None # what `node_info` was last filled in from
+        self._node_info_made = None # and the keys it was filled in with
+
+
+    # from the identity snapshot, without building node_info
+    network_addr = property(lambda s:s.crypto.identity.addr)
 
     @property
     def node_info(self):
-        make = {}
+        """Filled in from the keys, groups and version only when one of them
+        has changed since it was last read. The keys filled in are set again
+        on every read, so writing to them does not change what is advertised."""
+
+        made_from = (self.crypto.identity, self.wire_version, self._links_changed, self._groups_changed)
 
-        make['addr'] = self.crypto.public_address
-        make['kVerify'] = self.crypto.signing_key.verify_key.encode()
-        make['kPublic'] = self.crypto.private_key.public_key.encode()
+        if made_from != self._node_info_made_from:
+            identity = made_from[0]
 
-        make['groups'] = {'*':list(self.joined_groups),
-                          '#': list(self.joined_secure_groups.keys())}
+            make = {}
 
-        make['v'] = '0.1'
+            make['addr'] = identity.addr
+            make['kVerify'] = identity.kVerify
+            make['kPublic'] = identity.kPublic
 
-        make['netTime'] = -1 # todo
+            make['groups'] = {'*':list(self.joined_groups),
+                              '#': list(self.joined_secure_groups.keys())}
 
-        make['capabilities'] = self._node_info.get('capabilities', [])
+            make['v'] = self.wire_version
 
-        self._node_info.update(make)
+            make['netTime'] = -1 # todo
 
-        return self._node_info
+            make['routing'] = [[n, self.neighbours.cost(n)] for n in self.neighbours] # link costs
+
+            self._node_info_made = make
+            self._node_info_made_from = made_from
+            self._encoded_node_info = None
+
+        node_info = self._node_info
+        node_info.update(self._node_info_made)
+        node_info.setdefault('capabilities', [])
+        return node_info
 
     @node_info.setter
     def node_info(self, new):
         self._node_info = new
+        self._node_info_made_from = None
+        self._encoded_node_info = None
+
+
+    def join_group(self, name, key:bytes=None):
+        """Joins a group: a secure one ('#name') with its symmetric `key`, or
+        else a general one ('*name'). Joining a secure group again changes its key."""
+
+        if key is None:
+            self.joined_groups.add(name)
+        else:
+            old = self.joined_secure_groups.get(name)
+            if old is not None and old != key:
+                self.crypto.forget_symmetric_key(old)
+            self.joined_secure_groups[name] = key
 
+        self._groups_changed += 1
+
+    def leave_group(self, name):
+        self.joined_groups.discard(name)
+
+        key = self.joined_secure_groups.pop(name, None)
+        if key is not None:
+            self.crypto.forget_symmetric_key(key)
+
+        self._groups_changed += 1
 
     def broadcast_is_to_this_node(self, b:Broadcast):
         """True if Broadcast is to the node in anyway (group or direct)."""
 
-        return( b.is_to_all() or \
-                b.to == self.network_addr or \
-                b.to_secure_group() in self.joined_secure_groups or \
-                b.to_gen_group() in self.joined_groups)
+        return self.is_to_this_node(b.to)
+
+    def is_to_this_node(self, to:bytes):
+        """True if a broadcast `to` reaches the node in anyway (group or direct,
+        at the end of a source route)."""
+
+        to = route_destination(to)
+
+        if to == b'*' or to == self.network_addr:
+            return True
 
+        if to[:1] == b'#':
+            return len(to) > 1 and to in self.joined_secure_groups
 
+        return to[:1] == b'*' and to in self.joined_groups
 
-    def update_cached_properties(self, frm:bytes, resp_annc_obj:dict):
+
+
+    def cache_node(self, node:BaseNode, addr:bytes=None):
+        """Adds (or replaces) a node in `cached_nodes` (at its address, or
+        `addr`), preparing the crypto for its keys and dropping what was
+        prepared for its old ones if they changed."""
+
+        if addr is None:
+            addr = node.network_addr
+
+        keys = (node.node_info.get('kVerify'), node.node_info.get('kPublic'))
+
+        old = self.cached_nodes.get(addr)
+        if old is not None:
+            old_keys = (old.node_info.get('kVerify'), old.node_info.get('kPublic'))
+            if old_keys != keys and None not in old_keys:
+                self.crypto.forget_peer_keys(*old_keys)
+
+        if None not in keys:
+            self.crypto.add_peer_keys(*keys)
+
+        self.cached_nodes[addr] = node
+
+    def update_cached_properties(self, frm:bytes, resp_annc_obj:Mapping):
         """Uses a RESP or ANNC broadcast to update values of cached node's properties.
         Actions may be included in the dict, but will ignore them (as they start with `^`)
+        Only values of the cached properties are looked up (so decoded).
         """
 
         cn = self.cached_nodes.get(frm, None)
 
         if cn != None:
-            for key, value in resp_annc_obj.items():
+            for key in resp_annc_obj:
+                p = cn.property_named(key) if type(key) is str else None
+                if not p: continue
 
+                value = resp_annc_obj[key]
                 if value == '\x15': continue # assume does not exist of no access, so skip
 
-                p = cn.property_named(key)
-                if not p: continue
-
                 p.value = value  # if all checks out, update cache
 
 
     def payload_decryptor(self, payload:bytes, to, frm):
-        """Takes a payload, the to, and the from; returns decrpyted and b64 decoded payload.
+        """Takes a payload (base64 already decoded by the broadcast), the to,
+        and the from; returns the decrpyted payload.
         Used to decrpyt a payload to this node or a secure group it may be a part of.
         """
 
-        if to.startswith(b'*'): # no extra encryption, just b64 decode
-            return base64_decode(payload)
+        if to.startswith(b'*'): # no extra encryption
+            return payload
 
         if len(to) <= 1: # at this point len(to) > 1
             raise ExceptionWithResponse(RespCode.PRSER, "Invalid 'to' address.", back_to=frm)
 
-        if to == self.network_addr: # to == public address
+        if route_destination(to) == self.network_addr: # to == public address
 
             from_public_key = self.cached_nodes[frm].node_info['kPublic']
 
-            raw_payload = base64_decode(payload)
-
-            return self.crypto.decrypt_from_public_key(raw_payload, from_public_key)
+            return self.crypto.decrypt_from_public_key(payload, from_public_key)
 
         if to.startswith(b'#'):
             group_name = to
@@ -114,22 +225,22 @@ class Node(BaseNode):
 
                 group_key = self.joined_secure_groups[group_name]
 
-                plain_payload = Crypto.decrypt_symmetrically(base64_decode(payload), group_key)
+                plain_payload = self.crypto.decrypt_symmetrically(payload, group_key)
 
                 return plain_payload
             else:
-                return base64_decode(payload)
+                return payload
 
 
-        return base64_decode(payload) # if cant decrypt, just give it back?? TODO
+        return payload # if cant decrypt, just give it back?? TODO
 
 
     def payload_encryptor(self, b:Broadcast, pre_payload:bytes):
-        """Encrypts and b64 encodes the constructed payload(pre_payload)
-        given the broadcast information."""
+        """Encrypts the constructed payload(pre_payload) given the broadcast
+        information. (The broadcast base64 encodes it if its version needs it.)"""
 
         if b.to_gen_group(): #includes 'all' (*)
-            return base64_encode(pre_payload)
+            return pre_payload
 
         if b.to_secure_group():
 
@@ -138,20 +249,16 @@ class Node(BaseNode):
 
                 group_key = self.joined_secure_groups[group_name]
 
-                payload_encrypted = Crypto.encrypt_symmetrically(pre_payload, group_key)
-
-                return base64_encode(payload_encrypted)
+                return self.crypto.encrypt_symmetrically(pre_payload, group_key)
             else:
                 raise NotInSecureGroupException(group_name)
 
 
-        if b.to in self.cached_nodes:
-
-            to_public_key = self.cached_nodes[b.to].node_info['kPublic']
+        if b.destination in self.cached_nodes:
 
-            raw_encrypted = self.crypto.encrypt_to_public_key(pre_payload, to_public_key)
+            to_public_key = self.cached_nodes[b.destination].node_info['kPublic']
 
-            return base64_encode(raw_encrypted)
+            return self.crypto.encrypt_to_public_key(pre_payload, to_public_key)
         else:
             # unkown node, cant encypt, check if part of marco-polo TODO
             pass
@@ -165,19 +272,71 @@ class Node(BaseNode):
 
 
     def transmission_received_callback(self, raw_data) -> TransmittableBroadcast:
-        """The raw, fully network encrypted data. The entry point of an 'off the wire' data. """
+        """The raw, fully network encrypted data. The entry point of an 'off the wire' data.
+
+        Junk is dropped (counted in `dropped_frames`) as early as it can be
+        told apart: a bad frame header before decrypting, a bad broadcast
+        header before verifying.
+        """
+
+        self._keep_timers()
+
+        frame = raw_data
+        try:
+            handle, hops, raw_data = check_frame(frame) # without the version, handle, hops and length
+        except FrameError as fe:
+            self.dropped_frames[fe.reason] += 1
+            return
 
-        if raw_data.startswith(b'\x01\x05'): # v1, discovery
-            return self.handle_discover_broadcast_data(raw_data)
+        if handle == HANDLE_DISCOVERY:
+            return self.handle_discover_broadcast_data(frame)
             # return a TransmittableBroadcast from discovery processing
             #  to prevent raw_data interprtaion as normal broadcast
 
-        raw_data = raw_data[4:] # remove version byte, x01 normal 'broadcast byte', and 2 byte len
+        is_container = handle == HANDLE_CONTAINER # several broadcasts
 
         try:
             decrypted_signed_data = self.crypto.decrypt_from_network(raw_data)
+        except nacl_CryptoError: # (AEAD) corrupted, or of another network
+            self.dropped_frames['network tag'] += 1
+            return
+        except Exception as e:
+            logging.error('Unable to decrypt from the network: ' + repr(e))
+            return
+
+        try:
+            if not is_container and decrypted_signed_data[64:66] not in Broadcast.VERSIONS.values():
+                self.dropped_frames['broadcast version'] += 1 # e.g. not our network key
+                return
+
+            # relayed on by the header alone (before verifying, the nodes it is
+            #  to do that), and only processed further if to this node too
+            if is_container: # signature(64) frm|...
+                frm, plains = unpack_container(decrypted_signed_data[64:])
+
+                to_me, relay_to = self._sort_container_entries(frm, plains, hops)
+                self.relay_frame(frame, relay_to)
+                if not to_me:
+                    return
+            else: # signature(64) v(2) nonce(4) |kind|to|frm|...
+                _, to, frm, _ = Broadcast.header_fields(decrypted_signed_data, 64)
+
+                # a copy (e.g. flooded back) is dropped before the cost of verifying
+                seen_id = (frm, decrypted_signed_data[64+2:64+6])
+                if self.seen_broadcasts.seen(seen_id):
+                    self.gossip.heard_copy(seen_id)
+                    return
+
+                relay_to = self._relay_to(to) if hops and self.relaying else None
+                if relay_to is not None and self.gossiping and (Broadcast.gen_group(to) or Broadcast.secure_group(to)):
+                    self._gossip_frame(seen_id, frame, relay_to)
+                elif self.relay_frame(frame, relay_to) is False and ROUTE_SEPARATOR in to:
+                    self._send_route_error(to, frm, relay_to)
+
+                if not self.is_to_this_node(to):
+                    self.seen_broadcasts.add(seen_id)
+                    return
 
-            frm = decrypted_signed_data[32+32+7:].split(b'|', 3)[2]
             frm_node = self.cached_nodes[frm]
 
             verify_key_bytes = frm_node.node_info['kVerify']
@@ -200,16 +359,242 @@ class Node(BaseNode):
             # resp = Broadcast.RESP(frm, self.network_addr, RespCode.PRSER)
             return
 
+        if is_container:
+            return self.process_container_bytes(broadcast_raw)
+
+        self.seen_broadcasts.add(seen_id) # only once genuine, so a forgery can't shadow it
+
+        if ROUTE_SEPARATOR in to: # the way it came, back
+            self.routes.add((self.network_addr,) + tuple(reversed(to.split(ROUTE_SEPARATOR)[:-1])) + (frm,))
+
         return self.process_plain_broadcast_bytes(broadcast_raw)
 
+    def _sort_container_entries(self, frm:bytes, plains:list, hops:int):
+        """Looks at the headers of a (not yet verified) container's broadcasts:
+        returns if any unseen are to this node, and where the container should
+        be relayed to (None if not at all). Unseen ones only to other nodes are
+        then counted as seen, they are not processed here."""
+
+        to_me = False
+        relay_tos = set()
+
+        for plain in plains:
+            seen_id = (frm, plain[2:6])
+            if self.seen_broadcasts.seen(seen_id):
+                continue
+
+            to = Broadcast.header_fields(plain)[1]
+            if self.is_to_this_node(to):
+                to_me = True
+            else:
+                self.seen_broadcasts.add(seen_id)
+
+            relay_to = self._relay_to(to)
+            if relay_to is not None:
+                relay_tos.add(relay_to)
+
+        if not relay_tos or not hops or not self.relaying:
+            return to_me, None
+
+        return to_me, relay_tos.pop() if len(relay_tos) == 1 else b'*'
+
+    def _relay_to(self, to:bytes):
+        """Where a broadcast `to` is relayed to by this node: the next hop of
+        its source route (only if this node is on it), otherwise as `link_to`
+        unless it is to this node. None if it isn't relayed."""
+
+        if ROUTE_SEPARATOR in to:
+            return route_next_hop(to, self.network_addr)
+
+        return self.link_to(to) if to != self.network_addr else None
+
+    def link_to(self, to:bytes) -> bytes:
+        """The neighbour this node transmits a broadcast `to` to: the start of
+        its source route, or the next hop in `routing_table` (a dict lookup);
+        otherwise `to` itself (for the transport to send to all, flooding)."""
+
+        if ROUTE_SEPARATOR in to:
+            return to.partition(ROUTE_SEPARATOR)[0]
+
+        return self.routing_table.next_hop.get(to, to)
+
+    @property
+    def routing_table(self) -> RoutingTable:
+        """Shortest paths to other nodes, from the route advertisements of
+        neighbours (see `advertise_routes`)."""
+
+        if self._routing_table is None or self._routing_table.addr != self.network_addr:
+            self._routing_table = RoutingTable(self.network_addr)
+        return self._routing_table
+
+    def relay_frame(self, frame:bytes, to:bytes):
+        """Transmits a received (network encrypted) frame on towards `to`,
+        unchanged but for one hop fewer left. Does nothing (returns None) if
+        `to` is None or the frame has no hops left; returns False if the
+        transmission failed (see `link_failed`), True once relayed."""
+
+        if to is None:
+            return None
+
+        relayed = relayed_frame(frame)
+        if relayed is None:
+            return None
+
+        try:
+            self.do_transmission(relayed, to)
+        except Exception as e: # not to stop the frame being processed here
+            logging.error('Unable to relay frame: ' + repr(e))
+            self.link_failed(to)
+            return False
+
+        self.relayed_frames += 1
+        return True
+
+    def _gossip_frame(self, seen_id, frame:bytes, to:bytes):
+        """Relays a (group broadcast) frame heard for the first time later, if
+        not enough copies of it are heard meanwhile (see `gossip`)."""
+
+        frame = bytes(frame)
+        self.gossip.relay_later(seen_id, lambda: self.relay_frame(frame, to), len(self.neighbours))
+
+    def link_failed(self, neighbour:bytes):
+        """Forgets the routes from this node through `neighbour`, called when
+        transmitting to it failed (e.g. by the transport)."""
+
+        self.routes.link_failed(self.network_addr, neighbour)
+
+        if neighbour in self.neighbours:
+            self.link_measured(neighbour, delivered=False)
+
+    def link_measured(self, neighbour:bytes, rtt:float=None, delivered:bool=None):
+        """What the transport measured of the link to `neighbour`: a round trip
+        time (seconds), and/or if a transmission was delivered."""
+
+        if rtt is not None:
+            self.neighbours.rtt_measured(neighbour, rtt)
+        if delivered is not None:
+            self.neighbours.delivered(neighbour, delivered)
+
+        self._link_cost_changed(neighbour)
+
+    def _link_cost_changed(self, neighbour:bytes):
+        if self.routing_table.set_link(neighbour, self.neighbours.cost(neighbour)):
+            self._links_changed += 1
+
+    def advertise_routes(self, full=False):
+        """Transmits this node's route advertisement to its neighbours: a
+        single hop ANNC (to '*') whose payload is a list, its sequence number
+        then the destination, cost, and sequence number of each route that
+        changed since the last (all if `full`); split into several ANNCs of
+        `advert_max_entries` if long. Neighbours silent too long are forgotten first."""
+
+        for neighbour in self.neighbours.expire():
+            self.routing_table.remove_neighbour(neighbour)
+            self._links_changed += 1
+
+        seq, entries = self.routing_table.advertisement(full)
+
+        for start in range(0, max(len(entries), 1), self.advert_max_entries):
+            advert = [seq]
+            for entry in entries[start:start+self.advert_max_entries]:
+                advert.extend(entry)
+
+            annc = Broadcast.ANNC(self.network_addr)
+            annc.payload.resp_annc_obj = advert
+
+            self.do_transmission(self.make_transmittable_broadcast(annc, hops=0).data, b'*')
+
+    def start_route_advertisements(self, interval:float=10.0, full_every:int=3):
+        """Advertises routes now and every `interval` seconds (all of them
+        every `full_every`th time), by the node's timers (see `start_timers`)."""
+
+        self.stop_route_advertisements()
+        count = [0]
+
+        def advertise():
+            try:
+                self.advertise_routes(full=count[0] % full_every == 0)
+            except Exception as e:
+                logging.error('Unable to advertise routes: ' + repr(e))
+            count[0] += 1
+
+            self._advert_timer = self.dispatched_requests.timers.schedule(interval, advertise)
+
+        advertise()
+
+    def stop_route_advertisements(self):
+        if self._advert_timer is not None:
+            self._advert_timer.cancel()
+            self._advert_timer = None
+
+    def route_advertisement_received(self, neighbour:bytes, advert:list):
+        """Takes a route advertisement (see `advertise_routes`) heard from `neighbour`."""
+
+        seq, entries = advert[0], advert[1:]
+
+        self.neighbours.heard(neighbour, seq)
+        self._link_cost_changed(neighbour)
+
+        self.routing_table.update(neighbour, seq, zip(entries[0::3], entries[1::3], entries[2::3]))
+
+    def _send_route_error(self, to:bytes, frm:bytes, next_hop:bytes):
+        """Tells `frm` its source route `to` is broken after this node, back
+        along the part of the route it came by."""
+
+        before = to.split(ROUTE_SEPARATOR)
+        before = before[:before.index(self.network_addr)]
+
+        rerr = Broadcast.ROUTE('RERR', ROUTE_SEPARATOR.join(before[::-1] + [frm]), self.network_addr,
+                               [self.network_addr, next_hop])
+        try:
+            self.do_transmission(self.make_transmittable_broadcast(rerr).data, self.link_to(rerr.to))
+        except Exception as e:
+            logging.error('Unable to send route error: ' + repr(e))
+
+    def process_container_bytes(self, container:bytes) -> TransmittableBroadcast:
+        """Takes the (verified) body of a container frame, processes each plain
+        broadcast in it. Any responses are returned together in a container."""
+
+        try:
+            frm, plains = unpack_container(container)
+        except ValueError as e:
+            logging.error('Container parsing error, can\'t respond: ' + repr(e))
+            return
+
+        responses = []
+        for plain in plains:
+            try:
+                # the container's signature only vouches for the sender's own broadcasts
+                if Broadcast.header_fields(plain)[2] != frm:
+                    raise ValueError('Broadcast in container not from the container sender')
+
+                seen_id = (frm, plain[2:6])
+                if self.seen_broadcasts.seen(seen_id):
+                    continue
+                self.seen_broadcasts.add(seen_id)
+
+                tb = self.process_plain_broadcast_bytes(plain)
+            except Exception as e:
+                logging.error('Error processing broadcast in container: ' + repr(e))
+                continue
+
+            if tb is not None:
+                responses.append(tb)
+
+        if len(responses) <= 1:
+            return responses[0] if responses else None
+
+        return self.make_transmittable_container([tb.plain for tb in responses],
+                                                 [tb.broadcast for tb in responses])
+
     def process_plain_broadcast_bytes(self, bcast_bytes:bytes) -> TransmittableBroadcast:
         """Takes the plain network decrpyted level broadcast,
             signature valid, payload may be encrypted"""
 
         self.did_receive_plain_broadcast(bcast_bytes) # delegate
 
-        def handle_negitive_responce(message:str, to, code):
-            neg_resp = Broadcast.RESP(to, self.network_addr, code)
+        def handle_negitive_responce(message:str, to, code, reply_to=None):
+            neg_resp = Broadcast.RESP(to, self.network_addr, code, reply_to=reply_to)
             neg_resp.resp_payload_obj = message # set resp payload
 
             return self.make_transmittable_broadcast(neg_resp)
@@ -238,14 +623,15 @@ class Node(BaseNode):
         try:
             return self.process_payload_from_broadcast(b)
         except DecodingError as dce:
-            return handle_negitive_responce(dce, b.frm, RespCode.PRSER)
+            return handle_negitive_responce(dce, b.frm, RespCode.PRSER, b.nonce)
             logging.warning('Decoding Error when trying to process the payload of %s. %s' % [str(b), dce])
         except ExceptionWithResponse as ewr:
-            return handle_negitive_responce(ewr.message, b.to, ewr.resp_code)
+            return handle_negitive_responce(ewr.message, b.to, ewr.resp_code, b.nonce)
             return
         except NotToMeException:
-            logging.info('not to me (caught), forwarding along. %s' % str(b))
-            # TODO forward along route
+            # already relayed (if it is to be) by its frame header, see
+            # `transmission_received_callback` and `relay_frame`
+            logging.info('not to me (caught). %s' % str(b))
             return
 
 
@@ -323,36 +709,47 @@ class Node(BaseNode):
                 else:
                     resp_code = b'OK' if OK_resp else b'NAK' # may replace nak with meh
 
-                    resp_bcast = Broadcast.RESP(b.frm, self.network_addr, resp_code)
+                    resp_bcast = Broadcast.RESP(b.frm, self.network_addr, resp_code, reply_to=b.nonce)
 
                 resp_bcast.payload.resp_annc_obj = resp_payload_obj
 
                 return self.make_transmittable_broadcast(resp_bcast)
             else:
                 return self.make_transmittable_broadcast(  # ACK back if nothing to respond with
-                    Broadcast.RESP(b.frm, self.network_addr, b'ACK')
+                    Broadcast.RESP(b.frm, self.network_addr, b'ACK', reply_to=b.nonce)
                 )
 
         elif b.kind == 'ANNC':
 
             if isinstance(b.payload.resp_annc_obj, BaseNode):
                 # the payload is the node struct of the sender ('frm')
-                self.cached_nodes[b.frm] = b.payload.resp_annc_obj
+                self.cache_node(b.payload.resp_annc_obj, b.frm)
 
-            elif type(b.payload.resp_annc_obj) is dict:
+            elif isinstance(b.payload.resp_annc_obj, Mapping):
 
                 self.update_cached_properties(b.frm, b.payload.resp_annc_obj)
 
+            elif isinstance(b.payload.resp_annc_obj, list) and b.payload.resp_annc_obj:
+                # a route advertisement, from a neighbour
+                try:
+                    self.route_advertisement_received(b.frm, b.payload.resp_annc_obj)
+                except (TypeError, ValueError):
+                    raise ExceptionWithResponse(RespCode.PRSER, 'Route advertisement not correct structure.', b.frm)
+
             else:
                 raise ExceptionWithResponse(RespCode.PRSER, 'ANNC payload not correct structure.', b.frm)
 
             return
 
+        elif b.kind in Broadcast.ROUTE_KINDS:
+
+            return self.process_route_broadcast(b)
+
         elif b.kind == 'RESP':
 
             # print('recived RESP [%s] payload:' % str(b.resp_code), b.payload.resp_annc_obj)
 
-            if b.resp_code == b'OK' and type(b.payload.resp_annc_obj) is dict:
+            if b.resp_code == b'OK' and isinstance(b.payload.resp_annc_obj, Mapping):
                 self.update_cached_properties(b.frm, b.payload.resp_annc_obj)
                 # no 'ACK' if needed, nothing to do specifically
 
@@ -362,39 +759,238 @@ class Node(BaseNode):
 
 
 
-            # Process dispatched requests, their callbacks, and timeouts
-            # Alternative to using threads that autodelete themselves
+            # the request this answers, if any, gets its callback
+            self.dispatched_requests.response_received(b)
+
+            return
+
+
+    def process_route_broadcast(self, b:Broadcast) -> TransmittableBroadcast:
+        """Handles route requests, replies, and errors (see `discover_route`).
+
+        A route request is answered by its target with a route reply, source
+        routed back along the request's route record; any other node sends it
+        on (once) with itself added to the record. Every node it reaches learns
+        the way back to its origin, and that its sender is a neighbour.
+        """
+
+        me = self.network_addr
+
+        try:
+            if b.kind == 'RREQ':
+                origin, request_id, target, record = b.payload.resp_annc_obj
+
+                self.routes.add((me, b.frm)) # route requests are never relayed
+                self.routes.add((me,) + tuple(reversed(record)) + (origin,))
+
+                if origin == me or me in record or (origin, request_id) in self._route_requests:
+                    return
+                self._route_requests.add((origin, request_id))
+
+                if target == me:
+                    back_to = ROUTE_SEPARATOR.join(list(reversed(record)) + [origin])
+                    return self.make_transmittable_broadcast(Broadcast.ROUTE('RREP', back_to, me, [request_id, record]))
+
+                if len(ROUTE_SEPARATOR.join(record + [me, target])) <= MAX_ROUTED_TO:
+                    rreq = Broadcast.ROUTE('RREQ', b'*', me, [origin, request_id, target, record + [me]])
+                    self.do_transmission(self.make_transmittable_broadcast(rreq, hops=0).data, b'*')
+
+            elif b.kind == 'RREP':
+                _, record = b.payload.resp_annc_obj
+
+                self.routes.add((me,) + tuple(record) + (b.frm,))
+
+            elif b.kind == 'RERR':
+                a, b_ = b.payload.resp_annc_obj
+
+                self.routes.link_failed(a, b_)
+
+        except (TypeError, ValueError):
+            raise ExceptionWithResponse(RespCode.PRSER, 'Route broadcast payload not correct structure.', b.frm)
+
+    def discover_route(self, destination:bytes):
+        """Floods a route request for `destination`, a hop at a time: each node
+        sends it on once, adding itself to its route record. The route reply
+        from `destination` caches the route in `routes`, it is then used by
+        unicasts to it.
+
+        A destination is not requested again within a few seconds.
+        """
+
+        if destination in self._discovering:
+            return
+        self._discovering.add(destination)
+
+        request_id = nacl_random(4)
+        self._route_requests.add((self.network_addr, request_id))
+
+        rreq = Broadcast.ROUTE('RREQ', b'*', self.network_addr, [self.network_addr, request_id, destination, []])
+        self.do_transmission(self.make_transmittable_broadcast(rreq, hops=0).data, b'*')
+
+    def dispatch_request(self, request:Broadcast, callback=None, timeout:float=10.0, timeout_callback=None) -> DispatchedRequest:
+        """Transmits a REQ broadcast and waits for its response: `callback` is
+        called with the RESP, or `timeout_callback` if none comes within
+        `timeout` seconds (see `start_timers`, without them the timeouts fire
+        on the next request or frame received).
+
+        With `source_routing`, it goes by the cached route to its destination;
+        if there isn't one it is relayed as normal (flooding) and a route is
+        discovered for the next. A route is forgotten if a request by it times out.
+        """
+
+        self._keep_timers()
+
+        if self.source_routing and request.is_to_only_one() and request.to not in self.routes \
+           and request.to not in self.routing_table.next_hop:
+            self.discover_route(request.to)
+
+        tb = self.make_transmittable_broadcast(request)
+
+        destination = request.destination
+        def timed_out():
+            if ROUTE_SEPARATOR in request.to: # maybe broken, found again next time
+                self.routes.forget(destination)
+            if timeout_callback is not None:
+                timeout_callback()
+
+        dispatched = DispatchedRequest(destination, callback, timed_out, request, request.nonce)
+        self.dispatched_requests.add(dispatched, timeout) # first, a response could come back at once
 
-            to_be_removed_requests = []
-            for r in self.dispatched_requests:
+        try:
+            self.do_transmission(tb.data, self.link_to(request.to))
+        except Exception:
+            self.dispatched_requests.remove(dispatched)
+            raise
+
+        return dispatched
+
+    async def request(self, to:bytes, props=(), actions:dict=None, timeout:float=10.0) -> Broadcast:
+        """Requests the properties named in `props` and runs the `actions`
+        ({name: [args, ...]}) of node `to`, returns its RESP Broadcast.
+        Raises `asyncio.TimeoutError` if none comes within `timeout` seconds.
+
+        >>> resp = await node.request(addr, props=['on'], actions={'setState': [True]})
+        >>> resp.payload.resp_annc_obj['on']
+        """
+
+        loop = asyncio.get_running_loop()
+        if not self.dispatched_requests.timers.running:
+            self.start_timers(loop)
+
+        req = Broadcast.REQ(to, self.network_addr)
+        req.payload.request_prop_names = list(props)
+        req.payload.request_actions = dict(actions or {})
 
-                if r.to == b.frm:
-                    r.call_callback(b)
-                    to_be_removed_requests.append(r)
+        response = loop.create_future()
 
-                if r.timeout_time < time():
-                    r.timeout_callback()
-                    to_be_removed_requests.append(r)
+        def answered(resp):
+            if not response.done():
+                response.set_result(resp)
 
+        def timed_out():
+            if not response.done():
+                response.set_exception(asyncio.TimeoutError('No response from %r' % to))
+
+        dispatched = self.dispatch_request(req, answered, timeout, timed_out)
+
+        try:
+            return await response
+        finally:
+            self.dispatched_requests.remove(dispatched) # if cancelled
 
-            # clear up the self.dispatched_requests array
-            for done_r in to_be_removed_requests:
-                self.dispatched_requests.remove(done_r)
+    def _keep_timers(self):
+        """Starts the timers on the running event loop, if there is one and
+        they aren't yet. Without one, fires the timeouts due by now."""
 
+        timers = self.dispatched_requests.timers
+        if timers.running:
             return
 
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            timers.advance()
+        else:
+            self.start_timers(loop)
+
+    def start_timers(self, loop):
+        """Runs the node's timers (request timeouts, gossip delays) from the event `loop`."""
+        self.dispatched_requests.timers.start(loop)
+        self.gossip.timers.start(loop)
 
-    def make_transmittable_broadcast(self, broadcast:Broadcast) -> TransmittableBroadcast:
+    def make_transmittable_broadcast(self, broadcast:Broadcast, hops:int=None) -> TransmittableBroadcast:
         """Takes a Broadcast object and makes a TransmittableBroadcast object
             which includes the broadcast encoded, encyted, and ready to transmit.
+
+        With `source_routing`, a broadcast to one node is given the cached
+        route to it (its `to` changed to the route). `hops` (the times its frame
+        may be relayed) is by default what its route needs, or `hop_limit` without one.
         """
 
-        encrypted = self.crypto.sign_and_encrypt_with_network_key(
-                                                    broadcast.encode('0.1', self.payload_encryptor))
+        if hops is None:
+            hops = self._route_broadcast(broadcast)
+
+        if broadcast.kind in Broadcast.ROUTE_KINDS:
+            version = '0.2'
+        else:
+            version = self.broadcast_version_for(broadcast.destination)
+
+        plain = broadcast.encode(version, self.payload_encryptor)
+
+        # so copies of it coming back are ignored
+        self.seen_broadcasts.add((broadcast.frm, broadcast.nonce))
+
+        # signed and encrypted when the data is first used (not at all if put in a container)
+        return TransmittableBroadcast(None, broadcast, plain,
+                                      lambda plain: self._frame_plain_broadcast(plain, hops, frame_version_for(version)))
+
+    def _route_broadcast(self, broadcast:Broadcast) -> int:
+        """Gives a broadcast its cached route (if it should), returns the hops its route needs."""
+
+        if ROUTE_SEPARATOR in broadcast.to: # already routed
+            return broadcast.to.count(ROUTE_SEPARATOR)
 
-        # x01x01 means: version 1, normal broadcast
-        return TransmittableBroadcast(b'\x01\x01' + struct.pack('!H', len(encrypted)) + encrypted,
-                                      broadcast)
+        path = None
+        if self.source_routing and broadcast.is_to_only_one():
+            path = self.routes.get(broadcast.to)
+
+        if path is None:
+            return self.hop_limit
+
+        broadcast.to = ROUTE_SEPARATOR.join(path[1:])
+        return len(path) - 2
+
+    def broadcast_version_for(self, to:bytes) -> str:
+        """The broadcast format to use for `to`: the older of this node's and,
+        if `to` is a cached node, the one it advertises (nodes from before
+        0.2 advertise '0.1'). Groups get this node's `wire_version`, so a
+        mesh with older nodes in it should set that to '0.1'."""
+
+        cn = self.cached_nodes.get(to)
+        if cn is None:
+            return self.wire_version
+
+        theirs = cn.node_info.get('v', '0.1')
+        if theirs not in Broadcast.VERSIONS: # (newer) unknown, use ours
+            return self.wire_version
+
+        return min(self.wire_version, theirs, key=lambda v: tuple(int(n) for n in v.split('.')))
+
+    def _frame_plain_broadcast(self, plain:bytes, hops:int, version:int) -> bytes:
+        # encrypted straight into the frame, after room for its header
+        frame = self.crypto.sign_and_encrypt_with_network_key(plain, reserve=FRAME_HEADER_SIZE)
+
+        # x02x01 means: version 2, normal broadcast (x01x01 to nodes only reading version 1)
+        return finish_frame(HANDLE_BROADCAST, frame, hops, version)
+
+    def make_transmittable_container(self, plain_broadcasts:list, broadcasts:list=None) -> TransmittableBroadcast:
+        """Puts several plain (encoded) broadcasts from this node into one
+        container frame, signed and encrypted once. See `framing`."""
+
+        body = pack_container(self.network_addr, plain_broadcasts)
+        frame = self.crypto.sign_and_encrypt_with_network_key(body, reserve=FRAME_HEADER_SIZE)
+
+        return TransmittableBroadcast(finish_frame(HANDLE_CONTAINER, frame, self.hop_limit), broadcasts)
 
 
 
@@ -423,7 +1019,7 @@ class Node(BaseNode):
 
         #TODO the user/authority concept is important somewhere in here and needs to be implemented
 
-        raw_data = raw_data[4:] # remove the version, discovery handle byte, and 2 byte length
+        raw_data = check_frame(raw_data)[2] # remove the version, discovery handle byte, (hops,) and 2 byte length
 
         disc_bcast = raw_data[64+3:]
 
@@ -450,14 +1046,14 @@ class Node(BaseNode):
                 polo_plain = b'\x00\x01|POLO|%(from)s|%(self_pub_key)s|%(encoded_and_encrypted_self_node)s' % {
                     b'from':other_addr, # the node is encoded then encryted
                     b'self_pub_key': self.crypto.private_key.public_key.encode(),
-                    b'encoded_and_encrypted_self_node': self.crypto.encrypt_to_public_key(m_encode(self), other_public_key)
+                    b'encoded_and_encrypted_self_node': self.crypto.encrypt_to_public_key(m_encode(self, refs=True), other_public_key)
                 }
 
                 #sign and transmit polo_plain
 
                 signed_polo = self.crypto.signing_key.sign(polo_plain)
 
-                return TransmittableBroadcast(b'\x01\x05' + struct.pack('!H', len(signed_polo)) + signed_polo,
+                return TransmittableBroadcast(make_frame(HANDLE_DISCOVERY, signed_polo, version=VERSION_NO_HOPS),
                                                                         Broadcast('POLO', self.network_addr, other_addr))
 
             else:
@@ -491,8 +1087,8 @@ class Node(BaseNode):
 
                 signed_new_struct = self.crypto.signing_key.sign(node_struct) # TODO temp, sign with user key
                 encoded_payload = m_encode(
-                        [self.crypto.network_secret_box.secret_key, self, signed_new_struct]
-                    )
+                        [self.crypto.network_secret_box.secret_key, self, signed_new_struct, self.crypto.network_aead],
+                        refs=True)
 
                 acpt_plain = b'\x00\x01|ACPT|%(new_node_addr)s|%(self_pub_key)s|%(encrypted_encoded_payload)s' % {
                     b'new_node_addr': new_node.network_addr,
@@ -502,9 +1098,9 @@ class Node(BaseNode):
 
                 signed_acpt = self.crypto.signing_key.sign(acpt_plain)
 
-                self.cached_nodes[new_node.network_addr] = new_node  # TODO this, but when a node is not chached but has the net key (for all other nodes in network to learn about the new node on first bootstrap ANNC)
+                self.cache_node(new_node)  # TODO this, but when a node is not chached but has the net key (for all other nodes in network to learn about the new node on first bootstrap ANNC)
 
-                return TransmittableBroadcast(b'\x01\x05'+ struct.pack('!H', len(signed_acpt)) + signed_acpt,
+                return TransmittableBroadcast(make_frame(HANDLE_DISCOVERY, signed_acpt, version=VERSION_NO_HOPS),
                                              Broadcast('ACPT', self.network_addr, new_node.network_addr)
                 )
 
@@ -542,16 +1138,16 @@ class Node(BaseNode):
 
                 # Assuming all is good, add self to network, and bootstrape node to cache:
 
-                self.crypto.set_network_key(payload_list[0])
+                self.crypto.set_network_key(payload_list[0], len(payload_list) > 3 and payload_list[3])
 
-                self.cached_nodes[bootstrap_node.network_addr] = bootstrap_node
+                self.cache_node(bootstrap_node)
 
                 user_signed_self_struct = payload_list[2]
                 aqua_plain = b'\x00\x01|AQUA|%s' %  user_signed_self_struct
 
                 aqua_en = self.crypto.sign_and_encrypt_with_network_key(aqua_plain)
 
-                return TransmittableBroadcast(b'\x01\x05' + struct.pack('!H', len(aqua_en)) + aqua_en,
+                return TransmittableBroadcast(make_frame(HANDLE_DISCOVERY, aqua_en, version=VERSION_NO_HOPS),
                                                 Broadcast('AQUA', self.network_addr, b'*')
                 )
             else:
@@ -588,7 +1184,7 @@ class Node(BaseNode):
 
         try:
             packet_payload = self.crypto.signing_key.sign(marco)
-            self.do_transmission(b'\x01\x05'+ struct.pack('!H', len(packet_payload)) + packet_payload, b'*') # TODO, ^^ also sigend by user/authority
+            self.do_transmission(make_frame(HANDLE_DISCOVERY, packet_payload, version=VERSION_NO_HOPS), b'*') # TODO, ^^ also sigend by user/authority
             # x05 is the discovery mark
 
         except TransmissionError as te:
@@ -615,7 +1211,7 @@ class Node(BaseNode):
         try:
             with open(filename+'.tmp', 'bw') as f:
                 f.seek(0)
-                f.write(m_encode(out))
+                f.write(m_encode(out, refs=True)) # string table, cached nodes repeat keys
         except Exception:
             return False
 
@@ -628,9 +1224,17 @@ class Node(BaseNode):
 
     def load_node_volatile_data_from_file(self, filename='node.save'):
 
+        # decoded as it is read, so a large save (e.g. many cached nodes) is not
+        # held in memory twice
+        decoder = StreamDecoder()
         try:
             with open(filename, 'br') as f:
-                in_ = m_decode(f.read())
+                for chunk in iter(lambda: f.read(65536), b''):
+                    decoder.feed(chunk)
+                    in_ = next(decoder, None)
+                    if in_ is not None: break
+                else:
+                    raise DecodingError('Save file incomplete', f.tell())
         except FileNotFoundError:
             return False # if no file just ignore, to assume there is no save.
 
@@ -647,13 +1251,14 @@ class Node(BaseNode):
 
         saved_node_info = in_.get('nodeinfo', {})
         # saved_node_info.update(self.node_info)
-        self._node_info = saved_node_info
+        self.node_info = saved_node_info
 
         self.crypto.load_keys_from_save_dict(in_['cryto'])
 
         # load joined groups
         self.joined_groups = set(in_.get('groups', {}).get('gen', []))
         self.joined_secure_groups = in_.get('groups', {}).get('sec', {})
+        self._groups_changed += 1
 
         self.cached_nodes =in_.get('cached_nodes', {})
 
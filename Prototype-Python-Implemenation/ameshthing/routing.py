@@ -0,0 +1,511 @@
+"""
+Routing helpers for a Node: recognising broadcasts already seen (so
+flooded copies and loops are dropped), and source routes to other nodes.
+
+A source route is written in a broadcast's `to` as the addresses it goes
+through then its destination, joined by `>`: `carlos>dave>bob`.
+
+Group broadcasts are flooded by gossip (see `GossipFlooding`), unicasts by
+source routes or the shortest paths of a `RoutingTable`.
+"""
+
+from collections import OrderedDict
+from time import monotonic
+import random
+
+
+class SeenCache():
+    """A bounded set of recently seen broadcast ids, i.e. (frm, nonce).
+
+    Ids are forgotten `max_age` seconds after being added, or (oldest first)
+    once there are more than `max_entries`. `hits` and `misses` count the
+    results of `seen`, to help size it for the mesh.
+
+    >>> if cache.seen(key): return  # a copy, drop it
+    >>> cache.add(key)  # once the broadcast is known to be genuine
+    """
+
+    def __init__(self, max_entries=4096, max_age=120.0, clock=monotonic):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+
+        self._added = OrderedDict() # id: time added, oldest first
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._added)
+
+    def __contains__(self, key):
+        self._expire(self.clock())
+        return key in self._added
+
+    def seen(self, key) -> bool:
+        """True if `key` has been added (and not yet forgotten), counted as a
+        hit or miss."""
+
+        if key in self:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def add(self, key):
+        now = self.clock()
+        self._expire(now)
+
+        added = self._added
+        added[key] = now
+        added.move_to_end(key)
+
+        if len(added) > self.max_entries:
+            added.popitem(last=False)
+
+    def _expire(self, now):
+        added = self._added
+        too_old = now - self.max_age
+        while added:
+            key, time_added = next(iter(added.items()))
+            if time_added > too_old:
+                break
+            del added[key]
+
+
+ROUTE_SEPARATOR = b'>'
+
+MAX_ROUTED_TO = 0xFF # bytes, the longest (0.2 broadcast) `to` a route can be written in
+
+
+def route_destination(to:bytes) -> bytes:
+    """The node (or group) a `to`, source routed or not, is finally for."""
+    return to.rpartition(ROUTE_SEPARATOR)[2]
+
+
+def route_next_hop(to:bytes, addr:bytes):
+    """Where a broadcast `to` goes after node `addr`: the next address on its
+    source route, None if `addr` isn't on it (before the destination)."""
+
+    hops = to.split(ROUTE_SEPARATOR)
+    try:
+        return hops[hops.index(addr, 0, len(hops)-1) + 1]
+    except ValueError:
+        return None
+
+
+class RouteCache():
+    """Source routes from this node, by destination: each the addresses
+    along it from this node to the destination (both included).
+
+    Routes are forgotten `max_age` seconds after being added, or (oldest
+    first) once there are more than `max_entries`; and at once when a link
+    on them fails (`link_failed`), found through an index of the links.
+    A route replaces another to the same destination unless that is shorter.
+
+    >>> cache.add((me, carlos, bob))
+    >>> cache.get(bob)
+    (me, carlos, bob)
+    """
+
+    def __init__(self, max_entries=1024, max_age=300.0, clock=monotonic):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+
+        self._routes = OrderedDict() # destination: (path, time added), oldest first
+        self._by_link = {} # (a, b): {destination, ...} of routes over it
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __contains__(self, destination):
+        return self.get(destination) is not None
+
+    def get(self, destination:bytes):
+        """The path to `destination`, None if there is no route (still) cached."""
+
+        self._expire(self.clock())
+
+        route = self._routes.get(destination)
+        return route[0] if route is not None else None
+
+    def add(self, path):
+        """Caches a route (a sequence of addresses, this node first), returns
+        if it was (not if a shorter one is already cached or it has a loop)."""
+
+        path = tuple(path)
+        if len(path) < 2 or len(set(path)) != len(path):
+            return False
+
+        now = self.clock()
+        self._expire(now)
+
+        destination = path[-1]
+        old = self._routes.get(destination)
+        if old is not None:
+            if len(old[0]) < len(path):
+                return False
+            self.forget(destination)
+
+        self._routes[destination] = (path, now)
+        for link in zip(path, path[1:]):
+            self._by_link.setdefault(link, set()).add(destination)
+
+        if len(self._routes) > self.max_entries:
+            self.forget(next(iter(self._routes)))
+
+        return True
+
+    def forget(self, destination:bytes):
+        route = self._routes.pop(destination, None)
+        if route is None:
+            return
+
+        for link in zip(route[0], route[0][1:]):
+            over = self._by_link.get(link)
+            if over is not None:
+                over.discard(destination)
+                if not over:
+                    del self._by_link[link]
+
+    def link_failed(self, a:bytes, b:bytes) -> int:
+        """Forgets every route over the link from `a` to `b` (or `b` to `a`),
+        returns how many."""
+
+        destinations = self._by_link.get((a, b), set()) | self._by_link.get((b, a), set())
+        for destination in destinations:
+            self.forget(destination)
+
+        return len(destinations)
+
+    def _expire(self, now):
+        routes = self._routes
+        too_old = now - self.max_age
+        while routes:
+            destination, (_, time_added) = next(iter(routes.items()))
+            if time_added > too_old:
+                break
+            self.forget(destination)
+
+
+class GossipFlooding():
+    """Counter based, probabilistic rebroadcasting of flooded (group)
+    broadcasts, rather than every node repeating every one.
+
+    A broadcast heard for the first time is rebroadcast after a random
+    delay of up to `max_delay` seconds (by the `timers` wheel, at once if
+    it isn't running so there's nothing to wait on), unless
+    `threshold` copies of it were heard by then: its neighbours have most
+    likely heard it already. Otherwise it is rebroadcast with a probability
+    adapted to the number of neighbours, `fanout` / neighbours (always with
+    `fanout` or fewer); or for sure if fewer than `min_copies` were heard,
+    as at the edge of the flood it may be the only way on.
+
+    >>> gossip.relay_later(seen_id, lambda: relay(frame), len(neighbours))
+    >>> if cache.seen(seen_id): gossip.heard_copy(seen_id)
+    """
+
+    def __init__(self, timers, threshold=3, fanout=4, min_copies=2, max_delay=0.2, rand=random.random):
+        self.timers = timers # a TimerWheel
+        self.threshold = threshold
+        self.fanout = fanout
+        self.max_delay = max_delay
+        self.min_copies = min_copies
+        self.rand = rand
+
+        self._pending = {} # broadcast id: [copies heard, Timer]
+
+        self.relayed = 0
+        self.suppressed = 0 # by copies heard
+        self.skipped = 0 # by chance
+
+    def __len__(self):
+        return len(self._pending)
+
+    def probability(self, neighbours:int) -> float:
+        """Of rebroadcasting, with that many neighbours."""
+        return min(1.0, self.fanout / neighbours) if neighbours else 1.0
+
+    def relay_later(self, key, relay, neighbours:int):
+        """Considers rebroadcasting a broadcast (`key` its id) just heard the
+        first time, `relay` being called (without arguments) to do it."""
+
+        if key in self._pending:
+            return
+
+        def decide():
+            copies, _ = self._pending.pop(key)
+            if copies >= self.threshold:
+                self.suppressed += 1
+            elif copies < self.min_copies or self.rand() < self.probability(neighbours):
+                self.relayed += 1
+                relay()
+            else:
+                self.skipped += 1
+
+        entry = self._pending[key] = [1, None]
+        if not self.timers.running: # no loop advancing it
+            decide()
+            return
+
+        entry[1] = self.timers.schedule(self.rand() * self.max_delay, decide)
+
+    def heard_copy(self, key):
+        """Counts another copy of a broadcast heard, if it is waiting to be rebroadcast."""
+
+        entry = self._pending.get(key)
+        if entry is None:
+            return
+
+        entry[0] += 1
+        if entry[0] >= self.threshold: # decided, no need to wait
+            entry[1].cancel()
+            del self._pending[key]
+            self.suppressed += 1
+
+
+INFINITE_COST = 0xFFFF # unreachable, also the most any route costs
+
+
+class NeighbourTable():
+    """The nodes in direct reach and what the link to each costs: the
+    smoothed round trip time (in ms, `default_rtt` until measured) times the
+    expected transmissions per delivery (1 / the smoothed delivery ratio).
+
+    Deliveries are counted from what the transport measures, and from the
+    numbered route advertisements heard (a skipped number is a lost one).
+    A neighbour not heard from for `max_silence` seconds is forgotten.
+    """
+
+    class _Link():
+        __slots__ = 'rtt', 'delivery', 'heard', 'last_seq'
+
+        def __init__(self, rtt, heard):
+            self.rtt = rtt
+            self.delivery = 1.0
+            self.heard = heard
+            self.last_seq = None
+
+    def __init__(self, default_rtt=0.01, alpha=0.25, max_silence=35.0, clock=monotonic):
+        self.default_rtt = default_rtt
+        self.alpha = alpha # weight of a new measurement
+        self.max_silence = max_silence
+        self.clock = clock
+
+        self._links = {} # neighbour: _Link
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, neighbour):
+        return neighbour in self._links
+
+    def __iter__(self):
+        return iter(list(self._links))
+
+    def _link(self, neighbour):
+        link = self._links.get(neighbour)
+        if link is None:
+            link = self._links[neighbour] = self._Link(self.default_rtt, self.clock())
+        return link
+
+    def heard(self, neighbour:bytes, seq:int=None) -> bool:
+        """Something was heard from `neighbour` (directly), numbered `seq` if
+        it was a route advertisement. Returns if it is a new neighbour."""
+
+        new = neighbour not in self._links
+        link = self._link(neighbour)
+        link.heard = self.clock()
+
+        if seq is not None:
+            if link.last_seq is not None and seq > link.last_seq:
+                for _ in range(min(seq - link.last_seq - 1, 16)): # missed
+                    self._delivered(link, False)
+                self._delivered(link, True)
+            if link.last_seq is None or seq > link.last_seq:
+                link.last_seq = seq
+
+        return new
+
+    def rtt_measured(self, neighbour:bytes, seconds:float):
+        link = self._link(neighbour)
+        link.rtt += self.alpha * (seconds - link.rtt)
+
+    def delivered(self, neighbour:bytes, ok:bool):
+        self._delivered(self._link(neighbour), ok)
+
+    def _delivered(self, link, ok):
+        link.delivery += self.alpha * ((1.0 if ok else 0.0) - link.delivery)
+
+    def cost(self, neighbour:bytes) -> int:
+        link = self._links.get(neighbour)
+        if link is None:
+            return INFINITE_COST
+
+        return min(INFINITE_COST, max(1, round(link.rtt * 1000 / max(link.delivery, 0.01))))
+
+    def expire(self) -> list:
+        """Forgets the neighbours not heard from lately, returns them."""
+
+        too_old = self.clock() - self.max_silence
+        silent = [n for n, link in self._links.items() if link.heard <= too_old]
+        for neighbour in silent:
+            del self._links[neighbour]
+
+        return silent
+
+
+class RoutingTable():
+    """Shortest paths to every node, as a distance vector updated from the
+    route advertisements of neighbours.
+
+    Every neighbour's advertised (cost, sequence number) to each destination
+    is kept, so an update only re-evaluates the destinations it touches,
+    each over its neighbours: an advertisement of n entries costs O(n * k)
+    for k neighbours, a link cost change O(destinations routed via it * k)
+    (all it advertises if it got cheaper). Never a recomputation of the
+    whole table. A link cost changing by less than `tolerance` (a fraction)
+    is ignored, so measurement noise can't cause
+    storms of updates.
+
+    Routes are kept loop free as in Babel: each destination numbers its
+    entry (advancing it every advertisement), and a neighbour's route is
+    only feasible if its number is newer than the route this node had, or
+    the same but cheaper than the cheapest this node had with it (so it
+    can't be through this node). The cheapest feasible route is taken. With
+    none, the route is advertised once as `INFINITE_COST`, until a newer
+    number comes (in full advertisements).
+
+    `next_hop` ({destination: neighbour}) is for forwarding lookups, O(1).
+    """
+
+    def __init__(self, addr:bytes, tolerance=0.1):
+        self.addr = addr
+        self.tolerance = tolerance
+
+        self.seq = 0 # of this node's entry, advanced each advertisement
+
+        self.next_hop = {} # destination: neighbour
+        self._best = {} # destination: (cost, seq)
+        self._via = {} # destination: {neighbour: (advertised cost, seq)}
+        self._feasible = {} # destination: (seq, least cost) of its routes taken
+        self._advertised_by = {} # neighbour: {destination, ...}
+        self._links = {} # neighbour: cost
+
+        self._changed = set() # destinations whose route changed since last advertised
+
+    def __len__(self):
+        return len(self.next_hop)
+
+    def cost(self, destination:bytes) -> int:
+        return self._best.get(destination, (INFINITE_COST, 0))[0]
+
+    def set_link(self, neighbour:bytes, cost:int) -> bool:
+        """Sets what the link to `neighbour` costs, returns if it changed (enough)."""
+
+        old = self._links.get(neighbour)
+        if old is not None and abs(cost - old) <= old * self.tolerance:
+            return False
+
+        self._links[neighbour] = cost
+        if neighbour not in self._advertised_by: # reachable, before it advertises
+            self._learn(neighbour, neighbour, 0, 0)
+
+        next_hop = self.next_hop
+        for destination in self._advertised_by[neighbour]:
+            # dearer, only routes through it can change
+            if old is None or cost < old or next_hop.get(destination) == neighbour:
+                self._recompute(destination)
+
+        return True
+
+    def remove_neighbour(self, neighbour:bytes):
+        self._links.pop(neighbour, None)
+
+        for destination in self._advertised_by.pop(neighbour, ()):
+            self._via.get(destination, {}).pop(neighbour, None)
+            self._recompute(destination)
+
+    def update(self, neighbour:bytes, seq:int, entries):
+        """Takes an advertisement from `neighbour` (numbered `seq`, its own
+        entry): `entries` of (destination, cost, seq)."""
+
+        if neighbour not in self._links:
+            return # cost unknown, see `set_link`
+
+        self._learn(neighbour, neighbour, 0, seq)
+        self._recompute(neighbour)
+
+        for destination, cost, dest_seq in entries:
+            if destination == self.addr:
+                continue
+
+            self._learn(neighbour, destination, cost, dest_seq)
+            self._recompute(destination)
+
+    def _learn(self, neighbour, destination, cost, seq):
+        self._via.setdefault(destination, {})[neighbour] = (cost, seq)
+        self._advertised_by.setdefault(neighbour, set()).add(destination)
+
+    def _recompute(self, destination):
+        feasible = self._feasible.get(destination)
+
+        best = None # (total cost, seq, neighbour)
+        for neighbour, (cost, seq) in self._via.get(destination, {}).items():
+            if cost >= INFINITE_COST:
+                continue
+            if feasible is not None and (seq < feasible[0] or (seq == feasible[0] and cost >= feasible[1])):
+                continue
+
+            total = cost + self._links.get(neighbour, INFINITE_COST)
+            if total < INFINITE_COST and (best is None or total < best[0]):
+                best = (total, seq, neighbour)
+
+        old_cost, _ = self._best.get(destination, (INFINITE_COST, -1))
+        old_hop = self.next_hop.get(destination)
+
+        if best is not None:
+            total, seq, hop = best
+
+            if feasible is None or seq > feasible[0] or total < feasible[1]:
+                self._feasible[destination] = (seq, total)
+
+            self._best[destination] = (total, seq)
+            self.next_hop[destination] = hop
+
+        elif old_hop is not None: # lost, advertised as unreachable
+            self._best[destination] = (INFINITE_COST, feasible[0])
+            del self.next_hop[destination]
+            hop, total = None, INFINITE_COST
+
+        else:
+            hop, total = None, old_cost
+
+        if hop != old_hop or total != old_cost:
+            self._changed.add(destination)
+
+        if not self._via.get(destination):
+            self._via.pop(destination, None)
+
+    def advertisement(self, full=False):
+        """This node's next advertisement: its (new) sequence number and the
+        (destination, cost, seq) entries that changed since the last, or all
+        if `full`. Unreachable entries are forgotten once advertised."""
+
+        self.seq += 1
+
+        destinations = list(self._best) if full else list(self._changed)
+        self._changed.clear()
+
+        entries = []
+        for destination in destinations:
+            if destination not in self._best:
+                continue
+            cost, seq = self._best[destination]
+            entries.append((destination, cost, seq))
+            if cost >= INFINITE_COST and destination not in self._via:
+                del self._best[destination]
+
+        return self.seq, entries
@@ -3,17 +3,23 @@
 import unittest
 
 from .node import Node
-from .crypto import Crypto
+from .crypto import Crypto, KeyCache, AeadBox
+from nacl.exceptions import CryptoError
 from .broadcast import Broadcast
-from .constructs import BaseConstruct, Property, Action, ActionParameter
-from .types import types
+from .framing import BroadcastBatcher
+from .routing import SeenCache, RouteCache, GossipFlooding, NeighbourTable, RoutingTable, INFINITE_COST, route_next_hop
+from .dispatch import TimerWheel, RequestRegistry, DispatchedRequest
+from .constructs import BaseConstruct, BaseNode, Property, Action, ActionParameter
+from .types import types, types_by_repr, types_by_tag
 from .util import base64_decode
 
 import struct
+from time import monotonic
+import asyncio
 
-from .encoding import encode, decode
+from .encoding import encode, encode_into, decode, decode_lazy, LazyDict, StreamDecoder
 
-from .exceptions import DecodingError, ExceptionWithResponse, ArgumentValidationError
+from .exceptions import EncodingError, DecodingError, ExceptionWithResponse, ArgumentValidationError, TransmissionError
 
 # ChaCha Test suite too
 from .chacha20.test import *
@@ -98,6 +104,412 @@ class NodeTests(unittest.TestCase):
         self.assertFalse(self.n.property_named('on').value)
 
 
+    def test_container_frames(self):
+        faux_network_key = b'test' * 8
+
+        sender = Node()
+        sender.crypto.create_dual_keys()
+
+        self.n.cached_nodes[sender.network_addr] = sender
+        sender.cached_nodes[self.n.network_addr] = self.n
+
+        self.n.crypto.set_network_key(faux_network_key)
+        sender.crypto.set_network_key(faux_network_key)
+
+        sent = []
+        sender.do_transmission = lambda data, to: sent.append((data, to))
+
+        batcher = BroadcastBatcher(sender, max_size=1024, max_delay=60)
+        batcher.add(Broadcast.REQ(self.n.network_addr, sender.network_addr, raw_payload=b'^setState(T)'))
+        batcher.add(Broadcast.REQ(self.n.network_addr, sender.network_addr, raw_payload=b'foo,on'))
+        self.assertEqual((len(batcher), sent), (2, []))
+
+        batcher.flush()
+        self.assertEqual(len(sent), 1)
+        data, to = sent[0]
+        self.assertTrue(data.startswith(b'\x02\x0A\x07'))
+        self.assertEqual(to, self.n.network_addr)
+
+        # both are processed, both responses come back in one container
+        response = self.n.transmission_received_callback(data)
+        self.assertTrue(self.n.property_named('on').value)
+        self.assertEqual(len(response.broadcast), 2)
+        self.assertTrue(response.data.startswith(b'\x02\x0A'))
+
+        self.assertIsNone(sender.transmission_received_callback(response.data))
+
+        # a broadcast can not be slipped in as from another node
+        other = Broadcast.REQ(self.n.network_addr, b'someone', raw_payload=b'^setState(F)')
+        tb = sender.make_transmittable_container([other.encode('0.1', sender.payload_encryptor)])
+        self.assertIsNone(self.n.transmission_received_callback(tb.data))
+        self.assertTrue(self.n.property_named('on').value)
+
+        # filling a frame sends it
+        batcher = BroadcastBatcher(sender, max_size=300, max_delay=60)
+        for _ in range(3):
+            batcher.add(Broadcast.ANNC(sender.network_addr, raw_payload=b's60:' + b'x' * 60))
+        self.assertEqual((len(sent), len(batcher)), (2, 1))
+
+    def test_duplicate_broadcasts_dropped(self):
+        faux_network_key = b'test' * 8
+
+        sender = Node()
+        sender.crypto.create_dual_keys()
+
+        self.n.cached_nodes[sender.network_addr] = sender
+        sender.cached_nodes[self.n.network_addr] = self.n
+
+        self.n.crypto.set_network_key(faux_network_key)
+        sender.crypto.set_network_key(faux_network_key)
+
+        tb = sender.make_transmittable_broadcast(
+            Broadcast.REQ(self.n.network_addr, sender.network_addr, raw_payload=b'^setState(T)'))
+
+        self.assertIsNotNone(self.n.transmission_received_callback(tb.data))
+        self.n.property_named('on').value = False
+
+        self.assertIsNone(self.n.transmission_received_callback(tb.data)) # flooded back, ignored
+        self.assertFalse(self.n.property_named('on').value)
+        self.assertEqual((self.n.seen_broadcasts.hits, self.n.seen_broadcasts.misses), (1, 1))
+
+        # nor are a node's own broadcasts processed when they come back to it
+        self.assertIn((sender.network_addr, tb.broadcast.nonce), sender.seen_broadcasts)
+
+    def test_dispatch_request(self):
+        faux_network_key = b'test' * 8
+
+        sender = Node()
+        sender.crypto.create_dual_keys()
+
+        self.n.cached_nodes[sender.network_addr] = sender
+        sender.cached_nodes[self.n.network_addr] = self.n
+
+        self.n.crypto.set_network_key(faux_network_key)
+        sender.crypto.set_network_key(faux_network_key)
+
+        # delivered straight to `self.n`, its response straight back
+        sender.do_transmission = lambda data, to: sender.transmission_received_callback(
+            self.n.transmission_received_callback(data).data)
+
+        responses = []
+        sender.dispatch_request(Broadcast.REQ(self.n.network_addr, sender.network_addr, raw_payload=b'on'),
+                                responses.append)
+
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(responses[0].resp_code, b'OK')
+        self.assertIn('on', responses[0].payload.resp_annc_obj)
+        self.assertEqual(len(sender.dispatched_requests), 0)
+
+        # an action name given with its '^' is still run
+        req = Broadcast.REQ(self.n.network_addr, sender.network_addr)
+        req.payload.request_actions['^setState'] = [True]
+        sender.dispatch_request(req, responses.append)
+
+        self.assertEqual(responses[1].resp_code, b'ACK')
+        self.assertIs(self.n.property_named('on').value, True)
+
+    def test_awaitable_request(self):
+        faux_network_key = b'test' * 8
+
+        sender = Node()
+        sender.crypto.create_dual_keys()
+
+        self.n.cached_nodes[sender.network_addr] = sender
+        sender.cached_nodes[self.n.network_addr] = self.n
+
+        self.n.crypto.set_network_key(faux_network_key)
+        sender.crypto.set_network_key(faux_network_key)
+
+        self.n.property_named('foo').value = 'bar'
+
+        async def run():
+            in_flight = []
+            sender.do_transmission = lambda data, to: in_flight.append(data)
+
+            first = asyncio.ensure_future(sender.request(self.n.network_addr, props=['foo']))
+            second = asyncio.ensure_future(sender.request(self.n.network_addr,
+                                                          actions={'setState': [True]}, props=['on']))
+            await asyncio.sleep(0)
+            self.assertEqual(len(in_flight), 3) # a route request (no route yet) then both
+
+            for data in reversed(in_flight): # answered out of order
+                sender.transmission_received_callback(self.n.transmission_received_callback(data).data)
+
+            self.assertEqual((await first).payload.resp_annc_obj['foo'], 'bar')
+            self.assertEqual((await second).payload.resp_annc_obj['on'], True)
+
+            sender.dispatched_requests.timers.tick = 0.01
+            sender.do_transmission = lambda data, to: None # lost
+            with self.assertRaises(asyncio.TimeoutError):
+                await sender.request(self.n.network_addr, props=['foo'], timeout=0.02)
+
+            self.assertEqual(len(sender.dispatched_requests), 0)
+            sender.dispatched_requests.timers.stop()
+            sender.gossip.timers.stop()
+
+        asyncio.run(run())
+
+    def test_request_timeout_without_loop(self):
+        now = [0.0]
+        sender, other = Node(), Node()
+        for n in (sender, other):
+            n.crypto.create_dual_keys()
+        sender.crypto.set_network_key(b'test' * 8)
+        sender.cached_nodes[other.network_addr] = other
+        sender.dispatched_requests.timers = TimerWheel(tick=1, clock=lambda: now[0])
+        sender.do_transmission = lambda data, to: None # lost
+
+        timed_out = []
+        sender.dispatch_request(Broadcast.REQ(other.network_addr, sender.network_addr), timeout=5,
+                                timeout_callback=lambda: timed_out.append(1))
+        self.assertEqual(len(sender.dispatched_requests), 1)
+
+        now[0] = 6 # fired by the next frame received (even junk), or request
+        sender.transmission_received_callback(b'junk')
+        self.assertEqual((timed_out, len(sender.dispatched_requests)), ([1], 0))
+
+        sender.dispatch_request(Broadcast.REQ(other.network_addr, sender.network_addr), timeout=5,
+                                timeout_callback=lambda: timed_out.append(2))
+        now[0] = 12
+        sender.dispatch_request(Broadcast.REQ(other.network_addr, sender.network_addr), timeout=5)
+        self.assertEqual((timed_out, len(sender.dispatched_requests)), ([1, 2], 1))
+
+        async def in_loop(): # the timers started on it
+            sender.dispatched_requests.timers = TimerWheel()
+            sender.dispatch_request(Broadcast.REQ(other.network_addr, sender.network_addr))
+            self.assertTrue(sender.dispatched_requests.timers.running)
+            sender.dispatched_requests.timers.stop()
+            sender.gossip.timers.stop()
+        asyncio.run(in_loop())
+
+    def test_cache_node_prepares_keys(self):
+        other = Node()
+        other.crypto.create_dual_keys()
+        old_public = other.node_info['kPublic']
+
+        self.n.cache_node(other)
+        self.assertIs(self.n.cached_nodes[other.network_addr], other)
+        self.assertIn(old_public, self.n.crypto._boxes)
+
+        renewed = Node()
+        renewed.crypto.create_dual_keys()
+
+        self.n.cache_node(renewed, other.network_addr) # keys changed, old ones dropped
+        self.assertNotIn(old_public, self.n.crypto._boxes)
+        self.assertIn(renewed.node_info['kPublic'], self.n.crypto._boxes)
+
+        # keys from the network that aren't keys are cached but not prepared
+        bad = BaseNode()
+        bad.node_info = {'addr': b'zz', 'kVerify': b'short', 'kPublic': [b'not bytes']}
+        self.n.cache_node(bad, b'zz')
+        self.assertIs(self.n.cached_nodes[b'zz'], bad)
+        self.assertNotIn(b'short', self.n.crypto._verify_keys)
+
+        self.n.cache_node(other, b'zz') # replacing them
+        self.assertIn(old_public, self.n.crypto._boxes)
+
+    def test_relaying_frames(self):
+        faux_network_key = b'test' * 8
+
+        sender, relay = Node(), Node()
+        for n in (sender, relay):
+            n.crypto.create_dual_keys()
+            n.crypto.set_network_key(faux_network_key)
+        self.n.crypto.set_network_key(faux_network_key)
+
+        self.n.cached_nodes[sender.network_addr] = sender
+        sender.cached_nodes[self.n.network_addr] = self.n
+
+        relayed = []
+        relay.do_transmission = lambda data, to: relayed.append((data, to))
+
+        # the relay doesn't know the sender, nor need to
+        data = sender.make_transmittable_broadcast(Broadcast.REQ(self.n.network_addr, sender.network_addr, raw_payload=b'foo,on')).data
+        self.assertEqual(data[2], 7)
+        self.assertIsNone(relay.transmission_received_callback(data))
+
+        self.assertEqual(len(relayed), 1)
+        frame, to = relayed[0]
+        self.assertEqual(to, self.n.network_addr)
+        self.assertEqual(bytes(frame), data[:2] + b'\x06' + data[3:]) # only hops changed
+
+        response = self.n.transmission_received_callback(frame)
+        self.assertEqual(response.broadcast.kind, 'RESP')
+
+        # copies coming back are dropped, not relayed again
+        self.assertIsNone(relay.transmission_received_callback(frame))
+        self.assertEqual(relay.relayed_frames, 1)
+
+        # to all, processed and relayed by gossip: at once without a loop
+        #  running its timers, a little later with one
+        relay.cached_nodes[sender.network_addr] = sender
+        annc = sender.make_transmittable_broadcast(Broadcast.ANNC(sender.network_addr, raw_payload=b'foo')).data
+        relay.transmission_received_callback(annc)
+        self.assertEqual((len(relay.gossip), relayed[-1][1]), (0, b'*'))
+
+        loop = asyncio.new_event_loop()
+        relay.start_timers(loop)
+        annc = sender.make_transmittable_broadcast(Broadcast.ANNC(sender.network_addr, raw_payload=b'bar')).data
+        relay.transmission_received_callback(annc)
+        self.assertEqual((len(relay.gossip), relay.relayed_frames), (1, 2))
+        relay.gossip.timers.advance(monotonic() + 1)
+        self.assertEqual((len(relay.gossip), relay.relayed_frames), (0, 3))
+        relay.gossip.timers.stop()
+        relay.dispatched_requests.timers.stop()
+        loop.close()
+
+        # no hops left
+        sender.hop_limit = 0
+        data = sender.make_transmittable_broadcast(Broadcast.REQ(self.n.network_addr, sender.network_addr, raw_payload=b'foo')).data
+        relay.transmission_received_callback(data)
+        self.assertEqual(relay.relayed_frames, 3)
+
+        # containers too
+        sender.hop_limit = 1
+        sender.do_transmission = lambda data, to: relay.transmission_received_callback(data)
+        batcher = BroadcastBatcher(sender, max_delay=60)
+        batcher.add(Broadcast.REQ(self.n.network_addr, sender.network_addr, raw_payload=b'foo'))
+        batcher.add(Broadcast.REQ(self.n.network_addr, sender.network_addr, raw_payload=b'on'))
+        batcher.flush()
+
+        frame, to = relayed[-1]
+        self.assertEqual((relay.relayed_frames, frame[2], to), (4, 0, self.n.network_addr))
+        self.assertEqual(len(self.n.transmission_received_callback(frame).broadcast), 2)
+
+    def test_node_info_made_on_change(self):
+        n = Node()
+        n.crypto.create_dual_keys()
+
+        identity = n.crypto.identity
+        self.assertIs(n.crypto.identity, identity)
+        self.assertEqual(n.network_addr, identity.addr)
+        self.assertEqual(n.node_info['kPublic'], identity.public_key.encode())
+
+        made_from = n._node_info_made_from
+        n.node_info
+        self.assertIs(n._node_info_made_from, made_from) # nothing changed, not made again
+
+        n.join_group('lights')
+        n.join_group('locks', b'k' * 32)
+        self.assertEqual(n.node_info['groups'], {'*': ['lights'], '#': ['locks']})
+
+        n.crypto.encrypt_symmetrically(b'on', b'k' * 32)
+        n.join_group('locks', b'K' * 32) # new key, the old one's box dropped
+        self.assertNotIn(b'k' * 32, n.crypto._group_boxes)
+        n.leave_group('lights')
+        self.assertEqual(n.node_info['groups'], {'*': [], '#': ['locks']})
+
+        n.crypto.create_dual_keys()
+        self.assertIsNot(n.crypto.identity, identity)
+        self.assertNotEqual(n.network_addr, identity.addr)
+        self.assertEqual(n.node_info['addr'], n.network_addr)
+        self.assertEqual(n.node_info['kVerify'], n.crypto.signing_key.verify_key.encode())
+
+        # written over in place, what is filled in still matches the node
+        n.node_info['addr'] = b'abc'
+        n.node_info['capabilities'] = ['relay']
+        self.assertEqual(n.node_info['addr'], n.network_addr)
+        self.assertEqual(n.node_info['capabilities'], ['relay'])
+        self.assertEqual(decode(encode(n)).node_info['addr'], n.network_addr)
+
+    def test_junk_frames_dropped(self):
+        self.n.crypto.set_network_key(b'test' * 8)
+        decrypted = []
+        decrypt = self.n.crypto.decrypt_from_network
+        self.n.crypto.decrypt_from_network = lambda data: decrypted.append(data) or decrypt(data)
+
+        junk = [
+            b'\x01',                                      # short
+            b'\x03\x01\x00\x60' + bytes(0x60),            # version
+            b'\x01\x07\x00\x60' + bytes(0x60),            # handle
+            b'\x01\x01\x00\x60' + bytes(0x50),            # length (truncated)
+            b'\x01\x01\x00\x10' + bytes(0x10),            # size
+        ]
+        for frame in junk:
+            self.assertIsNone(self.n.transmission_received_callback(frame))
+
+        self.assertEqual(decrypted, []) # all before any decryption
+        self.assertEqual(dict(self.n.dropped_frames),
+                         {'short': 1, 'version': 1, 'handle': 1, 'length': 1, 'size': 1})
+
+        # well framed, but not of this network, dropped before verifying
+        stranger = Node()
+        stranger.crypto.create_dual_keys()
+        stranger.crypto.set_network_key(b'nope' * 8)
+        tb = stranger.make_transmittable_broadcast(Broadcast.ANNC(stranger.network_addr))
+        self.assertIsNone(self.n.transmission_received_callback(tb.data))
+        self.assertEqual(self.n.dropped_frames['broadcast version'], 1)
+
+    def test_network_aead_frames(self):
+        sender = Node()
+        sender.crypto.create_dual_keys()
+
+        self.n.cache_node(sender)
+        sender.cache_node(self.n)
+
+        self.n.crypto.set_network_key(b'test' * 8, aead=True)
+        sender.crypto.set_network_key(b'test' * 8, aead=True)
+
+        req = Broadcast.REQ(self.n.network_addr, sender.network_addr, raw_payload=b'^setState(T)')
+        tb = sender.make_transmittable_broadcast(req)
+        self.assertIsNotNone(self.n.transmission_received_callback(tb.data))
+        self.assertTrue(self.n.property_named('on').value)
+
+        stranger = Node()
+        stranger.crypto.create_dual_keys()
+        stranger.crypto.set_network_key(b'nope' * 8, aead=True)
+        tb = stranger.make_transmittable_broadcast(Broadcast.ANNC(stranger.network_addr))
+        self.assertIsNone(self.n.transmission_received_callback(tb.data))
+
+        corrupted = bytearray(sender.make_transmittable_broadcast(Broadcast.ANNC(sender.network_addr)).data)
+        corrupted[40] ^= 0xFF
+        self.assertIsNone(self.n.transmission_received_callback(bytes(corrupted)))
+
+        self.assertEqual(self.n.dropped_frames['network tag'], 2)
+
+    def test_broadcast_version_negotiation(self):
+        old = Node()
+        old.crypto.create_dual_keys()
+        old.wire_version = '0.1'
+
+        self.n.cached_nodes[old.network_addr] = old
+
+        self.assertEqual(self.n.broadcast_version_for(old.network_addr), '0.1')
+        self.assertEqual(self.n.broadcast_version_for(b'*'), '0.2')
+
+        old.wire_version = '0.3' # newer than known, the one both know
+        self.assertEqual(self.n.broadcast_version_for(old.network_addr), '0.2')
+
+        tb = self.n.make_transmittable_broadcast(Broadcast.ANNC(self.n.network_addr))
+        self.assertTrue(tb.plain.startswith(b'\x00\x02'))
+
+    def test_frames_to_version_1_readers(self):
+        old = Node()
+        old.crypto.create_dual_keys()
+        old.wire_version = '0.1' # as advertised by nodes from before frame version 2
+        for n in (old, self.n):
+            n.crypto.set_network_key(b'test' * 8)
+
+        self.n.cached_nodes[old.network_addr] = old
+        old.cached_nodes[self.n.network_addr] = self.n
+
+        data = self.n.make_transmittable_broadcast(Broadcast.REQ(old.network_addr, self.n.network_addr, raw_payload=b'foo,on')).data
+        self.assertEqual(data[:2], b'\x01\x01')
+        self.assertEqual(struct.unpack('!H', data[2:4])[0], len(data) - 4)
+
+        # read as a node only knowing version 1 frames does, a 4 byte header
+        signed = old.crypto.decrypt_from_network(data[4:])
+        plain = old.crypto.verify_signed_bytes(signed, self.n.node_info['kVerify'])
+        b = Broadcast.from_plain_broadcast_bytes(plain, old.payload_decryptor)
+        self.assertEqual((b.kind, b.frm), ('REQ', self.n.network_addr))
+
+        self.assertEqual(old.transmission_received_callback(data).broadcast.kind, 'RESP') # not relayed, but read
+
+        # to a group: this node's `wire_version`
+        self.assertEqual(self.n.make_transmittable_broadcast(Broadcast.ANNC(self.n.network_addr)).data[0], 2)
+        self.n.wire_version = '0.1'
+        self.assertEqual(self.n.make_transmittable_broadcast(Broadcast.ANNC(self.n.network_addr)).data[:2], b'\x01\x01')
+
     def test_bad_sig(self):
 
         faux_network_key = b'test' * 8
@@ -122,7 +534,7 @@ class NodeTests(unittest.TestCase):
         self.n.transmission_received_callback(b'\x01\x01' + struct.pack('!H', len(encrypted)) + encrypted)
 
     def test_to_groups_broacast_encoding_via_node(self):
-        self.n.joined_secure_groups[b'#asecgroup'] = b'\x7c' * 32
+        self.n.join_group(b'#asecgroup', b'\x7c' * 32)
 
         b = Broadcast.REQ(b'*somegroup', b'zyx', raw_payload=b'foo')
         fake_data = b.encode('0.1', self.n.payload_encryptor)
@@ -204,14 +616,80 @@ class CryptoTests(unittest.TestCase):
 
         self.assertEqual(de, test_message)
 
+    def test_network_aead(self):
+        c = Crypto()
+        c.create_dual_keys()
+        c.set_network_key(b'\x44' * 32, aead=True)
+        self.assertEqual(c.network_overhead, 64 + 24 + 16)
+
+        en = c.sign_and_encrypt_with_network_key(b'TestingTesting')
+        self.assertEqual(c.verify_signed_bytes(c.decrypt_from_network(en), c.signing_key.verify_key.encode()),
+                         b'TestingTesting')
+
+        tampered = en[:-1] + bytes([en[-1] ^ 1])
+        self.assertRaises(CryptoError, c.decrypt_from_network, tampered)
+
+        foreign = AeadBox(b'\x45' * 32).encrypt(b'x' * 80, b'n' * 24)
+        self.assertRaises(CryptoError, c.decrypt_from_network, foreign)
+
+        save = c.get_save_key_dict()
+        loaded = Crypto()
+        loaded.load_keys_from_save_dict(save)
+        self.assertTrue(loaded.network_aead)
+        self.assertEqual(loaded.decrypt_from_network(en)[64:], b'TestingTesting')
+
     def test_standard_symmetric_functions(self):
 
         test_key = b'\x4a' * 32
         test_message = b'TestingTesting\x00\x01\x02!'
 
-        en = Crypto.encrypt_symmetrically(test_message, test_key)
+        c, other = Crypto(), Crypto()
+
+        en = c.encrypt_symmetrically(test_message, test_key)
+
+        de = other.decrypt_symmetrically(en, test_key)
+        self.assertEqual(de, test_message)
+
+        # prepared boxes are each instance's own, dropped once the key isn't used
+        self.assertIn(test_key, c._group_boxes)
+        self.assertNotIn(b'\x4b' * 32, other._group_boxes)
+        c.encrypt_symmetrically(test_message, b'\x4b' * 32)
+        self.assertNotIn(b'\x4b' * 32, other._group_boxes)
+
+        c.forget_symmetric_key(test_key)
+        self.assertNotIn(test_key, c._group_boxes)
+        self.assertIn(test_key, other._group_boxes)
 
-        de = Crypto.decrypt_symmetrically(en, test_key)
+    def test_peer_key_cache(self):
+        made = []
+        cache = KeyCache(lambda key: made.append(key) or key.upper(), max_entries=2)
+
+        self.assertEqual(cache.get(b'a'), b'A')
+        cache.get(b'b')
+        cache.get(b'a') # made once, now most recent
+        cache.get(b'c') # evicts b
+        self.assertEqual(made, [b'a', b'b', b'c'])
+        self.assertNotIn(b'b', cache)
+        cache.forget(b'a')
+        self.assertEqual(len(cache), 1)
+
+        alice, bob = Crypto(), Crypto()
+        alice.create_dual_keys()
+        bob.create_dual_keys()
+
+        bob_keys = (bob.signing_key.verify_key.encode(), bob.private_key.public_key.encode())
+        alice_public = alice.private_key.public_key.encode()
+
+        alice.add_peer_keys(*bob_keys)
+        self.assertIn(bob_keys[1], alice._boxes)
+
+        secret = bob.encrypt_to_public_key(b'hi', alice_public)
+        self.assertEqual(alice.decrypt_from_public_key(secret, bob_keys[1]), b'hi')
+        self.assertEqual(bob.decrypt_from_public_key(alice.encrypt_to_public_key(b'yo', bob_keys[1]), alice_public), b'yo')
+        self.assertEqual(len(alice._boxes), 1) # the prepared one was used
+
+        alice.forget_peer_keys(*bob_keys)
+        self.assertEqual((len(alice._boxes), len(alice._verify_keys)), (0, 0))
 
 
 
@@ -233,6 +711,354 @@ class ConstructsTests(unittest.TestCase):
         args = ('not bool', 123)
         self.assertRaises(ArgumentValidationError, a.validate_args, *args)
 
+    def test_type_tables(self):
+        for t in types:
+            self.assertIs(types_by_repr[t.repr], t)
+            self.assertIs(types_by_tag[ord(t.repr)], t)
+
+        self.assertNotIn('x', types_by_repr)
+        self.assertNotIn(ord('s'), types_by_repr) # one kind of key each
+        self.assertNotIn('s', types_by_tag)
+
+        with self.assertRaises(DecodingError): decode(b'pname|x|n|d;;')
+
+
+class RoutingTests(unittest.TestCase):
+
+    def test_seen_cache(self):
+        now = [0.0]
+        cache = SeenCache(max_entries=3, max_age=10, clock=lambda: now[0])
+
+        self.assertFalse(cache.seen('a'))
+        cache.add('a')
+        self.assertTrue(cache.seen('a'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        for key in 'bcd': # bounded, the oldest is forgotten
+            cache.add(key)
+        self.assertEqual(len(cache), 3)
+        self.assertNotIn('a', cache)
+
+        now[0] = 5
+        cache.add('e')
+        now[0] = 12 # b, c and d were added at 0
+        self.assertNotIn('d', cache)
+        self.assertIn('e', cache)
+        self.assertEqual(len(cache), 1)
+        now[0] = 15
+        self.assertNotIn('e', cache)
+
+    def test_route_cache(self):
+        now = [0.0]
+        cache = RouteCache(max_entries=3, max_age=10, clock=lambda: now[0])
+
+        self.assertTrue(cache.add(('me', 'b', 'c', 'd')))
+        self.assertFalse(cache.add(('me', 'x', 'y', 'z', 'd'))) # longer than the cached one
+        self.assertFalse(cache.add(('me', 'b', 'me', 'e'))) # a loop
+        self.assertTrue(cache.add(('me', 'b', 'e')))
+        self.assertEqual(cache.get('d'), ('me', 'b', 'c', 'd'))
+
+        self.assertEqual(cache.link_failed('c', 'b'), 1) # either way
+        self.assertNotIn('d', cache)
+        self.assertIn('e', cache)
+
+        self.assertEqual(cache.link_failed('me', 'b'), 1)
+        self.assertEqual((len(cache), cache._by_link), (0, {}))
+
+        for dest in 'fghi': # bounded, the oldest is forgotten
+            cache.add(('me', dest))
+        self.assertEqual(len(cache), 3)
+        self.assertNotIn('f', cache)
+
+        now[0] = 10
+        self.assertIsNone(cache.get('i'))
+        self.assertEqual(cache._by_link, {})
+
+    def test_route_next_hop(self):
+        self.assertEqual(route_next_hop(b'b>c>d', b'b'), b'c')
+        self.assertEqual(route_next_hop(b'b>c>d', b'c'), b'd')
+        self.assertIsNone(route_next_hop(b'b>c>d', b'd')) # the destination
+        self.assertIsNone(route_next_hop(b'b>c>d', b'e'))
+
+    def test_source_routing(self):
+        # a line: a - b - c - d, and e next to b only. Like radio, everything
+        #  transmitted is heard by all the node's neighbours
+        names = 'abcde'
+        nodes = {name: Node() for name in names}
+        for n in nodes.values():
+            n.crypto.create_dual_keys()
+            n.crypto.set_network_key(b'test' * 8)
+        for n in nodes.values():
+            for other in nodes.values():
+                if other is not n:
+                    n.cached_nodes[other.network_addr] = other
+        addr = {name: n.network_addr for name, n in nodes.items()}
+
+        links = {('a', 'b'), ('b', 'c'), ('c', 'd'), ('b', 'e')}
+        heard = [] # (by, frame)
+
+        def transmitter(name):
+            def do_transmission(data, to):
+                neighbours = {y for x, y in links if x == name} | {x for x, y in links if y == name}
+                if to not in (b'*', addr[name]) and to not in {addr[nb] for nb in neighbours}:
+                    raise TransmissionError('No link to %r' % to)
+                for neighbour in sorted(neighbours):
+                    heard.append((neighbour, data))
+            return do_transmission
+        for name, n in nodes.items():
+            n.do_transmission = transmitter(name)
+
+        def run():
+            while heard:
+                name, data = heard.pop(0)
+                tb = nodes[name].transmission_received_callback(data)
+                if tb is not None:
+                    nodes[name].do_transmission(tb.data, tb.broadcast.next_hop)
+
+        a, d, e = nodes['a'], nodes['d'], nodes['e']
+
+        a.discover_route(addr['d'])
+        run()
+        self.assertEqual(a.routes.get(addr['d']), (addr['a'], addr['b'], addr['c'], addr['d']))
+        self.assertEqual(d.routes.get(addr['a']), (addr['d'], addr['c'], addr['b'], addr['a']))
+
+        e.relayed_frames = 0
+        e.seen_broadcasts.misses = 0
+        responses = []
+        req = Broadcast.REQ(addr['d'], addr['a'], raw_payload=b'on')
+        a.dispatch_request(req, responses.append)
+        self.assertEqual(req.to, addr['b'] + b'>' + addr['c'] + b'>' + addr['d'])
+        run()
+
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(responses[0].frm, addr['d'])
+        self.assertEqual(e.relayed_frames, 0) # heard b relay them, but not on their routes
+        self.assertEqual(e.seen_broadcasts.misses, 2)
+
+        # the c - d link breaks, c tells a
+        links.discard(('c', 'd'))
+        a.dispatch_request(Broadcast.REQ(addr['d'], addr['a'], raw_payload=b'on'))
+        run()
+        self.assertNotIn(addr['d'], a.routes)
+        self.assertNotIn(addr['d'], nodes['c'].routes)
+
+
+    def test_gossip_flooding(self):
+        now = [0.0]
+        wheel = TimerWheel(tick=0.01, clock=lambda: now[0])
+        loop = asyncio.new_event_loop()
+        wheel.start(loop) # (never run, advanced here)
+        self.addCleanup(loop.close)
+        self.addCleanup(wheel.stop)
+        gossip = GossipFlooding(wheel, threshold=3, fanout=4, max_delay=0.2, rand=lambda: 0.5)
+
+        self.assertEqual([gossip.probability(n) for n in (0, 2, 8)], [1.0, 1.0, 0.5])
+
+        relayed = []
+        gossip.relay_later('a', lambda: relayed.append('a'), 16)
+        gossip.relay_later('b', lambda: relayed.append('b'), 2)
+        gossip.relay_later('c', lambda: relayed.append('c'), 16) # chance .25, rand .5
+        gossip.relay_later('a', lambda: relayed.append('a again'), 16)
+
+        gossip.heard_copy('b')
+        gossip.heard_copy('b') # 3 copies, decided without waiting
+        gossip.heard_copy('c') # 2, so only by chance ('a' heard once goes on for sure)
+        self.assertEqual(len(gossip), 2)
+
+        now[0] = 0.05
+        wheel.advance()
+        self.assertEqual(relayed, []) # half of `max_delay`
+
+        now[0] = 0.2
+        wheel.advance()
+        gossip.heard_copy('a') # too late, nothing
+        self.assertEqual(relayed, ['a'])
+        self.assertEqual((gossip.relayed, gossip.suppressed, gossip.skipped, len(gossip)), (1, 1, 1, 0))
+
+    def test_neighbour_table(self):
+        now = [0.0]
+        table = NeighbourTable(default_rtt=0.01, alpha=0.5, max_silence=30, clock=lambda: now[0])
+
+        self.assertEqual(table.cost('b'), INFINITE_COST)
+        self.assertTrue(table.heard('b', seq=1))
+        self.assertFalse(table.heard('b', seq=2))
+        self.assertEqual(table.cost('b'), 10) # ms, nothing lost
+
+        table.rtt_measured('b', 0.03)
+        self.assertEqual(table.cost('b'), 20)
+
+        table.heard('b', seq=4) # 3 was lost: delivery .5 then .75
+        self.assertEqual(table.cost('b'), 27)
+
+        now[0] = 20
+        table.heard('c')
+        now[0] = 30
+        self.assertEqual(table.expire(), ['b'])
+        self.assertEqual(list(table), ['c'])
+
+    def test_routing_table(self):
+        # a line: me - b - c - d, and me - e - d costing more
+        table = RoutingTable('me', tolerance=0.1)
+
+        table.update('b', 1, [('c', 10, 1)]) # cost of b not known yet, ignored
+        self.assertEqual(len(table), 0)
+
+        self.assertTrue(table.set_link('b', 10))
+        self.assertTrue(table.set_link('e', 30))
+        table.update('b', 1, [('c', 10, 1), ('d', 20, 1), ('me', 10, 5)])
+        table.update('e', 1, [('d', 25, 1)])
+
+        self.assertEqual(table.next_hop, {'b': 'b', 'e': 'e', 'c': 'b', 'd': 'b'})
+        self.assertEqual((table.cost('c'), table.cost('d'), table.cost('me')), (20, 30, INFINITE_COST))
+
+        seq, entries = table.advertisement(full=True)
+        self.assertEqual(seq, 1)
+        self.assertEqual(sorted(entries), [('b', 10, 1), ('c', 20, 1), ('d', 30, 1), ('e', 30, 1)])
+        self.assertEqual(table.advertisement(), (2, [])) # nothing changed
+
+        self.assertFalse(table.set_link('b', 11)) # within the tolerance
+        self.assertEqual(table.cost('d'), 30)
+
+        # b's link to c breaks, it advertises d as unreachable. e's route is
+        #  feasible, less than the least cost to d so far (so not through here)
+        table.update('b', 2, [('c', INFINITE_COST, 1), ('d', INFINITE_COST, 1)])
+        self.assertEqual(table.next_hop['d'], 'e')
+        self.assertNotIn('c', table.next_hop)
+
+        # b then routing to d through this node (it heard our cost 30 to it) is
+        #  not feasible, it would be a loop
+        table.update('b', 3, [('d', 40, 1)])
+        self.assertEqual((table.next_hop['d'], table.cost('d')), ('e', 55))
+        self.assertEqual(sorted(table.advertisement()[1]), [('c', INFINITE_COST, 1), ('d', 55, 1)])
+        self.assertNotIn('c', table.advertisement(full=True)[1]) # forgotten once advertised
+
+        # a newer route from d is taken
+        table.update('b', 4, [('d', 20, 2)])
+        self.assertEqual((table.next_hop['d'], table.cost('d')), ('b', 30))
+
+        table.remove_neighbour('b') # e's route to d is older, until d's next number
+        self.assertEqual(table.next_hop, {'e': 'e'})
+        table.update('e', 2, [('d', 25, 3)])
+        self.assertEqual(table.next_hop, {'e': 'e', 'd': 'e'})
+
+    def test_route_advertisements(self):
+        # a line: a - b - c - d, like radio everything transmitted is heard by
+        #  all the node's neighbours
+        names = 'abcd'
+        nodes = {name: Node() for name in names}
+        for n in nodes.values():
+            n.crypto.create_dual_keys()
+            n.crypto.set_network_key(b'test' * 8)
+            n.source_routing = False
+        for n in nodes.values():
+            for other in nodes.values():
+                if other is not n:
+                    n.cached_nodes[other.network_addr] = other
+        addr = {name: n.network_addr for name, n in nodes.items()}
+
+        links = {('a', 'b'), ('b', 'c'), ('c', 'd')}
+        heard = [] # (by, frame)
+
+        def transmitter(name):
+            def do_transmission(data, to):
+                for x, y in sorted(links):
+                    if name in (x, y):
+                        heard.append((y if x == name else x, data))
+            return do_transmission
+        for name, n in nodes.items():
+            n.do_transmission = transmitter(name)
+
+        def run():
+            while heard:
+                name, data = heard.pop(0)
+                tb = nodes[name].transmission_received_callback(data)
+                if tb is not None:
+                    nodes[name].do_transmission(tb.data, tb.broadcast.to)
+
+        for _ in range(3):
+            for n in nodes.values():
+                n.advertise_routes()
+            run()
+
+        a = nodes['a']
+        self.assertEqual(a.routing_table.next_hop.get(addr['d']), addr['b'])
+        self.assertEqual(a.link_to(addr['d']), addr['b'])
+        self.assertEqual(a.routing_table.cost(addr['d']), 30) # 3 links of the default 10ms
+        self.assertEqual(nodes['d'].routing_table.next_hop.get(addr['a']), addr['c'])
+        self.assertIn([addr['b'], 10], a.node_info['routing'])
+
+        # b is not heard from again
+        for n in nodes.values():
+            n.neighbours.clock = lambda: monotonic() + 60
+            if n is not nodes['b']:
+                n.advertise_routes()
+        run()
+        self.assertNotIn(addr['b'], a.neighbours)
+        self.assertNotIn(addr['d'], a.routing_table.next_hop)
+
+
+class DispatchTests(unittest.TestCase):
+
+    def test_timer_wheel(self):
+        now = [0.0]
+        wheel = TimerWheel(tick=1, slots=8, clock=lambda: now[0])
+
+        fired = []
+        wheel.schedule(2.5, lambda: fired.append('a'))
+        wheel.schedule(20, lambda: fired.append('c')) # more than one turn
+        cancelled = wheel.schedule(3, lambda: fired.append('x'))
+        wheel.schedule(0, lambda: fired.append('now'))
+        cancelled.cancel()
+
+        wheel.advance(0.5)
+        self.assertEqual(fired, [])
+        wheel.advance(1)
+        self.assertEqual(fired, ['now'])
+        wheel.advance(2.9)
+        self.assertEqual(fired, ['now']) # never early
+        wheel.advance(3)
+        self.assertEqual(fired, ['now', 'a'])
+
+        wheel.advance(19)
+        self.assertEqual(len(wheel), 1)
+        wheel.advance(100) # a long gap still fires it
+        self.assertEqual((fired[-1], len(wheel)), ('c', 0))
+
+    def test_request_registry(self):
+        now = [0.0]
+        registry = RequestRegistry(TimerWheel(tick=1, clock=lambda: now[0]))
+
+        answered, timed_out = [], []
+        first = DispatchedRequest(b'abc', answered.append, lambda: timed_out.append(1))
+        second = DispatchedRequest(b'abc', answered.append, lambda: timed_out.append(2))
+        other = DispatchedRequest(b'xyz', answered.append, lambda: timed_out.append(3))
+
+        registry.add(first, timeout=5)
+        registry.add(second, timeout=5)
+        registry.add(other, timeout=2)
+        self.assertEqual((len(registry), registry.waiting_on(b'abc')), (3, 2))
+
+        resp = Broadcast.RESP(b'me', b'abc', b'OK')
+        self.assertIs(registry.response_received(resp), first) # oldest first
+        self.assertEqual(answered, [resp])
+
+        now[0] = 3
+        registry.timers.advance()
+        self.assertEqual((timed_out, len(registry)), ([3], 1))
+
+        self.assertIsNone(registry.response_received(Broadcast.RESP(b'me', b'xyz', b'OK')))
+
+        # a response with the request nonce answers that request, not the oldest
+        by_nonce = DispatchedRequest(b'abc', answered.append, nonce=b'nnnn')
+        registry.add(by_nonce, timeout=5)
+        self.assertIs(registry.response_received(Broadcast.RESP(b'me', b'abc', b'OK', reply_to=b'nnnn')), by_nonce)
+        self.assertIsNone(registry.response_received(Broadcast.RESP(b'me', b'abc', b'OK', reply_to=b'nnnn')))
+
+        now[0] = 10
+        registry.timers.advance()
+        self.assertEqual((timed_out, len(registry)), ([3, 2], 0))
+        self.assertEqual(len(answered), 2)
+
 
 class UtilTests(unittest.TestCase):
 
@@ -257,6 +1083,87 @@ class BroadcastTests(unittest.TestCase):
         self.assertEqual(self.annc.encode('0.1')[6:], b'|ANNC|*|abc|czY6Zm9vYmFy')
         self.assertEqual(self.resp.encode('0.1')[6:], b'|RESP|abc|zyx|OK|czY6Zm9vYmFy')
 
+    def test_route_broadcasts(self):
+        rrep = Broadcast.ROUTE('RREP', b'b>c>abc', b'zyx', [b'id00', [b'c', b'b']])
+        self.assertEqual((rrep.destination, rrep.next_hop), (b'abc', b'b'))
+        self.assertEqual((self.req.destination, self.req.next_hop), (b'abc', b'abc'))
+
+        with self.assertRaises(ValueError):
+            rrep.encode('0.1')
+
+        parsed = Broadcast.from_plain_broadcast_bytes(rrep.encode('0.2'), lambda payload, to, frm: payload)
+        self.assertEqual((parsed.kind, parsed.to, parsed.frm), ('RREP', b'b>c>abc', b'zyx'))
+        self.assertEqual(parsed.payload.resp_annc_obj, [b'id00', [b'c', b'b']])
+
+    def test_broadcast_parsing(self):
+        decrypted = []
+        def decrypter(payload, to, frm):
+            decrypted.append(payload)
+            return payload # base64 decoded by the broadcast
+
+        for b in (self.req, self.annc, self.resp):
+            parsed = Broadcast.from_plain_broadcast_bytes(b.encode('0.1'), decrypter)
+
+            self.assertEqual((parsed.kind, parsed.to, parsed.frm, parsed.resp_code),
+                             (b.kind, b.to, b.frm, b.resp_code))
+            self.assertEqual(parsed.nonce, b.nonce)
+            self.assertEqual(decrypted, []) # header only, payload untouched
+
+            self.assertEqual(parsed.payload.raw_bytes, b.payload.raw_bytes)
+            self.assertEqual(len(decrypted), 1)
+            parsed.payload.raw_bytes
+            self.assertEqual(len(decrypted), 1) # only decrypted once
+            decrypted.clear()
+
+        self.assertRaises(ExceptionWithResponse, Broadcast.from_plain_broadcast_bytes,
+                          b'\x00\x01nonc|ANNC|*|abc|czY6|extra', decrypter)
+
+    def test_broadcast_v02(self):
+        self.req.annc_result = b'#room'
+        self.assertEqual(self.req.encode('0.2')[6:],
+                         b'\x81\x00\x03\x03\x05\x00\x0aabczyx#room^turnOn()n')
+        self.assertEqual(self.resp.encode('0.2')[6:13], b'\x83\x0b\x03\x03\x00\x00\x09')
+
+        self.req.b64_payload = True # raw unless asked
+        self.assertEqual(self.req.encode('0.2')[6:],
+                         b'\x01\x00\x03\x03\x05\x00\x10abczyx#roomXnR1cm5Pbigpbg==')
+        self.assertTrue(Broadcast.from_plain_broadcast_bytes(self.req.encode('0.2'), None).b64_payload)
+        self.req.b64_payload = None
+
+        self.annc.b64_payload = False
+        self.assertRaises(ValueError, self.annc.encode, '0.1')
+        self.annc.b64_payload = None
+
+        self.resp.reply_to = b'nonc'
+        self.assertEqual(Broadcast.from_plain_broadcast_bytes(self.resp.encode('0.2'), None).reply_to, b'nonc')
+        self.assertIsNone(Broadcast.from_plain_broadcast_bytes(self.req.encode('0.2'), None).reply_to)
+
+        # '|' in a raw payload is just another byte
+        pipes = Broadcast.ANNC(b'abc', raw_payload=b's3:|||')
+        parsed = Broadcast.from_plain_broadcast_bytes(pipes.encode('0.2'), lambda p, to, frm: p)
+        self.assertEqual((parsed.b64_payload, parsed.payload.resp_annc_obj), (False, '|||'))
+
+        for b in (self.req, self.annc, self.resp):
+            v01_len = len(b.encode('0.1'))
+            plain = b.encode('0.2')
+            self.assertLess(len(plain), v01_len)
+
+            self.assertEqual(Broadcast.header_fields(b'sig' + plain, 3)[:3],
+                             (b.kind.encode(), b.to, b.frm))
+
+            parsed = Broadcast.from_plain_broadcast_bytes(plain, lambda p, to, frm: p)
+            self.assertEqual((parsed.kind, parsed.to, parsed.frm, parsed.resp_code, parsed.annc_result),
+                             (b.kind, b.to, b.frm, b.resp_code, b.annc_result))
+            self.assertEqual(parsed.nonce, b.nonce)
+            self.assertEqual(parsed.payload.raw_bytes, b.payload.raw_bytes)
+
+            for bad in (plain[:-1], plain + b'x', plain[:10]):
+                self.assertRaises(ExceptionWithResponse, Broadcast.from_plain_broadcast_bytes, bad, None)
+
+        self.assertRaises(ExceptionWithResponse, Broadcast.from_plain_broadcast_bytes,
+                          b'\x00\x09' + plain[2:], None)
+        self.assertRaises(ValueError, Broadcast.ANNC(b'abc', to=b'*' * 256).encode, '0.2')
+
     def test_group_helper_functions(self):
         """Tests for checking the `to` for general, secure groups or all(*)."""
 
@@ -296,11 +1203,19 @@ class BroadcastTests(unittest.TestCase):
         self.assertEqual(r.payload.request_actions, {'zargact': [], 'unargact': [42], 'severlargact': ['bar', 4.2]})
         self.assertEqual(r.payload.request_prop_names, ['fooprop', 'somerandplaceprop'])
 
+        # arguments are read by the decoder, so may hold the bounding characters
+        r = Broadcast.REQ(b'abc', b'zyx', raw_payload=b'^say(s5:(a,b)z2:)|),last')
+        self.assertEqual(r.payload.request_actions, {'say': ['(a,b)', b')|']})
+        self.assertEqual(r.payload.request_prop_names, ['last'])
+
     def test_parse_error_resp_raise(self):
 
         req = Broadcast.REQ(b'abc', b'zyx', raw_payload=b'^turnOn)')
         self.assertRaises(ExceptionWithResponse, req.payload.to_requested_things)
 
+        req = Broadcast.REQ(b'abc', b'zyx', raw_payload=b'^turnOn(i1;')
+        self.assertRaises(ExceptionWithResponse, req.payload.to_requested_things)
+
         annc = Broadcast.ANNC(b'abc', b'zyx', raw_payload=b'di42;')
         self.assertRaises(DecodingError, lambda : annc.payload.resp_annc_obj)
 
@@ -328,6 +1243,61 @@ class EncodingTests(unittest.TestCase):
         self.assertEqual(encode({'a':1,'b':2}), b'ds1:ai1;s1:bi2;;')
         self.assertEqual(encode({'a':{'c':[{'d':99}]},'b':'o'}), b'ds1:ads1:clds1:di99;;;;s1:bs1:o;')
 
+        self.assertEqual(encode(42, force_type='I'), b'I42;')
+        self.assertRaises(EncodingError, encode, (1, 2))
+
+    def test_encode_into(self):
+        buf = bytearray(b'l')
+        for elem in [1, 'two', [3.0]]:
+            encode_into(elem, buf)
+        buf += b';'
+
+        self.assertEqual(buf, encode([1, 'two', [3.0]]))
+        self.assertEqual(decode(bytes(buf)), [1, 'two', [3.0]])
+
+    def test_node_encoding_cache(self):
+        n = BaseNode()
+        p = n.add_property(Property('level', types.int, 1))
+        n.add_property(Property('name', types.string, 'lamp'))
+        n.add_action(Action('toggle', None, [], types.null))
+
+        first = encode(n)
+        self.assertEqual(encode(n), first)
+        self.assertIsNotNone(p._encoded)
+
+        p.value = 2
+        self.assertEqual(encode(n), first.replace(b'i1;', b'i2;'))
+
+        p.meta = {'unit': '%'}
+        self.assertIn(b'|i2;|ds4:units1:%;;', encode(n))
+
+        n.add_action(Action('reset', None, [], types.null))
+        self.assertIn(b'^toggle()n;^reset()n;|', encode(n))
+
+        # changed in place: cached until told
+        n.actions['reset'].action_parameters.append(ActionParameter('hard', types.bool))
+        self.assertIn(b'^reset()n;|', encode(n))
+        n.actions_changed()
+        self.assertIn(b'^reset($hard|b|d;;)n;|', encode(n))
+
+        n.node_info = {'nick': 'lamp'}
+        self.assertIn(b'nicks4:lamp', encode(n))
+        n.node_info['nick'] = 'light'
+        n.node_info_changed()
+        self.assertIn(b'nicks5:light', encode(n))
+
+        self.assertEqual(encode(decode(encode(n))), encode(n))
+
+        node = Node()
+        node.crypto.create_dual_keys()
+        first = encode(node)
+        cached = node._encoded_node_info
+        self.assertEqual(encode(node), first)
+        self.assertIs(node._encoded_node_info, cached) # not encoded again
+        node.join_group('*lamps') # node_info filled in again, so encoded again
+        self.assertIn(b'*lamps', encode(node))
+        self.assertNotIn(b'*lamps', first)
+
     def test_encodings_mesh_structures(self):
         a1 = Action('turnOn', lambda:_, None,types.null)
 
@@ -456,6 +1426,146 @@ class EncodingTests(unittest.TestCase):
         deep_dict_str = b'ds1:V' * 201 + b'i42;' + b';' * 201
         self.assertRaises(RecursionError, decode, (deep_dict_str))
 
+        # at the limit is fine, and not limited by the python stack
+        at_limit = decode(b'l' * 200 + b'i42;' + b';' * 200)
+        for _ in range(199): at_limit = at_limit[0]
+        self.assertEqual(at_limit, [42])
+
+    def test_decode_round_trip(self):
+        p = Property('temp', types.float, 21.5)
+        p.meta = {'desc': 'temperature', 'unit': 'c', 'min': -40, 'max': 125}
+
+        a = Action('setLevel', None, [ActionParameter('level', types.int)], types.int)
+
+        n = BaseNode()
+        n.add_property(p)
+        n.add_property(Property('empty', types.list, []))
+        n.add_action(a)
+        n.node_info = {'addr': b'abc', 'capabilities': ['ip'], 'nil': None, 'k': {}}
+
+        encoded = encode(n)
+        self.assertEqual(encode(decode(encoded)), encoded)
+
+        self.assertEqual(decode(encode(a)).return_type, types.int)
+
+        self.assertEqual(decode(b'ds1:ai12345;i7;s0:;'), {'a': 12345, 7: ''})
+
+        # property names are checked as `BaseConstruct` checks them
+        self.assertRaises(DecodingError, decode, b'p;|f|f21.5;;')
+
+    def test_lazy_dict(self):
+        obj = {'temp': 21.5, 'dump': b'\x00' * 5000, 'list': [1, [2, {}], 'x'], 'nil': None, 'on': True}
+        encoded = encode(obj)
+
+        lazy = decode_lazy(encoded)
+        self.assertIsInstance(lazy, LazyDict)
+        self.assertEqual(len(lazy), 5)
+        self.assertIn('dump', lazy)
+        self.assertEqual(lazy['list'], [1, [2, {}], 'x'])
+        self.assertNotIn('dump', lazy._values) # never accessed, never decoded
+        self.assertEqual(lazy, obj)
+        self.assertEqual(encode(lazy), encoded)
+        self.assertRaises(KeyError, lambda: lazy['missing'])
+
+        self.assertEqual(decode_lazy(b'li1;;'), [1])
+
+        for bad in [b'd', b'ds1:a;', b'ds1:as5:ab;', b'dli1;;i1;;']:
+            self.assertRaises(DecodingError, decode_lazy, bad)
+
+        # value errors are found when the value is accessed
+        lazy = decode_lazy(b'ds1:ai1x;;')
+        self.assertRaises(DecodingError, lambda: lazy['a'])
+
+    def test_zero_copy_decode(self):
+        blob = bytes(range(256)) * 40
+        data = encode({'fw': blob, 'parts': [b'ab', b''], 'name': 'x'})
+
+        obj = decode(data, zero_copy=True)
+        self.assertIsInstance(obj['fw'], memoryview)
+        self.assertIs(obj['fw'].obj, data) # a view of, not a copy from, the input
+        self.assertEqual(obj['fw'], blob)
+        self.assertEqual([bytes(p) for p in obj['parts']], [b'ab', b''])
+        self.assertEqual(obj['name'], 'x')
+
+        # encodes straight back out, as do bytearrays
+        self.assertEqual(encode(obj), data)
+        self.assertEqual(encode(bytearray(b'ab')), b'z2:ab')
+
+        self.assertEqual(decode(bytearray(data), zero_copy=True)['fw'], blob)
+        self.assertRaises(TypeError, decode, bytearray(data))
+
+    def test_string_table(self):
+        n = BaseNode()
+        for name in ('temp', 'humidity', 'pressure'):
+            p = n.add_property(Property(name, types.float, 1.5))
+            p.meta = {'desc': 'a sensor reading', 'unit': 'si'}
+        n.node_info = {'desc': 'a sensor reading'}
+
+        plain = encode(n)
+        with_refs = encode(n, refs=True)
+        self.assertTrue(with_refs.startswith(b'R'))
+        self.assertLess(len(with_refs), len(plain))
+        self.assertEqual(encode(decode(with_refs)), plain)
+
+        self.assertEqual(encode(['ab', 'ab', 'abc', {'abc': 'abc'}], refs=True),
+                         b'Rls2:abs2:abS3:abcdr0;r0;;;')
+        self.assertEqual(decode(b'Rls2:abS3:abcr0;;'), ['ab', 'abc', 'abc'])
+
+        # references only within a table, and to strings already defined
+        for bad in [b'S3:abc', b'r0;', b'Rr0;', b'RlS3:abcr1;;', b'Rr-1;', b'lRi1;;']:
+            self.assertRaises(DecodingError, decode, bad)
+
+    def test_stream_decoder(self):
+        n = BaseNode()
+        n.add_property(Property('unit', types.string, 'c'))
+        n.properties['unit'].meta = {'desc': 'unit', 'max': 1000}
+        n.add_property(Property('temp', types.float, 21.5))
+        n.add_action(Action('setLevel', None, [ActionParameter('level', types.int)], types.int))
+        n.node_info = {'addr': b'abc'}
+
+        objs = [{'a': [1, 2.5, None, True, 'x' * 300, b'\x00' * 20]}, 12, n, 'end']
+        data = b''.join(encode(o) for o in objs)
+
+        for chunk_size in (1, 7, len(data)):
+            decoder = StreamDecoder()
+            out = []
+            for i in range(0, len(data), chunk_size):
+                decoder.feed(data[i:i+chunk_size])
+                out.extend(decoder)
+
+            self.assertEqual([encode(o) for o in out], [encode(o) for o in objs])
+            self.assertFalse(decoder.in_object)
+
+        decoder = StreamDecoder()
+        decoder.feed(data[:-1])
+        self.assertEqual(len(list(decoder)), 3)
+        self.assertTrue(decoder.in_object)
+
+        decoder = StreamDecoder()
+        decoder.feed(b'li1;x')
+        with self.assertRaises(DecodingError): list(decoder)
+
+        # numbers (and references, names) without an end aren't waited on forever
+        for start in (b'i', b'f1.', b'Rlr', b'p'):
+            decoder = StreamDecoder()
+            decoder.feed(start)
+            with self.assertRaises(DecodingError):
+                for _ in range(10000):
+                    decoder.feed(b'1' * 100)
+                    list(decoder)
+
+        # a wrong closing byte fails at once, even as the last byte fed
+        node_data = encode(n)
+        self.assertTrue(node_data.endswith(b'>'))
+        for corrupt in (node_data[:-1] + b';', node_data.replace(b'd;;|', b'd;>|', 1)):
+            decoder = StreamDecoder()
+            with self.assertRaises(DecodingError):
+                for byte in corrupt:
+                    decoder.feed(bytes([byte]))
+                    list(decoder)
+            with self.assertRaises(DecodingError):
+                decode(corrupt)
+
 
 if __name__ == '__main__':
     unittest.main()
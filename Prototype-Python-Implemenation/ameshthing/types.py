@@ -25,6 +25,12 @@ types = types(
     # type_T('uint16', 'Hu')
 )
 
+# Lookup tables, so a type is found without scanning `types`: by its repr
+# ('s'), or by its tag, the repr's byte value (115) as codecs read it.
+types_by_repr = {t.repr: t for t in types}
+types_by_tag = {ord(t.repr): t for t in types}
+
+
 
 
 
@@ -0,0 +1,140 @@
+"""
+Simulates floods (ANNCs to '*') through a mesh of radio nodes, comparing
+every node relaying (blind flooding) with gossip (see `GossipFlooding`):
+the delivery ratio against the transmissions each flood needs.
+
+    python3 gossip_flood_sim.py [radio range (0.06)] [reception loss (0)] [nodes (1000)]
+
+The nodes are placed at random in a unit square, in reach of each other
+within the radio range. Every transmission is heard by the nodes in reach
+(unless lost) after a random backoff of up to `JITTER` seconds; two heard
+by a node within `AIRTIME` of each other collide, and both are lost.
+Time is simulated, the nodes' timers run on it.
+"""
+
+import sys
+import heapq
+import random
+import time
+
+from ameshthing.node import Node
+from ameshthing.broadcast import Broadcast
+from ameshthing.dispatch import TimerWheel
+from ameshthing.routing import GossipFlooding
+
+
+AIRTIME = 0.002 # seconds a reception takes
+JITTER = 0.01 # the most a transmission is delayed (medium access backoff)
+FLOODS = 10 # per mode, from random nodes
+
+
+class SimulatedWheel(TimerWheel):
+    running = True # advanced by the simulation, not a loop
+
+
+class Mesh():
+
+    def __init__(self, n, radio_range, loss, seed=1):
+        self.rng = random.Random(seed)
+        self.loss = loss
+
+        pos = [(self.rng.random(), self.rng.random()) for _ in range(n)]
+        self.reach = [[j for j in range(n) if j != i and
+                       (pos[i][0] - pos[j][0])**2 + (pos[i][1] - pos[j][1])**2 < radio_range**2]
+                      for i in range(n)]
+
+        self.now = 0.0
+        self.wheel = SimulatedWheel(tick=0.001, slots=4096, clock=lambda: self.now)
+        self._events = [] # (time, count, callback)
+        self._count = 0
+
+        self.transmissions = 0
+        self._receiving = [[] for _ in range(n)] # [start, data, not collided], at each node
+
+        self.nodes = [Node() for _ in range(n)]
+        for i, node in enumerate(self.nodes):
+            node.crypto.create_dual_keys()
+            node.crypto.set_network_key(b'test' * 8)
+            node.hop_limit = 40
+            node.do_transmission = self._transmitter(i)
+            for j in self.reach[i]: # as if heard from in route advertisements
+                node.neighbours.heard(b'%i' % j)
+
+    @property
+    def mean_neighbours(self):
+        return sum(map(len, self.reach)) / len(self.reach)
+
+    def _at(self, when, callback):
+        self._count += 1
+        heapq.heappush(self._events, (when, self._count, callback))
+
+    def _transmitter(self, i):
+        def do_transmission(data, to):
+            self.transmissions += 1
+            start = self.now + self.rng.random() * JITTER
+            for j in self.reach[i]:
+                if self.rng.random() >= self.loss:
+                    self._at(start, lambda j=j, data=bytes(data), start=start: self._receive(j, data, start))
+        return do_transmission
+
+    def _receive(self, j, data, start):
+        receiving = self._receiving[j]
+        receiving[:] = [r for r in receiving if r[0] > start - AIRTIME]
+
+        reception = [start, data, True]
+        for other in receiving: # (all overlap)
+            other[2] = reception[2] = False
+        receiving.append(reception)
+
+        self._at(start + AIRTIME, lambda: reception[2] and self.nodes[j].transmission_received_callback(data))
+
+    def run(self):
+        while self._events or len(self.wheel):
+            if self._events:
+                when, _, callback = heapq.heappop(self._events)
+            else: # only timers left
+                when, callback = self.now + self.wheel.tick, None
+
+            self.wheel.advance(when)
+            self.now = when
+            if callback is not None:
+                callback()
+
+    def flood(self, mode, gossiping, floods=FLOODS, **gossip):
+        for node in self.nodes:
+            node.gossiping = gossiping
+            node.gossip = GossipFlooding(self.wheel, rand=self.rng.random, **gossip)
+
+        self.transmissions = 0
+        delivered = 0
+        started = time.perf_counter()
+
+        for f in range(floods):
+            src = self.rng.choice(self.nodes)
+            for node in self.nodes:
+                node.cached_nodes[src.network_addr] = src
+
+            annc = Broadcast.ANNC(src.network_addr, raw_payload=b'flood %i' % f)
+            src.do_transmission(src.make_transmittable_broadcast(annc).data, b'*')
+            self.run()
+
+            seen_id = (src.network_addr, annc.nonce)
+            delivered += sum(seen_id in node.seen_broadcasts for node in self.nodes)
+
+        print('%-30s delivered %5.1f%%  transmissions/flood %6.1f  (%.1fs)' % (mode,
+              100 * delivered / (floods * len(self.nodes)), self.transmissions / floods,
+              time.perf_counter() - started))
+
+
+if __name__ == '__main__':
+    radio_range = float(sys.argv[1]) if len(sys.argv) > 1 else 0.06
+    loss = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    n = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+
+    mesh = Mesh(n, radio_range, loss)
+    print('%i nodes, %.1f neighbours on average, %.0f%% reception loss' % (n, mesh.mean_neighbours, loss * 100))
+
+    mesh.flood('blind flooding', False)
+    mesh.flood('counter, k=3', True, threshold=3, fanout=len(mesh.nodes))
+    mesh.flood('gossip, k=3, fanout 4', True, threshold=3, fanout=4)
+    mesh.flood('gossip, k=2, fanout 4', True, threshold=2, fanout=4)
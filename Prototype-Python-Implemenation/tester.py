@@ -89,12 +89,12 @@ def user_in_fake(data):
 l.cached_nodes[b'user'] = user
 
 
-l.joined_secure_groups[b'#abc'] = b'\x55' * 32 #test key
+l.join_group(b'#abc', b'\x55' * 32) #test key
 
-l.joined_groups.add(b'*abc')
+l.join_group(b'*abc')
 
 b = Broadcast.REQ(b'*abc', b'user')
-b.payload.request_actions['^setState'] = [True, 'foo']
+b.payload.request_actions['setState'] = [True, 'foo']
 
 fake_data = b.encode(version_str='0.1')
 
@@ -116,7 +116,7 @@ l.fake_process_plain_broadcast(fake_data)
 
 print('\n--')
 
-l.joined_secure_groups[b'#abc'] = b'\x55' * 32 #test key
+l.join_group(b'#abc', b'\x55' * 32) #test key
 
 b = Broadcast.RESP(b'#abc', b'user', b'OK')
 b.payload.raw_bytes = b's3:bar'